@@ -0,0 +1,111 @@
+"""
+Admission control for `/compute_embedding`: one bounded queue per model.
+
+A request is admitted if fewer than `concurrency + depth` requests are pending for its model, otherwise it is
+rejected right away (429 with a Retry-After hint). Admitted requests wait for one of the `concurrency` slots
+until their deadline, and are dropped (504) if the deadline passed before inference starts.
+"""
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+# Weight of the last request in the moving average of the inference latency
+LATENCY_EMA_WEIGHT = 0.1
+
+
+class AdmissionError(Exception):
+    """
+    A request that is not served: `status_code` is the HTTP status, `retry_after` the hint in seconds, if any.
+    """
+
+    def __init__(self, status_code: int, message: str, retry_after: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ModelQueue:
+    def __init__(self, concurrency: int, depth: int):
+        self.concurrency = concurrency
+        self.depth = depth
+        self.pending = 0  # admitted requests, waiting or running
+        self.rejected = 0
+        self.expired = 0
+        self.latency_s = None  # moving average of the inference latency
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> int:
+        """
+        Seconds until the pending requests are likely drained.
+        """
+        return max(1, math.ceil(self.pending / self.concurrency * (self.latency_s or 1.0)))
+
+    def _record_latency(self, latency_s: float):
+        with self._lock:
+            if self.latency_s is None:
+                self.latency_s = latency_s
+            else:
+                self.latency_s += LATENCY_EMA_WEIGHT * (latency_s - self.latency_s)
+
+    @contextmanager
+    def admit(self, deadline: float):
+        """
+        Hold a slot of the model while the block runs. `deadline` is a time.monotonic() timestamp.
+        Raises AdmissionError if the queue is full or the deadline passes before a slot is free.
+        """
+        with self._lock:
+            if self.pending >= self.concurrency + self.depth:
+                self.rejected += 1
+                raise AdmissionError(429, "Too many pending requests for this model", self.retry_after())
+            self.pending += 1
+        try:
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                with self._lock:
+                    self.expired += 1
+                raise AdmissionError(504, "Deadline exceeded while waiting in the queue")
+            try:
+                start = time.monotonic()
+                yield
+                self._record_latency(time.monotonic() - start)
+            finally:
+                self._slots.release()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": self.pending,
+                "concurrency": self.concurrency,
+                "depth": self.depth,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "latency_ms": None if self.latency_s is None else round(self.latency_s * 1000, 1),
+            }
+
+
+class AdmissionController:
+    """
+    The queues of all models, created on first use.
+    """
+
+    def __init__(self, concurrency: int, depth: int):
+        self.concurrency = concurrency
+        self.depth = depth
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def queue(self, model_name: str) -> ModelQueue:
+        with self._lock:
+            if model_name not in self._queues:
+                self._queues[model_name] = ModelQueue(self.concurrency, self.depth)
+            return self._queues[model_name]
+
+    def stats(self) -> dict:
+        with self._lock:
+            queues = dict(self._queues)
+        return {model_name: queue.stats() for model_name, queue in queues.items()}
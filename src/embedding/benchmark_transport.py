@@ -0,0 +1,91 @@
+"""
+Per-request overhead of the transports of the embedding server, for small payloads (the live path sends one
+sentence): HTTP with a JSON response, HTTP with a binary response, and the Unix socket (see local_transport.py).
+
+Requests are sent one at a time over a kept-alive connection; the sentences are unique, so that nothing is
+served from the coalescing of concurrent requests. The inference time is the same for all transports: the
+differences between them are transport overhead. With --model-free, the Unix socket server is started here with
+a handler that does no inference, to measure the raw transport cost.
+
+Usage, with the server running with EMBED_UDS_PATH=/tmp/embedding.sock:
+    python src/embedding/benchmark_transport.py --model LaBSE --uds-path /tmp/embedding.sock
+"""
+
+import time
+import argparse
+
+import numpy as np
+import requests
+
+from local_transport import UnixSocketTransport, serve_unix_socket
+
+
+def _percentiles(latencies: list[float]) -> dict:
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+    }
+
+
+def benchmark(send, num_requests: int, num_sentences: int, warmup: int = 20) -> dict:
+    latencies = []
+    for i in range(warmup + num_requests):
+        sentences = [f"Hello, I would like to know the status of my order {i}.{j}" for j in range(num_sentences)]
+        start = time.perf_counter()
+        send(sentences)
+        if i >= warmup:
+            latencies.append(time.perf_counter() - start)
+    return _percentiles(latencies)
+
+
+def http_sender(url: str, model_name: str, binary: bool):
+    session = requests.Session()
+    headers = {"Accept": "application/octet-stream"} if binary else {}
+
+    def send(sentences):
+        response = session.post(
+            f"{url}/compute_embedding", json={"sentences": sentences, "model_name": model_name}, headers=headers
+        )
+        response.raise_for_status()
+        if binary:
+            return np.frombuffer(response.content, dtype="<f4")
+        return np.asarray(response.json(), dtype=np.float32)
+
+    return send
+
+
+def uds_sender(uds_path: str, model_name: str):
+    transport = UnixSocketTransport(uds_path)
+    return lambda sentences: transport.embed(sentences, model_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="LaBSE")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--uds-path", default="/tmp/embedding.sock")
+    parser.add_argument("--num-requests", type=int, default=1000)
+    parser.add_argument("--num-sentences", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--model-free", action="store_true", help="Only the Unix socket, without inference")
+    args = parser.parse_args()
+
+    if args.model_free:
+        serve_unix_socket(args.uds_path, lambda model_name, sentences, max_tokens: np.zeros((len(sentences), 1024)))
+        senders = {"uds (no inference)": uds_sender(args.uds_path, args.model)}
+    else:
+        senders = {
+            "http json": http_sender(args.url, args.model, binary=False),
+            "http binary": http_sender(args.url, args.model, binary=True),
+            "uds": uds_sender(args.uds_path, args.model),
+        }
+    print(f"{'transport':<20} {'sentences':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for num_sentences in args.num_sentences:
+        for name, send in senders.items():
+            result = benchmark(send, args.num_requests, num_sentences)
+            print(
+                f"{name:<20} {num_sentences:>9} {result['mean_ms']:>9} {result['p50_ms']:>9}"
+                f" {result['p95_ms']:>9} {result['p99_ms']:>9}"
+            )
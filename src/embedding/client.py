@@ -0,0 +1,223 @@
+"""
+Client of the embedding server (server_embedding.py).
+
+    client = EmbeddingClient("http://127.0.0.1:5000", model_name="LaBSE")
+    embeddings = client.embed(["Hello world!", "Bonjour"])  # float32 array, one row per sentence
+    embeddings = await client.aembed(["Hello world!"])      # same, from asyncio code
+    client = EmbeddingClient("unix:/run/embedding.sock")    # same host: Unix socket (see local_transport.py)
+
+- one keep-alive connection pool, shared by all threads (and the asyncio interface, which runs in threads)
+- big sentence lists are deduplicated and split into chunks sent concurrently
+- binary responses (raw float32 rows) when the server supports them, JSON otherwise
+- 429/503 responses are retried after their Retry-After hint
+- optional in-memory LRU cache and on-disk cache (SQLite) of the embeddings
+"""
+
+import time
+import sqlite3
+import asyncio
+import threading
+import concurrent.futures
+from pathlib import Path
+from collections import OrderedDict
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from compact import decode_compact
+from local_transport import LocalTransportError, UnixSocketTransport
+
+DEFAULT_URL = "http://127.0.0.1:5000"
+CHUNK_SIZE = 64  # sentences per request
+MAX_WORKERS = 8  # concurrent requests per call
+POOL_SIZE = 16  # keep-alive connections
+MAX_RETRIES = 3  # on 429/503
+TIMEOUT = 30  # seconds
+
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU cache of embeddings in memory, optionally backed by a SQLite file shared across processes.
+    """
+
+    def __init__(self, max_size: int = 100_000, cache_dir: str | None = None):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if cache_dir is not None:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(Path(cache_dir) / "embeddings.sqlite", check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB)")
+            self._db.commit()
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+            missing = [key for key in keys if key not in found]
+            if self._db is not None and missing:
+                for i in range(0, len(missing), 500):  # SQLite limits the number of parameters
+                    batch = missing[i : i + 500]
+                    rows = self._db.execute(
+                        f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                    )
+                    for key, blob in rows:
+                        found[key] = self._put(key, np.frombuffer(blob, dtype=np.float32))
+        return found
+
+    def put_many(self, items: dict[str, np.ndarray]):
+        with self._lock:
+            for key, embedding in items.items():
+                self._put(key, embedding)
+            if self._db is not None and items:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                    [(key, np.asarray(e, dtype=np.float32).tobytes()) for key, e in items.items()],
+                )
+                self._db.commit()
+
+    def _put(self, key: str, embedding: np.ndarray) -> np.ndarray:
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return embedding
+
+
+class EmbeddingError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+
+
+class EmbeddingClient:
+    def __init__(
+        self,
+        url: str = DEFAULT_URL,
+        model_name: str | None = None,
+        chunk_size: int = CHUNK_SIZE,
+        max_workers: int = MAX_WORKERS,
+        pool_size: int = POOL_SIZE,
+        timeout: float = TIMEOUT,
+        max_retries: int = MAX_RETRIES,
+        binary: bool = True,
+        cache: EmbeddingCache | None = None,
+    ):
+        self.url = url.rstrip("/")
+        self.model_name = model_name
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.binary = binary
+        self.cache = cache
+        self.transport = UnixSocketTransport(url[len("unix:") :]) if url.startswith("unix:") else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embed")
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+        if self.transport is not None:
+            self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _post_local(self, payload: dict) -> np.ndarray:
+        if payload.get("dimension") is not None:
+            raise ValueError("dimension is not supported on the Unix socket transport")
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.transport.embed(payload["sentences"], payload["model_name"], payload.get("max_tokens"))
+            except LocalTransportError as e:
+                if e.status_code in (429, 503) and attempt < self.max_retries:
+                    time.sleep(e.retry_after or 1)
+                    continue
+                raise EmbeddingError(e.status_code, str(e))
+
+    def _post(self, payload: dict) -> np.ndarray:
+        if self.transport is not None:
+            return self._post_local(payload)
+        headers = {"Accept": "application/octet-stream"} if self.binary else {}
+        for attempt in range(self.max_retries + 1):
+            response = self.session.post(
+                f"{self.url}/compute_embedding", json=payload, headers=headers, timeout=self.timeout
+            )
+            if response.status_code in (429, 503) and attempt < self.max_retries:
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+                continue
+            if response.status_code != 200:
+                raise EmbeddingError(response.status_code, response.text)
+            if response.headers.get("Content-Type", "").startswith("application/octet-stream"):
+                n, dimension = map(int, response.headers["X-Embedding-Shape"].split(","))
+                dtype = "<f2" if response.headers.get("X-Embedding-Dtype") == "float16" else "<f4"
+                return np.frombuffer(response.content, dtype=dtype).reshape(n, dimension).astype(np.float32)
+            # Server without binary responses: rows, or a compact payload with "dimension" (see compact.py)
+            embeddings = response.json()
+            if isinstance(embeddings, dict):
+                return decode_compact(embeddings, dequantize=True)
+            return np.asarray(embeddings, dtype=np.float32)
+
+    def embed(
+        self,
+        sentences: list[str],
+        model_name: str | None = None,
+        max_tokens: int | None = None,
+        dimension: int | None = None,
+    ) -> np.ndarray:
+        """
+        Embeddings of the sentences, as a float32 array with one row per sentence.
+        """
+        model_name = model_name or self.model_name
+        if model_name is None:
+            raise ValueError("No model_name given")
+        if not sentences:
+            return np.empty((0, 0), dtype=np.float32)
+
+        prefix = f"{model_name}\x00{max_tokens}\x00{dimension}\x00"
+        unique_sentences = list(dict.fromkeys(sentences))
+        embeddings = self.cache.get_many([prefix + s for s in unique_sentences]) if self.cache else {}
+        embeddings = {key[len(prefix) :]: embedding for key, embedding in embeddings.items()}
+
+        missing = [s for s in unique_sentences if s not in embeddings]
+        payload = {"model_name": model_name}
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+        if dimension is not None:
+            payload["dimension"] = dimension
+        chunks = [missing[i : i + self.chunk_size] for i in range(0, len(missing), self.chunk_size)]
+        futures = [self._executor.submit(self._post, {**payload, "sentences": chunk}) for chunk in chunks]
+        computed = {}
+        for chunk, future in zip(chunks, futures):
+            computed.update(zip(chunk, future.result()))
+        if self.cache and computed:
+            self.cache.put_many({prefix + s: embedding for s, embedding in computed.items()})
+        embeddings.update(computed)
+
+        out = np.empty((len(sentences), len(embeddings[sentences[0]])), dtype=np.float32)
+        for i, sentence in enumerate(sentences):
+            out[i] = embeddings[sentence]
+        return out
+
+    async def aembed(
+        self,
+        sentences: list[str],
+        model_name: str | None = None,
+        max_tokens: int | None = None,
+        dimension: int | None = None,
+    ) -> np.ndarray:
+        """
+        `embed` for asyncio code: runs in a worker thread, so that the event loop is not blocked.
+        """
+        return await asyncio.to_thread(self.embed, sentences, model_name, max_tokens, dimension)
@@ -0,0 +1,97 @@
+"""
+Compact embedding formats for `/compute_embedding` responses.
+
+- dimension: Matryoshka-style truncation to the first `dimension` components, renormalized to unit length.
+- precision:
+    - "float32": full precision (default)
+    - "float16": half precision, 2x smaller
+    - "int8": symmetric scalar quantization, 4x smaller, one float32 scale per vector (x ≈ q * scale)
+    - "binary": sign bits packed into bytes (1 if x > 0), 32x smaller
+
+Compact payloads are JSON objects holding the raw bytes in base64:
+    {"precision": "int8", "shape": [n, dim], "data": "<base64>", "scale": [...]}
+"""
+
+import base64
+
+import numpy as np
+
+PRECISIONS = ("float32", "float16", "int8", "binary")
+
+
+def truncate_dimension(embeddings: np.ndarray, dimension: int) -> np.ndarray:
+    """
+    Keep the first `dimension` components of each embedding and renormalize it to unit length.
+    """
+    if not 0 < dimension <= embeddings.shape[1]:
+        raise ValueError(f"dimension must be in [1, {embeddings.shape[1]}], got {dimension}")
+    truncated = embeddings[:, :dimension].astype(np.float32, copy=True)
+    truncated /= np.clip(np.linalg.norm(truncated, axis=1, keepdims=True), 1e-12, None)
+    return truncated
+
+
+def quantize_int8(embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per-vector int8 quantization.
+    Return:
+        quantized: int8 array of the same shape
+        scale: float32 array, one scale per vector
+    """
+    scale = np.abs(embeddings).max(axis=1) / 127
+    scale[scale == 0] = 1
+    quantized = np.clip(np.rint(embeddings / scale[:, None]), -127, 127).astype(np.int8)
+    return quantized, scale.astype(np.float32)
+
+
+def pack_binary(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Sign bits of each embedding, packed 8 per byte (big-endian bit order, last byte zero-padded).
+    """
+    return np.packbits(embeddings > 0, axis=1)
+
+
+def encode_compact(embeddings: np.ndarray, dimension: int | None = None, precision: str = "float32") -> dict:
+    """
+    Truncate and quantize embeddings into a compact JSON payload.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {PRECISIONS}, got {precision}")
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dimension is not None:
+        embeddings = truncate_dimension(embeddings, dimension)
+
+    payload = {"precision": precision, "shape": list(embeddings.shape)}
+    if precision == "float32":
+        data = embeddings
+    elif precision == "float16":
+        data = embeddings.astype(np.float16)
+    elif precision == "int8":
+        data, scale = quantize_int8(embeddings)
+        payload["scale"] = scale.tolist()
+    else:
+        data = pack_binary(embeddings)
+    payload["data"] = base64.b64encode(np.ascontiguousarray(data).tobytes()).decode("ascii")
+    return payload
+
+
+def decode_compact(payload: dict, dequantize: bool = False) -> np.ndarray:
+    """
+    Decode a compact payload into its raw array: float32, float16, int8, or packed uint8 bits for "binary".
+    With `dequantize`, int8 vectors are multiplied back by their scale and binary ones mapped to -1/+1 float32.
+    """
+    n, dimension = payload["shape"]
+    data = base64.b64decode(payload["data"])
+    precision = payload["precision"]
+    if precision == "binary":
+        packed = np.frombuffer(data, dtype=np.uint8).reshape(n, -1)
+        if not dequantize:
+            return packed
+        bits = np.unpackbits(packed, axis=1, count=dimension)
+        return bits.astype(np.float32) * 2 - 1
+    dtype = {"float32": np.float32, "float16": np.float16, "int8": np.int8}[precision]
+    embeddings = np.frombuffer(data, dtype=dtype).reshape(n, dimension)
+    if not dequantize:
+        return embeddings
+    if precision == "int8":
+        return embeddings.astype(np.float32) * np.asarray(payload["scale"], dtype=np.float32)[:, None]
+    return embeddings.astype(np.float32)
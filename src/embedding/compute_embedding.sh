@@ -14,4 +14,53 @@ curl 127.0.0.1:5000/compute_embedding      -X POST     -d '{"model_name": "UAE-L
 curl 0.0.0.0:5000/compute_embedding      -X POST     -d '{"model_name": "SBERT-bert-base-spanish-wwm-uncased", "sentences":["What is Deep Learning?"]}'     -H 'Content-Type: application/json'
 curl 0.0.0.0:5000/compute_embedding      -X POST     -d '{"model_name": "LaBSE", "sentences":["What is Deep Learning?"]}'     -H 'Content-Type: application/json'
 curl 0.0.0.0:5000/compute_embedding      -X POST     -d '{"model_name": "sentence-camembert-large", "sentences":["What is Deep Learning?"]}'     -H 'Content-Type: application/json'
-curl 0.0.0.0:5000/compute_embedding      -X POST     -d '{"model_name": "sentence-camembert-large", "sentences":["What is Deep Learning?", "Hello", "What'\''s your name?", "Nice to meet you.", "I see."]}'     -H 'Content-Type: application/json'
\ No newline at end of file
+curl 0.0.0.0:5000/compute_embedding      -X POST     -d '{"model_name": "sentence-camembert-large", "sentences":["What is Deep Learning?", "Hello", "What'\''s your name?", "Nice to meet you.", "I see."]}'     -H 'Content-Type: application/json'
+
+# compact embeddings: Matryoshka truncation + int8 / binary quantization
+curl 0.0.0.0:5000/compute_embedding      -X POST     -d '{"model_name": "LaBSE", "sentences":["What is Deep Learning?", "Hello"], "dimension": 256, "precision": "int8"}'     -H 'Content-Type: application/json'
+curl 0.0.0.0:5000/compute_embedding      -X POST     -d '{"model_name": "LaBSE", "sentences":["What is Deep Learning?", "Hello"], "precision": "binary"}'     -H 'Content-Type: application/json'
+
+# per-request token truncation + truncation statistics
+curl 0.0.0.0:5000/compute_embedding      -X POST     -d '{"model_name": "LaBSE", "sentences":["What is Deep Learning?"], "max_tokens": 64}'     -H 'Content-Type: application/json'
+curl 0.0.0.0:5000/truncation_stats
+
+# Readiness: 200 once every model is loaded, with the loading state of each model
+curl http://127.0.0.1:5000/ready
+
+# Liveness: 200 as long as the process is up
+curl http://127.0.0.1:5000/live
+
+# Per-request deadline: 504 if inference has not started within 500 ms, 429 + Retry-After if the model queue is full
+curl -v -X POST http://127.0.0.1:5000/compute_embedding -H "Content-Type: application/json" -d '{"sentences": ["Hello world!"], "model_name": "LaBSE", "timeout_ms": 500}'
+
+# Serve the TEI models in process instead of the TEI containers (no embed_start.sh, no nginx hop)
+# EMBED_TEI_BACKEND=inprocess python src/embedding/server_embedding.py
+
+# Reload the model registry (model_registry.json) now; it is also reloaded when the file changes
+curl -X POST http://127.0.0.1:5000/admin/reload
+
+# Binary response: raw float32 rows, shape in the X-Embedding-Shape header
+curl -s -D - -o embeddings.bin -X POST http://127.0.0.1:5000/compute_embedding -H "Content-Type: application/json" -H "Accept: application/octet-stream" -d '{"sentences": ["Hello world!"], "model_name": "LaBSE"}'
+
+# Peak memory per request, with EMBED_TRACK_MEMORY=1
+curl http://127.0.0.1:5000/memory_stats
+
+# Unix socket transport for callers on the same host (see local_transport.py and client.py):
+# EMBED_UDS_PATH=/tmp/embedding.sock python src/embedding/server_embedding.py
+# python src/embedding/benchmark_transport.py --model LaBSE --uds-path /tmp/embedding.sock
+
+# Several models in one request, computed in parallel, response keyed by model
+curl -X POST http://127.0.0.1:5000/compute_embedding -H "Content-Type: application/json" -d '{"sentences": ["Hello world!"], "model_name": ["LaBSE", "UAE-Large-V1", "sentence-camembert-large"]}'
+
+# Profile for 30 s: Python stack samples of the whole process (tokenization vs forward pass vs serialization)
+curl -X POST http://127.0.0.1:5000/admin/profile -H "Content-Type: application/json" -d '{"kind": "stack", "duration_s": 30}'
+# ... or torch profiler traces of 5% of the LaBSE requests (ONNX models: "kind": "onnxruntime")
+curl -X POST http://127.0.0.1:5000/admin/profile -H "Content-Type: application/json" -d '{"kind": "torch", "model_name": "LaBSE", "sample_rate": 0.05, "duration_s": 60}'
+# Status and trace files, then download one (traces are written under EMBED_PROFILES_DIR, default profiles/)
+curl http://127.0.0.1:5000/admin/profile
+curl -O http://127.0.0.1:5000/admin/profile/<id>/stacks.folded
+
+# Capture 1% of the requests (shape and timing; add EMBED_CAPTURE_TEXTS=1 for the texts), then replay them
+# EMBED_CAPTURE_PATH=captures/traffic.jsonl EMBED_CAPTURE_RATE=0.01 python src/embedding/server_embedding.py
+# python src/embedding/replay_traffic.py --capture captures/traffic.jsonl --speed 2 --output replay_report.json
+# python src/embedding/replay_traffic.py --capture captures/traffic.jsonl --max-rate --concurrency 16
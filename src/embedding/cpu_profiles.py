@@ -0,0 +1,144 @@
+"""
+CPU execution profiles: how many threads each model uses and on which cores it runs.
+
+- "latency" mode: one wide session, all the threads of the profile work on each request.
+- "throughput" mode: `sessions` narrow sessions serving requests in parallel, `intra_op_threads` each.
+
+Profiles are read from CPU_PROFILES_PATH ({model_name: profile}), written by tune_cpu_profiles.py. Models without
+a profile share the available cores evenly, without pinning.
+
+Torch intra-op thread counts are set per inference thread (OpenMP teams are per calling thread), ONNX Runtime ones
+per session through `ort_session_options`. torch has a single inter-op pool per process, which can only be sized
+once, before any torch work: `configure_torch_interop_threads` sizes it for all the torch models at startup.
+"""
+
+import os
+import sys
+import json
+import queue
+import concurrent.futures
+from pathlib import Path
+from typing import Literal
+
+from pydantic import BaseModel
+
+CPU_PROFILES_PATH = os.environ.get("EMBED_CPU_PROFILES", "cpu_profiles.json")
+
+
+class CPUProfile(BaseModel):
+    mode: Literal["latency", "throughput"] = "latency"
+    intra_op_threads: int = 1
+    inter_op_threads: int = 1
+    cores: list[int] | None = None  # None: no pinning
+    sessions: int = 1  # only used in "throughput" mode
+
+    @property
+    def num_sessions(self) -> int:
+        return self.sessions if self.mode == "throughput" else 1
+
+
+def available_cores() -> list[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def default_cpu_profile(num_models: int) -> CPUProfile:
+    return CPUProfile(intra_op_threads=max(1, len(available_cores()) // max(1, num_models)))
+
+
+def load_cpu_profiles(path: str = CPU_PROFILES_PATH) -> dict[str, CPUProfile]:
+    if not os.path.exists(path):
+        return {}
+    profiles = json.loads(Path(path).read_text(encoding="utf-8"))
+    return {model_name: CPUProfile(**profile) for model_name, profile in profiles.items()}
+
+
+def save_cpu_profiles(profiles: dict[str, CPUProfile], path: str = CPU_PROFILES_PATH):
+    Path(path).write_text(
+        json.dumps({model_name: profile.model_dump() for model_name, profile in profiles.items()}, indent=2),
+        encoding="utf-8",
+    )
+
+
+def ort_session_options(profile: CPUProfile):
+    """
+    ONNX Runtime session options of one session of the profile.
+    """
+    import onnxruntime as ort
+
+    session_options = ort.SessionOptions()
+    session_options.intra_op_num_threads = profile.intra_op_threads
+    session_options.inter_op_num_threads = profile.inter_op_threads
+    if profile.inter_op_threads > 1:
+        session_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    if profile.cores:
+        # Do not let the ONNX Runtime threads spin on cores that other models use
+        session_options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    return session_options
+
+
+def configure_inference_thread(profile: CPUProfile):
+    """
+    Pin the calling thread (and the threads it spawns) to the cores of the profile, and size its torch pool.
+    The torch inter-op pool is process-wide, see `configure_torch_interop_threads`.
+    """
+    if profile.cores:
+        os.sched_setaffinity(0, profile.cores)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(profile.intra_op_threads)
+
+
+def configure_torch_interop_threads(profiles: list[CPUProfile]) -> int | None:
+    """
+    Size the process-wide torch inter-op pool for the widest of the profiles of the torch models. Call it before
+    any torch work: torch cannot resize the pool later (e.g. for a model added by a registry reload).
+    Return:
+        num_threads: the size of the pool, None if it was not set
+    """
+    if not profiles:
+        return None
+    import torch
+
+    num_threads = max(profile.inter_op_threads for profile in profiles)
+    try:
+        torch.set_num_interop_threads(num_threads)
+    except RuntimeError as e:  # already set, or inter-op work already started
+        print(f"*** WARNING: Could not set the torch inter-op threads to {num_threads}: {e}")
+        return None
+    return num_threads
+
+
+class ModelRunner:
+    """
+    Runs the inference of a model on its own threads, one per session, each holding one replica of the model.
+    """
+
+    def __init__(self, model_name: str, replicas: list, profile: CPUProfile):
+        self.profile = profile
+        self._replicas = queue.SimpleQueue()
+        for replica in replicas:
+            self._replicas.put(replica)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(replicas),
+            thread_name_prefix=f"infer_{model_name}",
+            initializer=configure_inference_thread,
+            initargs=(profile,),
+        )
+
+    def _call(self, fn):
+        replica = self._replicas.get()
+        try:
+            return fn(replica)
+        finally:
+            self._replicas.put(replica)
+
+    def run(self, fn):
+        """
+        Call `fn(replica)` on a free session of the model and return its result.
+        """
+        return self._executor.submit(self._call, fn).result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -94,6 +94,10 @@ EOL
 
 for model_name in "${models[@]}"; do
     cat <<EOL >> $NGINX_CONF
+    # Exact match: the prefix location below would forward /${model_name}/health as //health
+    location = /${model_name}/health {
+        proxy_pass http://${PREFIX}${model_name}/health;
+    }
     location /${model_name} {
         proxy_pass http://${PREFIX}${model_name}/;
     }
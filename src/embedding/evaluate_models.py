@@ -0,0 +1,240 @@
+"""
+Offline evaluation of embedding models for user prompt matching: accuracy and speed.
+
+For each candidate model, every user text and `up` candidate of the labelled matchings is embedded (once per
+unique text, in large batches, cached on disk), candidates are ranked by cosine distance to the user text, and
+the rank of the labelled conv path gives top-1/top-k accuracy per language. Next to it, encode throughput
+(large batches), latency (single-sentence requests, as on the live path) and model memory are measured.
+
+Labels are read from an `outputs/` subtree of the dataset (see README), e.g. `outputs/prod` or
+`outputs/<prompt_id>`. Matchings whose label has no conv_path_id ("no match") are not scored.
+
+Models are given by name (see MODEL_NAMES), or `<model_name>@<onnx_file>` for an ONNX variant of a
+"huggingface" model, e.g. `gte-large-en-v1.5@model_quantized.onnx`.
+
+Usage (from the repository root, so that model_zoo/ resolves):
+    python src/embedding/evaluate_models.py <dataset_dir> --labels prod --models LaBSE sentence-camembert-large
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+from collections import defaultdict
+
+import numpy as np
+
+from server_embedding import (
+    BATCH_SIZE,
+    compute_embeddings,
+    get_model_spec,
+    load_model,
+    _load_model_hfonnx,
+    _compute_embeddings_hfonnx,
+    truncate_sentences,
+)
+from recompute_distances import MatchingTexts, embed_texts
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.dataset import iter_matching_files, read_matching, matching_key
+
+TOP_K = (1, 3, 5)
+EMBEDDINGS_CACHE_DIR = "/www/files/up_matching_dataset/embeddings_cache"
+# Number of texts used to measure encode throughput / number of single-sentence requests to measure latency
+THROUGHPUT_SAMPLE_SIZE = 1024
+LATENCY_NUM_REQUESTS = 100
+
+
+def load_labels(labels_dir: str) -> dict[str, str | None]:
+    """
+    Read the labelled outputs: matching key -> labelled conv_path_id (None if no candidate matches).
+    Supports both `prod/<language>/...` and `<prompt_id>/<language>_<model>/...` layouts.
+    """
+    labels = {}
+    for output_path in Path(labels_dir).rglob("*.json"):
+        language_dir, assistant_id, call_id = output_path.relative_to(labels_dir).parts[:3]
+        language = language_dir.split("_")[0]
+        output = json.loads(output_path.read_text(encoding="utf-8"))
+        labels[f"{language}/{assistant_id}/{call_id}/{output_path.stem}"] = output.get("conv_path_id")
+    return labels
+
+
+def load_labelled_matchings(ut_to_conv_path_dir: str, labels: dict[str, str | None]):
+    """
+    Deduplicated texts of the scored matchings, with their language and label position among the candidates.
+    """
+    matching_texts = MatchingTexts()
+    languages, label_positions = [], []
+    for matching_path in iter_matching_files(ut_to_conv_path_dir):
+        matching = read_matching(matching_path)
+        key = matching_key(matching, matching_path)
+        label = labels.get(key)
+        if label is None or label not in matching["candidates"]["conv_path_id"]:
+            continue
+        matching_texts.add(key, matching["user_text"], matching["candidates"]["up"], matching.get("source_node_id"))
+        languages.append(matching["language"])
+        label_positions.append(matching["candidates"]["conv_path_id"].index(label))
+    return matching_texts, languages, label_positions
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+class CandidateModel:
+    """
+    A model under evaluation: loads it and exposes `encode(sentences, model_dict, model_name)`.
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        self.model_dict = {}
+        rss_before = _rss_mb()
+        if "@" in spec:
+            model_name, onnx_filename = spec.split("@", 1)
+            model_spec = get_model_spec(model_name)
+            self.model_dict[spec] = _load_model_hfonnx(
+                model_name,
+                warmup=False,
+                onnx_filename=onnx_filename,
+                pooling=model_spec.pooling if model_spec is not None else "mean",
+            )
+            self.encode = lambda sentences, model_dict, name: _compute_embeddings_hfonnx(
+                truncate_sentences(sentences, model_dict, name)[0], model_dict, name, batch_size=BATCH_SIZE
+            )
+        else:
+            self.model_dict[spec] = load_model(spec, warmup=False)
+            self.encode = compute_embeddings
+        # TEI models run in their own containers, so their memory is not visible here
+        self.memory_mb = _rss_mb() - rss_before
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        return embed_texts(texts, self.model_dict, self.spec, encode=self.encode)
+
+    def embed_cached(self, texts: list[str], cache_dir: str) -> np.ndarray:
+        """
+        Embed texts, reusing the vectors cached for this model and caching the new ones.
+        """
+        cache_path = Path(cache_dir) / self.spec.replace("/", "_")
+        cached_texts, cached_embeddings = [], None
+        if (cache_path / "texts.json").exists():
+            cached_texts = json.loads((cache_path / "texts.json").read_text(encoding="utf-8"))
+            cached_embeddings = np.load(cache_path / "embeddings.npy")
+        row_by_text = {text: i for i, text in enumerate(cached_texts)}
+
+        missing_texts = [text for text in texts if text not in row_by_text]
+        if missing_texts:
+            new_embeddings = self.embed(missing_texts)
+            for text in missing_texts:
+                row_by_text[text] = len(row_by_text)
+            cached_texts += missing_texts
+            cached_embeddings = (
+                new_embeddings if cached_embeddings is None else np.concatenate([cached_embeddings, new_embeddings])
+            )
+            cache_path.mkdir(parents=True, exist_ok=True)
+            np.save(cache_path / "embeddings.npy", cached_embeddings)
+            (cache_path / "texts.json").write_text(json.dumps(cached_texts, ensure_ascii=False), encoding="utf-8")
+        logging.info(f"{self.spec}: {len(texts) - len(missing_texts)}/{len(texts)} embeddings found in cache")
+        return cached_embeddings[[row_by_text[text] for text in texts]]
+
+    def benchmark(self, texts: list[str]) -> dict:
+        """
+        Encode throughput on large batches and latency of single-sentence requests.
+        """
+        sample = texts[:THROUGHPUT_SAMPLE_SIZE]
+        start = time.perf_counter()
+        self.encode(sample, self.model_dict, self.spec)
+        throughput = len(sample) / (time.perf_counter() - start)
+
+        latencies = []
+        for text in texts[:LATENCY_NUM_REQUESTS]:
+            start = time.perf_counter()
+            self.encode([text], self.model_dict, self.spec)
+            latencies.append((time.perf_counter() - start) * 1000)
+        return {
+            "throughput_texts_per_s": round(throughput, 1),
+            "latency_ms_p50": round(float(np.percentile(latencies, 50)), 2),
+            "latency_ms_p95": round(float(np.percentile(latencies, 95)), 2),
+            "memory_mb": round(self.memory_mb, 1),
+        }
+
+
+def score(matching_texts: MatchingTexts, languages: list[str], label_positions: list[int], embeddings: np.ndarray):
+    """
+    Top-k accuracy per language (and "all"): the labelled candidate is among the k closest to the user text.
+    """
+    hits = defaultdict(lambda: np.zeros(len(TOP_K), dtype=np.int64))
+    counts = defaultdict(int)
+    for user_text_id, candidate_ids, language, label_position in zip(
+        matching_texts.user_text_ids, matching_texts.candidate_ids, languages, label_positions
+    ):
+        distances = 1 - embeddings[candidate_ids] @ embeddings[user_text_id]
+        # Rank of the label = number of candidates strictly closer than it
+        rank = int(np.sum(distances < distances[label_position]))
+        for group in (language, "all"):
+            counts[group] += 1
+            hits[group] += [rank < k for k in TOP_K]
+    return {
+        group: {"num_matchings": counts[group]}
+        | {f"top{k}": round(float(hits[group][i] / counts[group]), 4) for i, k in enumerate(TOP_K)}
+        for group in sorted(counts)
+    }
+
+
+def evaluate_models(
+    dataset_dir: str, labels: str, model_specs: list[str], cache_dir: str = EMBEDDINGS_CACHE_DIR
+) -> dict:
+    labels_by_key = load_labels(f"{dataset_dir}/outputs/{labels}")
+    matching_texts, languages, label_positions = load_labelled_matchings(
+        f"{dataset_dir}/inputs/ut_to_conv_path", labels_by_key
+    )
+    logging.info(
+        f"Evaluating on {len(matching_texts.keys)} labelled matchings ({len(matching_texts.texts)} unique texts)."
+    )
+
+    report = {}
+    for spec in model_specs:
+        model = CandidateModel(spec)
+        embeddings = model.embed_cached(matching_texts.texts, cache_dir)
+        report[spec] = {
+            "accuracy": score(matching_texts, languages, label_positions, embeddings),
+            "speed": model.benchmark(matching_texts.texts),
+        }
+        del model  # free the model before loading the next one
+        logging.info(f"{spec}: {json.dumps(report[spec])}")
+    return report
+
+
+def print_report(report: dict):
+    header = f"{'model':<45} {'lang':<5} {'n':>6} " + " ".join(f"{f'top{k}':>6}" for k in TOP_K)
+    header += f" {'texts/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'mem MB':>8}"
+    print(header)
+    for spec, result in report.items():
+        speed = result["speed"]
+        for language, accuracy in result["accuracy"].items():
+            print(
+                f"{spec:<45} {language:<5} {accuracy['num_matchings']:>6} "
+                + " ".join(f"{accuracy[f'top{k}']:>6.3f}" for k in TOP_K)
+                + f" {speed['throughput_texts_per_s']:>9} {speed['latency_ms_p50']:>8}"
+                + f" {speed['latency_ms_p95']:>8} {speed['memory_mb']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset_dir", help="up_matching_dataset directory")
+    parser.add_argument("--labels", default="prod", help="Subdirectory of outputs/ holding the labels")
+    parser.add_argument("--models", nargs="+", required=True)
+    parser.add_argument("--cache-dir", default=EMBEDDINGS_CACHE_DIR)
+    parser.add_argument("--report", default=None, help="Path of the JSON report")
+    args = parser.parse_args()
+
+    report = evaluate_models(args.dataset_dir, args.labels, args.models, args.cache_dir)
+    print_report(report)
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=2), encoding="utf-8")
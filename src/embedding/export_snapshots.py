@@ -0,0 +1,22 @@
+"""
+Export warm-start snapshots of sentence_transformer and TEI models (see export_snapshot in server_embedding.py).
+The server loads model_zoo/<model_name>/snapshot instead of the original checkpoint when it exists.
+Re-run after updating a model in the model zoo.
+
+Usage (from the repository root, so that model_zoo/ resolves):
+    python src/embedding/export_snapshots.py LaBSE sentence-camembert-large
+    python src/embedding/export_snapshots.py --all
+"""
+
+import argparse
+
+from server_embedding import MODEL_NAMES, export_snapshot
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("models", nargs="*")
+    parser.add_argument("--all", action="store_true", help="Export every sentence_transformer and TEI model")
+    args = parser.parse_args()
+
+    for model_name in MODEL_NAMES["sentence_transformer"] + MODEL_NAMES["TEI"] if args.all else args.models:
+        export_snapshot(model_name)
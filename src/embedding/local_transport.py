@@ -0,0 +1,183 @@
+"""
+Unix-domain-socket transport for callers on the same host as the embedding server: no TCP, no HTTP parsing.
+
+Every message is a frame: u32 length of the payload, then the payload. All integers are little-endian.
+A connection carries any number of request/response pairs, one at a time.
+
+Request payload:
+    u16 model name length, model name (utf-8)
+    u32 max_tokens (0: default of the model)
+    u32 number of sentences, then for each sentence: u32 length, sentence (utf-8)
+Response payload:
+    u16 status (HTTP semantics: 200, 404, 429, 503, 504, 500)
+    if 200: u32 n, u32 dim, n * dim float32 (row-major)
+    else:   u16 retry_after in seconds (0: none), error message (utf-8)
+
+Enabled on the server with EMBED_UDS_PATH=/path/to/socket (see server_embedding.py).
+"""
+
+import os
+import struct
+import socket
+import threading
+import socketserver
+
+import numpy as np
+
+MAX_FRAME_SIZE = 256 * 2**20
+
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_SHAPE = struct.Struct("<II")
+
+
+class LocalTransportError(Exception):
+    def __init__(self, status_code: int, message: str, retry_after: int | None = None):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes | None:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            return None
+        received += n
+    return bytes(buffer)
+
+
+def read_frame(sock: socket.socket) -> bytes | None:
+    """
+    Payload of the next frame, None if the peer closed the connection.
+    """
+    header = _recv_exactly(sock, _U32.size)
+    if header is None:
+        return None
+    (size,) = _U32.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {size} bytes exceeds {MAX_FRAME_SIZE}")
+    return _recv_exactly(sock, size) if size else b""
+
+
+def write_frame(sock: socket.socket, *parts: bytes):
+    sock.sendall(b"".join([_U32.pack(sum(len(part) for part in parts)), *parts]))
+
+
+def encode_request(model_name: str, sentences: list[str], max_tokens: int | None = None) -> bytes:
+    model = model_name.encode("utf-8")
+    parts = [_U16.pack(len(model)), model, _U32.pack(max_tokens or 0), _U32.pack(len(sentences))]
+    for sentence in sentences:
+        data = sentence.encode("utf-8")
+        parts += [_U32.pack(len(data)), data]
+    return b"".join(parts)
+
+
+def decode_request(payload: bytes) -> tuple[str, list[str], int | None]:
+    (model_size,) = _U16.unpack_from(payload, 0)
+    offset = _U16.size
+    model_name = payload[offset : offset + model_size].decode("utf-8")
+    offset += model_size
+    max_tokens, num_sentences = struct.unpack_from("<II", payload, offset)
+    offset += 8
+    sentences = []
+    for _ in range(num_sentences):
+        (size,) = _U32.unpack_from(payload, offset)
+        offset += _U32.size
+        sentences.append(payload[offset : offset + size].decode("utf-8"))
+        offset += size
+    return model_name, sentences, max_tokens or None
+
+
+def encode_response(embeddings: np.ndarray) -> list[bytes]:
+    """
+    Parts of a 200 response: the float32 rows are sent from the array buffer.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="<f4")
+    return [_U16.pack(200), _SHAPE.pack(*embeddings.shape), memoryview(embeddings).cast("B")]
+
+
+def encode_error(status_code: int, message: str, retry_after: int | None = None) -> list[bytes]:
+    return [_U16.pack(status_code), _U16.pack(retry_after or 0), message.encode("utf-8")]
+
+
+def decode_response(payload: bytes) -> np.ndarray:
+    """
+    Embedding matrix of a response; raises LocalTransportError for an error response.
+    """
+    (status_code,) = _U16.unpack_from(payload, 0)
+    if status_code != 200:
+        (retry_after,) = _U16.unpack_from(payload, _U16.size)
+        raise LocalTransportError(status_code, payload[2 * _U16.size :].decode("utf-8"), retry_after or None)
+    n, dimension = _SHAPE.unpack_from(payload, _U16.size)
+    return np.frombuffer(payload, dtype="<f4", count=n * dimension, offset=_U16.size + _SHAPE.size).reshape(
+        n, dimension
+    )
+
+
+def serve_unix_socket(path: str, handle) -> socketserver.ThreadingUnixStreamServer:
+    """
+    Serve requests on a Unix socket in a background thread, one thread per connection.
+    `handle(model_name, sentences, max_tokens)` returns the embeddings, or raises an exception with a
+    `status_code` (and optionally `retry_after`) attribute.
+    """
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            while True:
+                payload = read_frame(self.request)
+                if payload is None:
+                    return
+                try:
+                    response = encode_response(handle(*decode_request(payload)))
+                except Exception as e:
+                    status_code = getattr(e, "status_code", 500)
+                    response = encode_error(status_code, str(e), getattr(e, "retry_after", None))
+                write_frame(self.request, *response)
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="uds_server").start()
+    print(f"Serving embeddings on unix socket {path}")
+    return server
+
+
+class UnixSocketTransport:
+    """
+    Client side: one persistent connection per thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _socket(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = self._local.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+        return sock
+
+    def embed(self, sentences: list[str], model_name: str, max_tokens: int | None = None) -> np.ndarray:
+        sock = self._socket()
+        try:
+            write_frame(sock, encode_request(model_name, sentences, max_tokens))
+            payload = read_frame(sock)
+        except OSError:
+            self.close()
+            raise
+        if payload is None:
+            self.close()
+            raise ConnectionError(f"Connection to {self.path} closed by the server")
+        return decode_response(payload)
+
+    def close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
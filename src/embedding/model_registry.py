@@ -0,0 +1,74 @@
+"""
+Declarative registry of the served models: model_registry.json, {model_name: spec}.
+
+    {
+        "LaBSE": {"backend": "sentence_transformer", "max_tokens": 128},
+        "gte-large-en-v1.5": {"backend": "huggingface", "onnx_file": "model_quantized.onnx", "pooling": "cls"},
+        "UAE-Large-V1": {"backend": "TEI", "tei_backend": "inprocess",
+                         "cpu_profile": {"mode": "throughput", "sessions": 2, "intra_op_threads": 4}}
+    }
+
+Every model of the registry is served. The server reloads it when the file changes, or on POST /admin/reload:
+added and changed models are loaded in the background and swapped in once ready, removed ones are retired.
+"""
+
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from typing import Literal
+
+from pydantic import BaseModel
+
+from cpu_profiles import CPUProfile
+
+MODEL_REGISTRY_PATH = os.environ.get(
+    "EMBED_MODEL_REGISTRY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_registry.json")
+)
+BACKENDS = ("TEI", "sentence_transformer", "huggingface", "pytorch")
+
+
+class ModelSpec(BaseModel):
+    backend: Literal["TEI", "sentence_transformer", "huggingface", "pytorch"]
+    path: str | None = None  # default: <MODEL_ZOO_DIR>/<model_name>
+    onnx_file: str = "model.onnx"  # "huggingface" models only
+    pooling: Literal["mean", "cls"] = "mean"  # "huggingface" models only, the others use their pooling config
+    max_tokens: int = 128
+    batch_size: int = 32
+    cpu_profile: CPUProfile | None = None  # default: cpu_profiles.json
+    tei_backend: Literal["container", "inprocess"] | None = None  # TEI models only, default: EMBED_TEI_BACKEND
+
+
+def load_registry(path: str = MODEL_REGISTRY_PATH) -> dict[str, ModelSpec]:
+    """
+    Read and validate the registry. Raises on an invalid file, so that a bad edit never replaces a good registry.
+    """
+    specs = json.loads(Path(path).read_text(encoding="utf-8"))
+    return {model_name: ModelSpec(**spec) for model_name, spec in specs.items()}
+
+
+def model_names_by_backend(specs: dict[str, ModelSpec]) -> dict[str, list[str]]:
+    return {backend: [name for name, spec in specs.items() if spec.backend == backend] for backend in BACKENDS}
+
+
+def watch_registry(on_change, path: str = MODEL_REGISTRY_PATH, interval: float = 1.0):
+    """
+    Call `on_change()` whenever the modification time of the registry changes. Runs forever: start it in a thread.
+    """
+    last_mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+    while True:
+        time.sleep(interval)
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        if mtime != last_mtime:
+            last_mtime = mtime
+            try:
+                on_change()
+            except Exception as e:
+                print(f"*** ERROR: Failed to reload the model registry {path}: {e}")
+
+
+def start_registry_watcher(on_change, path: str = MODEL_REGISTRY_PATH, interval: float = 1.0) -> threading.Thread:
+    thread = threading.Thread(target=watch_registry, args=(on_change, path, interval), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,203 @@
+"""
+On-demand profiling of the embedding server, started from POST /admin/profile (see server_embedding.py).
+
+Kinds of profiles, all bounded in time (at most MAX_DURATION_S):
+- "stack": samples the Python stacks of all the threads every `interval_ms`, written as folded stacks
+  (<dir>/stacks.folded, one "frame;frame;frame count" line per stack: flamegraph.pl / speedscope input).
+  Shows where the time goes in Python: tokenization, forward pass, serialization.
+- "torch": runs a `sample_rate` fraction of the requests of `model_name` under the torch profiler, one Chrome
+  trace per request (<dir>/<n>_<model_name>.json).
+- "onnxruntime": runs a `sample_rate` fraction of the requests of `model_name` on a copy of the model loaded with
+  ONNX Runtime profiling enabled (ORT profiling can only be enabled when a session is created). ORT writes its
+  Chrome trace in <dir> when the profile stops.
+Profiled requests run in the request thread, outside the model runner and without coalescing. torch does not
+support overlapping profiles: a request sampled while another one is being profiled is served unprofiled.
+
+When no profile runs, the only cost on the request path is checking that the active session is None: the server
+clears it when the profile stops (`on_stop`).
+"""
+
+import os
+import sys
+import time
+import random
+import threading
+from pathlib import Path
+from collections import Counter
+
+PROFILES_DIR = os.environ.get("EMBED_PROFILES_DIR", "profiles")
+KINDS = ("stack", "torch", "onnxruntime")
+MAX_DURATION_S = 300
+
+
+class StackSampler:
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self.counts = Counter()
+        self.num_samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="stack_sampler")
+        self._thread.start()
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.counts[";".join(reversed(stack))] += 1
+            self.num_samples += 1
+
+    def stop(self, path: Path):
+        self._stop.set()
+        self._thread.join()
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfilingSession:
+    def __init__(
+        self,
+        kind: str,
+        model_name: str | None = None,
+        duration_s: float = 30,
+        sample_rate: float = 0.1,
+        interval_ms: float = 5,
+        output_dir: str = PROFILES_DIR,
+        load_profiled_model=None,
+        on_stop=None,
+    ):
+        """
+        `load_profiled_model(model_name, profile_prefix)` loads the ONNX Runtime copy of a model ("onnxruntime").
+        `on_stop(session)` is called once the profile stops, at the end of its duration or on `stop()`.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {KINDS}")
+        if kind != "stack" and model_name is None:
+            raise ValueError(f"model_name is required for {kind} profiles")
+        if not 0 < duration_s <= MAX_DURATION_S:
+            raise ValueError(f"duration_s must be in (0, {MAX_DURATION_S}]")
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate must be in (0, 1]")
+        self.kind = kind
+        self.model_name = model_name
+        self.sample_rate = sample_rate
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}_{kind}"
+        self.dir = Path(output_dir) / self.id
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.started_at = time.time()
+        self.ends_at = time.monotonic() + duration_s
+        self.num_profiled_requests = 0
+        self.stopped = False
+        self._lock = threading.Lock()
+        self._torch_lock = threading.Lock()  # one torch profile at a time
+        self._on_stop = on_stop
+        self._sampler = StackSampler(interval_ms / 1000) if kind == "stack" else None
+        self._profiled_model = None
+        if kind == "onnxruntime":
+            threading.Thread(
+                target=self._load_profiled_model, args=(load_profiled_model,), daemon=True, name="profiled_model"
+            ).start()
+        self._timer = threading.Timer(duration_s, self.stop)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _load_profiled_model(self, load_profiled_model):
+        model = load_profiled_model(self.model_name, str(self.dir / self.model_name))
+        with self._lock:
+            if not self.stopped:
+                self._profiled_model = model
+                return
+        # Stopped while loading
+        session = _ort_session(model)
+        if session is not None:
+            session.end_profiling()
+
+    def wants(self, model_name: str) -> bool:
+        """
+        Whether to profile this request.
+        """
+        if self.stopped or self.kind == "stack" or model_name != self.model_name or time.monotonic() > self.ends_at:
+            return False
+        if self.kind == "onnxruntime" and self._profiled_model is None:
+            return False
+        return random.random() < self.sample_rate
+
+    def profile_request(self, model_dict: dict, compute):
+        """
+        Run `compute(model_dict)` under the profiler: with the served model (torch), or the profiled copy (ORT).
+        Falls back to `compute(model_dict)`, unprofiled, if the profile stopped or another torch profile is running.
+        """
+        if self.kind == "onnxruntime":
+            profiled_model = self._profiled_model
+            if profiled_model is None:  # released by stop()
+                return compute(model_dict)
+            self._next_request_number()
+            return compute({self.model_name: profiled_model})
+
+        if not self._torch_lock.acquire(blocking=False):
+            return compute(model_dict)
+        try:
+            from torch.profiler import ProfilerActivity, profile
+
+            request_number = self._next_request_number()
+            with profile(activities=[ProfilerActivity.CPU], record_shapes=True, with_stack=True) as profiler:
+                result = compute({self.model_name: model_dict[self.model_name]})
+            profiler.export_chrome_trace(str(self.dir / f"{request_number}_{self.model_name}.json"))
+            return result
+        finally:
+            self._torch_lock.release()
+
+    def _next_request_number(self) -> int:
+        with self._lock:
+            self.num_profiled_requests += 1
+            return self.num_profiled_requests
+
+    def stop(self):
+        with self._lock:
+            if self.stopped:
+                return
+            self.stopped = True
+        self._timer.cancel()
+        if self._sampler is not None:
+            self._sampler.stop(self.dir / "stacks.folded")
+        if self._profiled_model is not None:
+            session = _ort_session(self._profiled_model)
+            if session is not None:
+                session.end_profiling()
+            self._profiled_model = None  # frees the copy of the model
+        if self._on_stop is not None:
+            self._on_stop(self)
+
+    def files(self) -> list[str]:
+        return sorted(str(path.relative_to(self.dir.parent)) for path in self.dir.rglob("*") if path.is_file())
+
+    def status(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "model_name": self.model_name,
+            "started_at": self.started_at,
+            "running": not self.stopped,
+            "remaining_s": max(0.0, round(self.ends_at - time.monotonic(), 1)) if not self.stopped else 0.0,
+            "profiled_requests": self.num_profiled_requests,
+            "stack_samples": self._sampler.num_samples if self._sampler is not None else None,
+            "files": self.files(),
+        }
+
+
+def _ort_session(model):
+    """
+    The ONNX Runtime InferenceSession of an HFONNXModel (optimum model or direct onnxruntime wrapper).
+    """
+    for attribute in ("session", "model"):
+        session = getattr(model.model, attribute, None)
+        if hasattr(session, "end_profiling"):
+            return session
+    return None
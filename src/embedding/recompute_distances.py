@@ -0,0 +1,169 @@
+"""
+Recompute the user text / candidate distances of the `ut_to_conv_path` matchings with other embedding models.
+
+Production stores the distance computed at call time in each message. This stage recomputes, offline, the
+cosine distance between the user text and every `up` candidate of every matching, for any model of MODEL_NAMES:
+1. stream the matching files once and deduplicate every user text and candidate `up` text,
+2. embed each unique string once per model, in large batches through `compute_embeddings`,
+3. write one binary sidecar per model:
+    <output_dir>/<model_name>/
+        distances.npy  # float32, the candidate distances of all matchings back to back
+        offsets.npy    # int64, distances of matching i are distances[offsets[i]:offsets[i + 1]]
+        keys.json      # matching keys (<language>/<assistant_id>/<call_id>/<matching_id>), in sidecar order
+
+Usage (from the repository root, so that model_zoo/ resolves):
+    python src/embedding/recompute_distances.py <ut_to_conv_path_dir> <output_dir> --models LaBSE UAE-Large-V1
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from server_embedding import compute_embeddings, load_model
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.dataset import iter_matching_files, read_matching, matching_key
+
+# Number of unique strings sent to `compute_embeddings` at once
+EMBEDDING_CHUNK_SIZE = 4096
+
+
+class MatchingTexts:
+    """
+    Deduplicated texts of a matching dataset: every matching references its texts by index in `texts`.
+    """
+
+    def __init__(self):
+        self.texts = []
+        self._text_ids = {}
+        self.keys = []
+        self.user_text_ids = []
+        self.candidate_ids = []  # one int32 array per matching
+        self._candidate_set_ids = {}  # source_node_id -> int32 array shared by its matchings (normalized datasets)
+
+    def _text_id(self, text: str) -> int:
+        text_id = self._text_ids.get(text)
+        if text_id is None:
+            text_id = self._text_ids[text] = len(self.texts)
+            self.texts.append(text)
+        return text_id
+
+    def add(self, key: str, user_text: str, candidate_texts: list[str], source_node_id: str | None = None):
+        self.keys.append(key)
+        self.user_text_ids.append(self._text_id(user_text or ""))
+        candidate_ids = self._candidate_set_ids.get(source_node_id)
+        if candidate_ids is None:
+            candidate_ids = np.fromiter(
+                (self._text_id(t) for t in candidate_texts), dtype=np.int32, count=len(candidate_texts)
+            )
+            if source_node_id is not None:
+                self._candidate_set_ids[source_node_id] = candidate_ids
+        self.candidate_ids.append(candidate_ids)
+
+    @classmethod
+    def from_dataset(cls, ut_to_conv_path_dir: str) -> "MatchingTexts":
+        matching_texts = cls()
+        for matching_path in iter_matching_files(ut_to_conv_path_dir):
+            matching = read_matching(matching_path)
+            matching_texts.add(
+                matching_key(matching, matching_path),
+                matching["user_text"],
+                matching["candidates"]["up"],
+                matching.get("source_node_id"),
+            )
+        return matching_texts
+
+
+def embed_texts(
+    texts: list[str],
+    model_dict: dict,
+    model_name: str,
+    chunk_size: int = EMBEDDING_CHUNK_SIZE,
+    encode=compute_embeddings,
+) -> np.ndarray:
+    """
+    Embed unique texts in large chunks and return the L2-normalized float32 embedding matrix.
+    `encode(sentences, model_dict, model_name)` defaults to `compute_embeddings`.
+    """
+    embeddings = None
+    for i in range(0, len(texts), chunk_size):
+        chunk = np.asarray(encode(texts[i : i + chunk_size], model_dict, model_name), dtype=np.float32)
+        if embeddings is None:
+            embeddings = np.empty((len(texts), chunk.shape[1]), dtype=np.float32)
+        embeddings[i : i + len(chunk)] = chunk
+        logging.info(f"{model_name}: embedded {i + len(chunk)}/{len(texts)} unique texts")
+    if embeddings is None:
+        return np.empty((0, 0), dtype=np.float32)
+    embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+    return embeddings
+
+
+def compute_distances(matching_texts: MatchingTexts, embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Cosine distances between the user text and the candidates of every matching.
+    Return:
+        distances: float32 array of all candidate distances back to back
+        offsets: int64 array of size num_matchings + 1
+    """
+    offsets = np.zeros(len(matching_texts.keys) + 1, dtype=np.int64)
+    np.cumsum([len(ids) for ids in matching_texts.candidate_ids], out=offsets[1:])
+    distances = np.empty(offsets[-1], dtype=np.float32)
+    for i, (user_text_id, candidate_ids) in enumerate(
+        zip(matching_texts.user_text_ids, matching_texts.candidate_ids)
+    ):
+        distances[offsets[i] : offsets[i + 1]] = 1 - embeddings[candidate_ids] @ embeddings[user_text_id]
+    return distances, offsets
+
+
+def save_distances(output_dir: str, model_name: str, keys: list[str], distances: np.ndarray, offsets: np.ndarray):
+    model_dir = Path(output_dir) / model_name
+    model_dir.mkdir(parents=True, exist_ok=True)
+    np.save(model_dir / "distances.npy", distances)
+    np.save(model_dir / "offsets.npy", offsets)
+    (model_dir / "keys.json").write_text(json.dumps(keys), encoding="utf-8")
+
+
+def load_distances(output_dir: str, model_name: str) -> dict[str, np.ndarray]:
+    """
+    Load the sidecar of a model: matching key -> candidate distances (memory-mapped, in candidates["up"] order).
+    """
+    model_dir = Path(output_dir) / model_name
+    distances = np.load(model_dir / "distances.npy", mmap_mode="r")
+    offsets = np.load(model_dir / "offsets.npy")
+    keys = json.loads((model_dir / "keys.json").read_text(encoding="utf-8"))
+    return {key: distances[offsets[i] : offsets[i + 1]] for i, key in enumerate(keys)}
+
+
+def recompute_distances(ut_to_conv_path_dir: str, output_dir: str, model_names: list[str]):
+    start = time.time()
+    matching_texts = MatchingTexts.from_dataset(ut_to_conv_path_dir)
+    logging.info(
+        f"Read {len(matching_texts.keys)} matchings with {len(matching_texts.texts)} unique texts "
+        f"in {time.time() - start:.2f} seconds."
+    )
+
+    model_dict = {}
+    for model_name in model_names:
+        model_start = time.time()
+        model_dict[model_name] = load_model(model_name, warmup=False)
+        embeddings = embed_texts(matching_texts.texts, model_dict, model_name)
+        distances, offsets = compute_distances(matching_texts, embeddings)
+        save_distances(output_dir, model_name, matching_texts.keys, distances, offsets)
+        del model_dict[model_name], embeddings  # free the model before loading the next one
+        logging.info(f"{model_name}: distances saved in {time.time() - model_start:.2f} seconds.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ut_to_conv_path_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--models", nargs="+", required=True)
+    args = parser.parse_args()
+
+    recompute_distances(args.ut_to_conv_path_dir, args.output_dir, args.models)
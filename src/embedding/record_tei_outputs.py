@@ -0,0 +1,60 @@
+"""
+Record the embeddings returned by the TEI containers, to check the in-process TEI backend against them
+(see test/test_tei_equivalence.py).
+
+Sentences are sent as is (no truncation on our side), one recording per model:
+    <output_dir>/<model_name>.json  # {"model_name": ..., "sentences": [...], "embeddings": [[...], ...]}
+
+Usage, with the TEI containers up (embed_start.sh):
+    python src/embedding/record_tei_outputs.py --output-dir /www/files/test/tei_recordings
+"""
+
+import json
+import argparse
+from pathlib import Path
+
+import requests
+
+from server_embedding import MODEL_NAMES, TEI_URL
+
+TEI_RECORDINGS_DIR = "/www/files/test/tei_recordings"
+
+DEFAULT_SENTENCES = [
+    "Hello world!",
+    "Yes, that's right.",
+    "Sí, claro, dígame.",
+    "Oui, je voudrais parler à un conseiller s'il vous plaît.",
+    "query: what are your opening hours?",
+    "passage: We are open from 9am to 6pm, Monday to Friday.",
+    "Instruct: Given a user utterance in a phone call, retrieve the matching user prompt\nQuery: I want to cancel",
+    "I received a letter about an unpaid invoice but I already paid it last month by bank transfer, "
+    "so I don't understand why I am being asked to pay again and I would like someone to check it.",
+]
+
+
+def record_tei_outputs(model_name: str, sentences: list[str], output_dir: str) -> Path:
+    response = requests.post(f"{TEI_URL}/{model_name}", json={"inputs": sentences})
+    response.raise_for_status()
+    recording_path = Path(output_dir) / f"{model_name}.json"
+    recording_path.parent.mkdir(parents=True, exist_ok=True)
+    recording_path.write_text(
+        json.dumps({"model_name": model_name, "sentences": sentences, "embeddings": response.json()}),
+        encoding="utf-8",
+    )
+    print(f"Recorded {len(sentences)} embeddings of {model_name} to {recording_path}")
+    return recording_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=MODEL_NAMES["TEI"])
+    parser.add_argument("--sentences", default=None, help="Text file with one sentence per line")
+    parser.add_argument("--output-dir", default=TEI_RECORDINGS_DIR)
+    args = parser.parse_args()
+
+    sentences = DEFAULT_SENTENCES
+    if args.sentences:
+        with open(args.sentences, encoding="utf-8") as f:
+            sentences = [line.rstrip("\n") for line in f if line.strip()]
+    for model_name in args.models:
+        record_tei_outputs(model_name, sentences, args.output_dir)
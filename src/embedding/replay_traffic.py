@@ -0,0 +1,172 @@
+"""
+Replay captured traffic (see traffic_capture.py) against an embedding server, and report the latency percentiles
+and errors, overall and per model: a realistic load test for batching, caching or scheduling changes.
+
+Rates:
+- original (default): requests are sent at their captured arrival times, whatever the responses (open loop)
+- scaled: --speed 2 sends them twice as fast, --speed 0.5 twice as slow
+- max: --max-rate sends them back to back from --concurrency clients (closed loop)
+
+Captures without texts are replayed with synthetic texts of the captured lengths, unique per request so that
+the server caches and the coalescing of concurrent requests do not serve them.
+
+Usage:
+    python src/embedding/replay_traffic.py --capture capture.jsonl --url http://127.0.0.1:5000 --speed 2
+    python src/embedding/replay_traffic.py --capture capture.jsonl --max-rate --concurrency 16 --output report.json
+"""
+
+import json
+import time
+import argparse
+import threading
+import concurrent.futures
+from collections import Counter, defaultdict
+
+import numpy as np
+import requests
+
+from traffic_capture import load_capture
+
+WORDS = "the order of my account was shipped yesterday but I have not received any tracking number yet".split()
+
+
+def synthetic_sentence(length: int, seed: int) -> str:
+    """
+    Text of `length` characters, different for every seed.
+    """
+    words = [str(seed)]
+    while len(" ".join(words)) < length:
+        words.append(WORDS[(seed + len(words)) % len(WORDS)])
+    return " ".join(words)[: max(length, len(str(seed)))]
+
+
+def build_request(entry: dict, index: int) -> tuple[dict, dict]:
+    """
+    JSON body and headers replaying a captured request.
+    """
+    sentences = entry.get("sentences") or [
+        synthetic_sentence(length, index * 1000 + i) for i, length in enumerate(entry["text_lengths"])
+    ]
+    payload = {"sentences": sentences, "model_name": entry["model_name"]}
+    for field in ("max_tokens", "dimension", "precision", "timeout_ms"):
+        if entry.get(field) is not None:
+            payload[field] = entry[field]
+    headers = {"Accept": "application/octet-stream"} if entry.get("format") == "binary" else {}
+    return payload, headers
+
+
+class Replayer:
+    def __init__(self, url: str, timeout: float = 60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        if getattr(self._local, "session", None) is None:
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def send(self, entry: dict, index: int) -> dict:
+        payload, headers = build_request(entry, index)
+        start = time.perf_counter()
+        try:
+            response = self._session().post(
+                f"{self.url}/compute_embedding", json=payload, headers=headers, timeout=self.timeout
+            )
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        model_name = entry["model_name"]
+        return {
+            "model_name": ",".join(model_name) if isinstance(model_name, list) else model_name,
+            "status": status,
+            "latency": time.perf_counter() - start,
+            "captured_latency_ms": entry.get("latency_ms"),
+        }
+
+
+def replay_timed(replayer: Replayer, entries: list[dict], speed: float, max_workers: int) -> list[dict]:
+    """
+    Open loop: send every request at its captured offset divided by `speed`.
+    """
+    start = time.monotonic()
+    first_ts = entries[0]["ts"]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for index, entry in enumerate(entries):
+            delay = start + (entry["ts"] - first_ts) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(replayer.send, entry, index))
+        return [future.result() for future in futures]
+
+
+def replay_max_rate(replayer: Replayer, entries: list[dict], concurrency: int) -> list[dict]:
+    """
+    Closed loop: `concurrency` clients send the requests back to back.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(replayer.send, entries, range(len(entries))))
+
+
+def _summary(results: list[dict], duration: float) -> dict:
+    latencies_ms = np.asarray([r["latency"] for r in results if r["status"] == 200]) * 1000
+    captured_ms = [r["captured_latency_ms"] for r in results if r["captured_latency_ms"] is not None]
+    summary = {
+        "requests": len(results),
+        "rate_per_s": round(len(results) / duration, 2) if duration > 0 else None,
+        "errors": dict(Counter(str(r["status"]) for r in results if r["status"] != 200)),
+        "captured_p50_ms": round(float(np.percentile(captured_ms, 50)), 3) if captured_ms else None,
+    }
+    if len(latencies_ms):
+        summary.update(
+            {
+                "mean_ms": round(float(latencies_ms.mean()), 3),
+                "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+                "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+                "max_ms": round(float(latencies_ms.max()), 3),
+            }
+        )
+    return summary
+
+
+def report(results: list[dict], duration: float) -> dict:
+    by_model = defaultdict(list)
+    for result in results:
+        by_model[result["model_name"]].append(result)
+    return {
+        "duration_s": round(duration, 3),
+        "overall": _summary(results, duration),
+        "models": {model_name: _summary(model_results, duration) for model_name, model_results in by_model.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--capture", required=True, help="JSONL file written with EMBED_CAPTURE_PATH")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay rate, relative to the captured one")
+    parser.add_argument("--max-rate", action="store_true", help="Send back to back from --concurrency clients")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients with --max-rate")
+    parser.add_argument("--max-workers", type=int, default=128, help="Requests in flight at the captured rate")
+    parser.add_argument("--limit", type=int, default=None, help="Replay only the first N requests")
+    parser.add_argument("--output", default=None, help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    entries = load_capture(args.capture)[: args.limit]
+    if not entries:
+        raise SystemExit(f"No requests in {args.capture}")
+    replayer = Replayer(args.url)
+    mode = f"max rate, {args.concurrency} clients" if args.max_rate else f"speed x{args.speed}"
+    print(f"Replaying {len(entries)} requests against {args.url} ({mode})")
+    start = time.monotonic()
+    if args.max_rate:
+        results = replay_max_rate(replayer, entries, args.concurrency)
+    else:
+        results = replay_timed(replayer, entries, args.speed, args.max_workers)
+    result = report(results, time.monotonic() - start)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
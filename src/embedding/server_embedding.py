@@ -1,6 +1,40 @@
 """
 curl -v -X POST http://127.0.0.1:5000/compute_embedding -H "Content-Type: application/json" -d '{"sentences": ["Hello world!"], "model_name": "gte-large-en-v1.5"}'
 
+Optional request fields for compact embeddings (see compact.py):
+    "dimension": truncate to the first N components and renormalize (Matryoshka)
+    "precision": "float32", "float16", "int8" (with per-vector scale) or "binary" (packed sign bits)
+Optional request field to override the per-model truncation (max_tokens of the model registry):
+    "max_tokens": keep only the last N tokens of each sentence
+Optional binary response, with "format": "binary" or the header "Accept: application/octet-stream":
+    the raw little-endian rows of the embedding matrix, shape in the X-Embedding-Shape header ("n,dim") and dtype
+    in X-Embedding-Dtype ("float32", or "float16" with "precision": "float16"). "dimension" also applies.
+Several models at once: "model_name": ["LaBSE", "UAE-Large-V1"] computes them in parallel, the response is keyed
+by model: {"LaBSE": [...], "UAE-Large-V1": [...]} (JSON and compact formats only).
+Optional request field to override the deadline (see DEFAULT_TIMEOUT_MS):
+    "timeout_ms": the request is dropped (504) if inference has not started within this time
+
+Requests go through a bounded queue per model (see admission.py): 429 with Retry-After when it is full.
+Requests for a model that is not loaded start loading it in the background and get a 503 with Retry-After.
+/live tells that the process is up, /ready that every model is loaded.
+
+With EMBED_UDS_PATH set, embeddings are also served on that Unix socket (see local_transport.py), for callers on
+the same host: same models, queues and deadlines, without TCP and HTTP.
+
+With EMBED_CAPTURE_PATH set, a sample of the requests (shape and timing, optionally the texts) is written to that
+JSONL file (see traffic_capture.py), to be replayed with replay_traffic.py.
+
+The served models are declared in model_registry.json (see model_registry.py). They are loaded in the background
+at startup, /ready tells when they are all served (see model_status). The registry is reloaded when it changes
+or on POST /admin/reload, without interrupting the models that did not change.
+
+Profiling (see profiling.py), for a bounded window:
+    curl -X POST http://127.0.0.1:5000/admin/profile -H "Content-Type: application/json" \\
+        -d '{"kind": "stack", "duration_s": 30}'     # or "torch" / "onnxruntime" with "model_name", "sample_rate"
+    curl http://127.0.0.1:5000/admin/profile                                # status and trace files
+    curl -O http://127.0.0.1:5000/admin/profile/<id>/stacks.folded          # download a trace
+
+torch, onnxruntime, optimum and sentence_transformers are only imported by the backends that need them.
 """
 
 import os
@@ -9,20 +43,33 @@ import time
 import numpy as np
 import json
 
-# import threading
+import threading
+import concurrent.futures
 import logging
-import torch
-import onnxruntime as ort
+import tracemalloc
+from functools import lru_cache
 
 # import intel_extension_for_pytorch as ipex
-from sentence_transformers import SentenceTransformer
-from flask import Flask, request, jsonify
-from optimum.onnxruntime import ORTModelForFeatureExtraction
-from transformers import AutoTokenizer
+from flask import Flask, Response, request, jsonify, send_from_directory
 
 import subprocess
 import requests
 
+from compact import PRECISIONS, encode_compact, truncate_dimension
+from admission import AdmissionController, AdmissionError
+from local_transport import serve_unix_socket
+from cpu_profiles import (
+    CPUProfile,
+    ModelRunner,
+    configure_torch_interop_threads,
+    default_cpu_profile,
+    load_cpu_profiles,
+    ort_session_options,
+)
+from model_registry import MODEL_REGISTRY_PATH, ModelSpec, load_registry, model_names_by_backend, start_registry_watcher
+from profiling import PROFILES_DIR, ProfilingSession
+from traffic_capture import CAPTURE_PATH, TrafficCapture
+
 
 # Configure root logger to handle INFO messages
 # logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -35,62 +82,139 @@ app = Flask(__name__)
 app.logger.setLevel(logging.INFO)
 
 MODEL_ZOO_DIR = "model_zoo"  # Go up one directory from embed/ to access model_zoo/
-# To serve a model, create an empty file with the model name in this directory
-MODEL_NAME_DIR = "loaded_model_names"
-os.makedirs(MODEL_NAME_DIR, exist_ok=True)
-CHECK_INTERVAL = 2  # Check every N seconds for the list of model names
+REGISTRY_CHECK_INTERVAL = 1  # Check every N seconds whether the model registry changed
 
 BATCH_SIZE = 32
 
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-
-MODEL_NAMES = {
-    "TEI": [
-        "multilingual-e5-large-instruct",
-        "UAE-Large-V1",
-    ],
-    "sentence_transformer": [
-        "SBERT-bert-base-spanish-wwm-uncased",
-        "LaBSE",
-        "sentence-camembert-large",  # fr
-    ],
-    "huggingface": [],
-    "pytorch": [],
-}
+# Pre-converted copy of a model (safetensors weights + tokenizer.json), see export_snapshot
+SNAPSHOT_DIR = "snapshot"
+# Number of models loaded at the same time at startup
+LOAD_WORKERS = int(os.environ.get("EMBED_LOAD_WORKERS", 4))
+
+# TEI service URL (port 8080, not 5000 like the Flask server), and how long to wait for it at startup
+TEI_URL = "http://127.0.0.1:8080"
+TEI_STARTUP_TIMEOUT = 600
+# Default backend of the TEI models (see tei_backend in model_registry.py):
+#   "container": TEI Docker containers behind nginx (embed_start.sh)
+#   "inprocess": sentence-transformers in this process, with the pooling of the model config and normalization,
+#                as TEI does (no instruction prefix is added by either: callers send it in the sentences)
+TEI_BACKEND = os.environ.get("EMBED_TEI_BACKEND", "container")
+
+# Admission control, per model: requests running at the same time, requests waiting for a slot
+QUEUE_CONCURRENCY = int(os.environ.get("EMBED_QUEUE_CONCURRENCY", 2))
+QUEUE_DEPTH = int(os.environ.get("EMBED_QUEUE_DEPTH", 32))
+# Time a request may wait before its inference starts
+DEFAULT_TIMEOUT_MS = int(os.environ.get("EMBED_TIMEOUT_MS", 10000))
+# Retry-After hint for the requests of a model being loaded, in seconds
+LOADING_RETRY_AFTER = 5
+
+# Track the peak memory of each request (tracemalloc: Python and numpy allocations, not torch/ONNX Runtime ones).
+# Peaks overlap when requests run concurrently. Served on /memory_stats and in the X-Peak-Memory-MB header
+TRACK_MEMORY = os.environ.get("EMBED_TRACK_MEMORY", "0") == "1"
+BINARY_PRECISIONS = ("float32", "float16")
+
+# Unix socket of the local transport, disabled if not set
+UDS_PATH = os.environ.get("EMBED_UDS_PATH")
+# Threads computing the models of multi-model requests (the local models then run on their own runners)
+FANOUT_WORKERS = 16
+
+# Served models (see model_registry.py): the registry as last read, and the spec each loaded model was loaded
+# with. They differ while a changed model is being reloaded: the previous version keeps serving until the swap.
+model_specs = load_registry()
+served_specs = {}
+MODEL_NAMES = model_names_by_backend(model_specs)
+registry_lock = threading.Lock()
+
+# Inputs are truncated to their last N tokens (see truncate_sentences), max_tokens of the model spec
+DEFAULT_MAX_TOKENS = 128
+# Character truncation for models without a fast tokenizer
+MAX_LEN_CHARS = 200
 
 # We may need multiple models at the same time, so we use a dictionary to store them
 # {model_name: model_instance}
 model_dict = {}
+# Tokenizers of the models without a local instance (TEI): {model_name: tokenizer}
+tokenizer_dict = {}
+# Truncation statistics per model, served on /truncation_stats
+truncation_stats = {}
+truncation_stats_lock = threading.Lock()
+# Embeddings being computed, shared by concurrent requests: {(model_name, max_tokens, sentence): Future}
+inflight_embeddings = {}
+inflight_lock = threading.Lock()
+# Peak memory of the requests per model, when TRACK_MEMORY is set
+memory_stats = {}
+memory_stats_lock = threading.Lock()
+fanout_executor = concurrent.futures.ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+# Loading state of the served models, served on /ready: {model_name: "loading" | "reloading" | "ready" | "failed"}
+model_status = {}
+model_status_lock = threading.Lock()
+# CPU profile of each model (see cpu_profiles.py), read at startup, and the runners applying them
+cpu_profiles = {}
+model_runners = {}
+admission = AdmissionController(QUEUE_CONCURRENCY, QUEUE_DEPTH)
+# Sampled capture of the requests, replayed by replay_traffic.py (see traffic_capture.py), None when off
+traffic_capture = TrafficCapture(CAPTURE_PATH) if CAPTURE_PATH else None
+# Running profile started by POST /admin/profile (see profiling.py), None when off, and the last one for its status
+profiling_session = None
+last_profiling_session = None
+profiling_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_device() -> str:
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def get_model_spec(model_name: str) -> ModelSpec | None:
+    return served_specs.get(model_name) or model_specs.get(model_name)
+
+
+def get_max_tokens(model_name: str) -> int:
+    spec = get_model_spec(model_name)
+    return spec.max_tokens if spec is not None else DEFAULT_MAX_TOKENS
+
+
+def get_batch_size(model_name: str) -> int:
+    spec = get_model_spec(model_name)
+    return spec.batch_size if spec is not None else BATCH_SIZE
 
 
 def model_type(model_name: str) -> str:
     """
     Determine the type of model based on its name.
     """
-    if model_name in MODEL_NAMES["TEI"]:
-        return "TEI"
-    elif model_name in MODEL_NAMES["sentence_transformer"]:
-        return "sentence_transformer"
-    elif model_name in MODEL_NAMES["huggingface"]:
-        return "huggingface"
-    elif model_name in MODEL_NAMES["pytorch"]:
-        return "pytorch"
-    else:
-        return "other"
+    spec = get_model_spec(model_name)
+    return spec.backend if spec is not None else "other"
+
+
+def _model_path(model_name: str, spec: ModelSpec | None = None) -> str:
+    spec = spec or get_model_spec(model_name)
+    return (spec and spec.path) or os.path.join(MODEL_ZOO_DIR, model_name)
+
+
+def _tei_inprocess(spec: ModelSpec) -> bool:
+    return spec.backend == "TEI" and (spec.tei_backend or TEI_BACKEND) == "inprocess"
+
 
+def _snapshot_path(model_path: str) -> str:
+    return os.path.join(model_path, SNAPSHOT_DIR)
+
+
+def _load_model_sentence_transformer(model_name: str, warmup: bool = True, model_path: str | None = None):
+    import torch
+    from sentence_transformers import SentenceTransformer
 
-def _load_model_sentence_transformer(
-    model_name: str, warmup: bool = True
-) -> SentenceTransformer:
     start = time.time()
     os.makedirs(MODEL_ZOO_DIR, exist_ok=True)
-    print(f"Instantiating model: {model_name}")
+    model_path = model_path or _model_path(model_name)
+    if os.path.isdir(_snapshot_path(model_path)):
+        # safetensors weights are memory-mapped instead of unpickled
+        model_path = _snapshot_path(model_path)
+    print(f"Instantiating model: {model_name} from {model_path}")
 
-    model = SentenceTransformer(
-        os.path.join(MODEL_ZOO_DIR, model_name), trust_remote_code=True
-    )
-
-    model = model.to(DEVICE)
+    model = SentenceTransformer(model_path, device=get_device(), trust_remote_code=True)
     
     model.eval()
 
@@ -108,46 +232,66 @@ def _load_model_sentence_transformer(
 
 
 class HFONNXModel:
-    def __init__(self, model, tokenizer):
+    """
+    ONNX Runtime sessions take and return numpy arrays: pooling and normalization are done in numpy, straight into
+    the output array. `return_tensors="pt"` is only for the plain transformers fallback.
+    """
+
+    def __init__(self, model, tokenizer, pooling: str = "mean", return_tensors: str = "np"):
         self.model = model
         self.tokenizer = tokenizer
+        self.pooling = pooling
+        self.return_tensors = return_tensors
 
-    def encode(self, sentences, batch_size=BATCH_SIZE):
+    def encode(self, sentences, batch_size=BATCH_SIZE) -> np.ndarray:
+        """
+        Normalized embeddings of the sentences, as one float32 array allocated once for all the batches.
+        """
         if isinstance(sentences, str):
             sentences = [sentences]
-        all_embeddings = []
+        out = None
         for i in range(0, len(sentences), batch_size):
             batch_sentences = sentences[i : i + batch_size]
             inputs = self.tokenizer(
                 batch_sentences,
-                return_tensors="pt",
+                return_tensors=self.return_tensors,
                 padding=True,
                 truncation=True,
                 max_length=512,
             )
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                embeddings = self._mean_pooling(
-                    outputs.last_hidden_state, inputs["attention_mask"]
-                )
-                embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
-                all_embeddings.append(embeddings)
-        if all_embeddings:
-            return torch.cat(all_embeddings, dim=0).cpu().numpy()
-        else:
-            return np.array([])
+            hidden_state = self._run(inputs)
+            if out is None:
+                out = np.empty((len(sentences), hidden_state.shape[-1]), dtype=np.float32)
+            self._pool(hidden_state, np.asarray(inputs["attention_mask"]), out[i : i + len(batch_sentences)])
+        if out is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return out
+
+    def _run(self, inputs) -> np.ndarray:
+        if self.return_tensors == "np":
+            return np.asarray(self.model(**inputs).last_hidden_state)
+        import torch
 
-    def _mean_pooling(self, token_embeddings, attention_mask):
-        input_mask_expanded = (
-            attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
-        )
-        return torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(
-            input_mask_expanded.sum(1), min=1e-9
-        )
+        with torch.no_grad():
+            return self.model(**inputs).last_hidden_state.cpu().numpy()
+
+    def _pool(self, hidden_state: np.ndarray, attention_mask: np.ndarray, out: np.ndarray):
+        if self.pooling == "cls":
+            out[:] = hidden_state[:, 0]
+        else:
+            mask = attention_mask.astype(hidden_state.dtype)
+            np.einsum("bsd,bs->bd", hidden_state, mask, out=out, casting="same_kind")
+            out /= np.clip(mask.sum(axis=1, keepdims=True), 1e-9, None)
+        out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
 
 
 def _load_model_hfonnx(
-    model_name: str, warmup: bool = True, onnx_filename: str = "model.onnx"
+    model_name: str,
+    warmup: bool = True,
+    onnx_filename: str = "model.onnx",
+    session_options=None,
+    model_path: str | None = None,
+    pooling: str = "mean",
 ) -> HFONNXModel:
     """
     Load a Hugging Face Transformer model with ONNX weights for optimized inference.
@@ -156,18 +300,23 @@ def _load_model_hfonnx(
         - model_quantized.onnx (quantized for smaller size/faster inference)
         - model_fp16.onnx (half-precision for reduced memory usage)
     """
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
     start = time.time()
     os.makedirs(MODEL_ZOO_DIR, exist_ok=True)
     print(f"Instantiating model: {model_name}")
+    return_tensors = "np"
 
-    model_path = os.path.join(MODEL_ZOO_DIR, model_name)
+    model_path = model_path or _model_path(model_name)
     onnx_path = os.path.join(model_path, "onnx")
 
     # Try loading ONNX model using optimum.onnxruntime
     try:
         # Determine available providers
         available_providers = ort.get_available_providers()
-        if "CUDAExecutionProvider" in available_providers and DEVICE == "cuda":
+        if "CUDAExecutionProvider" in available_providers and get_device() == "cuda":
             provider = "CUDAExecutionProvider"
         else:
             provider = "CPUExecutionProvider"
@@ -176,6 +325,7 @@ def _load_model_hfonnx(
             onnx_path,
             file_name=onnx_filename,
             provider=provider,
+            session_options=session_options,
             library="transformers",
         )
         print("Successfully loaded ONNX model using optimum.onnxruntime")
@@ -185,11 +335,13 @@ def _load_model_hfonnx(
         try:
             onnx_model_path = os.path.join(onnx_path, "model.onnx")
             available_providers = ort.get_available_providers()
-            if "CUDAExecutionProvider" in available_providers and DEVICE == "cuda":
+            if "CUDAExecutionProvider" in available_providers and get_device() == "cuda":
                 providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
             else:
                 providers = ["CPUExecutionProvider"]
-            ort_session = ort.InferenceSession(onnx_model_path, providers=providers)
+            ort_session = ort.InferenceSession(
+                onnx_model_path, sess_options=session_options, providers=providers
+            )
 
             class ONNXRuntimeWrapper:
                 def __init__(self, session):
@@ -201,10 +353,11 @@ def _load_model_hfonnx(
                     onnx_inputs = {
                         name: (value.cpu().numpy() if hasattr(value, "cpu") else value)
                         for name, value in inputs.items()
+                        if name in self.input_names
                     }
                     outputs = self.session.run(self.output_names, onnx_inputs)
                     result = type("obj", (object,), {})()
-                    result.last_hidden_state = torch.from_numpy(outputs[0])
+                    result.last_hidden_state = outputs[0]
                     return result
 
             model = ONNXRuntimeWrapper(ort_session)
@@ -215,8 +368,9 @@ def _load_model_hfonnx(
             from transformers import AutoModel
 
             model = AutoModel.from_pretrained(model_path)
-            model = model.to(DEVICE)
+            model = model.to(get_device())
             model.eval()
+            return_tensors = "pt"
 
     # Load tokenizer
     tokenizer = AutoTokenizer.from_pretrained(model_path)
@@ -225,36 +379,65 @@ def _load_model_hfonnx(
         f"Done loading HuggingFace ONNX model: {model_name}. Took {time.time() - start:.2f}s"
     )
 
+    model = HFONNXModel(model, tokenizer, pooling=pooling, return_tensors=return_tensors)
     if warmup:
         start = time.time()
-        inputs = tokenizer(
-            "Artificial intelligence (AI), in its broadest sense, is intelligence exhibited by machines.",
-            return_tensors="pt",
-            padding=True,
-            truncation=True,
-        )
-        with torch.no_grad():
-            _ = model(**inputs)
+        model.encode("Artificial intelligence (AI), in its broadest sense, is intelligence exhibited by machines.")
         print(f"Warmup took an extra {time.time() - start:.2f}s")
 
-    return HFONNXModel(model, tokenizer)
+    return model
 
 
 def _load_model_torch(model_name: str, warmup: bool = True) -> None:
     return None
 
 
-def load_model(model_name: str, warmup: bool = True):
+def _load_model_tei(model_name: str, timeout: float = TEI_STARTUP_TIMEOUT) -> None:
     """
-    Load a model from the model zoo directory.
+    TEI models are served by their own container: wait until it is healthy (through the /<model>/health
+    location of embed_nginx.conf).
     """
-    if model_type(model_name) == "TEI":
-        model = None
-    elif model_type(model_name) == "sentence_transformer":
-        model = _load_model_sentence_transformer(model_name, warmup=warmup)
-    elif model_type(model_name) == "huggingface":
-        model = _load_model_hfonnx(model_name, warmup=warmup)
-    elif model_type(model_name) == "pytorch":
+    start = time.time()
+    while True:
+        try:
+            if requests.get(f"{TEI_URL}/{model_name}/health", timeout=1).status_code == 200:
+                print(f"TEI model {model_name} is up. Waited {time.time() - start:.2f}s")
+                return None
+        except requests.RequestException:
+            pass
+        if time.time() - start > timeout:
+            raise TimeoutError(f"TEI model {model_name} not up after {timeout}s")
+        time.sleep(1)
+
+
+def load_model(
+    model_name: str, warmup: bool = True, cpu_profile: CPUProfile | None = None, spec: ModelSpec | None = None
+):
+    """
+    Load a model from the model zoo directory, as described by its spec (default: the one of the registry).
+    `cpu_profile` sets the thread counts of the ONNX Runtime session of "huggingface" models.
+    """
+    spec = spec or get_model_spec(model_name)
+    if spec is None:
+        raise ValueError(f"Unknown model: {model_name}")
+    model_path = _model_path(model_name, spec)
+
+    if _tei_inprocess(spec):
+        model = _load_model_sentence_transformer(model_name, warmup=warmup, model_path=model_path)
+    elif spec.backend == "TEI":
+        model = _load_model_tei(model_name)
+    elif spec.backend == "sentence_transformer":
+        model = _load_model_sentence_transformer(model_name, warmup=warmup, model_path=model_path)
+    elif spec.backend == "huggingface":
+        model = _load_model_hfonnx(
+            model_name,
+            warmup=warmup,
+            onnx_filename=spec.onnx_file,
+            session_options=ort_session_options(cpu_profile) if cpu_profile else None,
+            model_path=model_path,
+            pooling=spec.pooling,
+        )
+    elif spec.backend == "pytorch":
         model = _load_model_torch(model_name, warmup=warmup)
     else:
         raise ValueError(f"Unknown model: {model_name}")
@@ -262,53 +445,263 @@ def load_model(model_name: str, warmup: bool = True):
     return model
 
 
-def check_for_model_update():
-    global model_dict
-    while True:
-        # Check for the updated model names
-        # The folder contains files named {call_sid}___{model_name}
-        new_model_names = os.listdir(MODEL_NAME_DIR)
-        new_model_names = set([x.split("___")[-1] for x in new_model_names])
-        # Remove old models that are no longer in the directory
-        for model_name in list(model_dict.keys()):
-            if model_name not in new_model_names:
-                print(f"Removing model: {model_name}")
-                del model_dict[model_name]
-        # Load new models
-        for model_name in new_model_names:
-            if model_name not in model_dict:
-                print(f"Loading model: {model_name}")
-                model_dict[model_name] = load_model(model_name)
-        time.sleep(CHECK_INTERVAL)
+def get_cpu_profile(model_name: str, spec: ModelSpec | None = None) -> CPUProfile:
+    """
+    Profile of a model from its spec, else from cpu_profiles.json, else an even share of the cores among the
+    local models.
+    """
+    spec = spec or get_model_spec(model_name)
+    if spec is not None and spec.cpu_profile is not None:
+        return spec.cpu_profile
+    num_local_models = sum(
+        s.backend in ("sentence_transformer", "huggingface") or _tei_inprocess(s) for s in model_specs.values()
+    )
+    return cpu_profiles.get(model_name) or default_cpu_profile(num_local_models)
+
+
+def create_model_runner(
+    model_name: str, model, cpu_profile: CPUProfile, spec: ModelSpec | None = None
+) -> ModelRunner | None:
+    """
+    Runner of a local model: torch models share their weights across sessions, ONNX Runtime sessions are
+    loaded once per session. None for models served out of process.
+    """
+    spec = spec or get_model_spec(model_name)
+    if spec.backend == "sentence_transformer" or _tei_inprocess(spec):
+        replicas = [model] * cpu_profile.num_sessions
+    elif spec.backend == "huggingface":
+        replicas = [model] + [
+            load_model(model_name, warmup=False, cpu_profile=cpu_profile, spec=spec)
+            for _ in range(cpu_profile.num_sessions - 1)
+        ]
+    else:
+        return None
+    return ModelRunner(model_name, replicas, cpu_profile)
+
+
+def export_snapshot(model_name: str) -> str:
+    """
+    Save a sentence_transformer model (or TEI model served in process) to model_zoo/<model_name>/snapshot:
+    safetensors weights and the serialized fast tokenizer, which load much faster than the original checkpoint.
+    "huggingface" models already load their ONNX weights directly.
+    """
+    if model_type(model_name) not in ("sentence_transformer", "TEI"):
+        raise ValueError(f"Snapshots are only supported for sentence_transformer and TEI models, not {model_name}")
+    model = _load_model_sentence_transformer(model_name, warmup=False)
+    snapshot_path = _snapshot_path(_model_path(model_name))
+    model.save(snapshot_path, safe_serialization=True)
+    print(f"Saved snapshot of {model_name} to {snapshot_path}")
+    return snapshot_path
+
+
+def _shutdown_runner(runner: ModelRunner | None):
+    # Waits for the requests still running on the previous version of a model
+    if runner is not None:
+        threading.Thread(target=runner.shutdown, daemon=True).start()
+
+
+def _discard_load(model_name: str, warmup: bool):
+    """
+    End a load whose spec was removed or changed while loading. `reload_registry` did not start a load of the
+    changed spec (the model was still loading), so start it now.
+    """
+    with model_status_lock:
+        if model_name not in model_specs:
+            model_status.pop(model_name, None)
+            return
+        # A model being reloaded keeps serving its previous version
+        model_status[model_name] = "ready" if model_name in model_dict else "failed"
+    load_models_in_background([model_name], warmup=warmup)
+
+
+def _load_model_in_background(model_name: str, spec: ModelSpec, warmup: bool = False):
+    # Specs are compared by value: a reload replaces the registry with equal, but new, spec objects
+    try:
+        cpu_profile = get_cpu_profile(model_name, spec)
+        model = load_model(model_name, warmup=warmup, cpu_profile=cpu_profile, spec=spec)
+        runner = create_model_runner(model_name, model, cpu_profile, spec)
+    except Exception as e:
+        print(f"*** ERROR: Failed to load model {model_name}: {e}")
+        if model_specs.get(model_name) == spec:
+            with model_status_lock:
+                # A model being reloaded keeps serving its previous version
+                model_status[model_name] = "ready" if model_name in model_dict else "failed"
+        else:
+            _discard_load(model_name, warmup)
+        return
+    with registry_lock:
+        discarded = model_specs.get(model_name) != spec
+        if not discarded:
+            # Swap the new version in: runner first, since requests look the model up in model_dict
+            previous_runner = model_runners.pop(model_name, None)
+            if runner is not None:
+                model_runners[model_name] = runner
+            served_specs[model_name] = spec
+            model_dict[model_name] = model
+            tokenizer_dict.pop(model_name, None)
+            model_status[model_name] = "ready"
+    if discarded:
+        _shutdown_runner(runner)
+        _discard_load(model_name, warmup)
+    else:
+        _shutdown_runner(previous_runner)
+
+
+def load_models_in_background(model_names: list[str], warmup: bool = False) -> concurrent.futures.Executor:
+    """
+    Load models in parallel, without blocking: each model is served as soon as it is ready.
+    A model already served keeps serving its current version until the new one replaces it.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=LOAD_WORKERS, thread_name_prefix="load_model")
+    with model_status_lock:
+        model_names = [name for name in model_names if model_status.get(name) not in ("loading", "reloading")]
+        for model_name in model_names:
+            model_status[model_name] = "reloading" if model_name in model_dict else "loading"
+    for model_name in model_names:
+        executor.submit(_load_model_in_background, model_name, model_specs[model_name], warmup)
+    executor.shutdown(wait=False)
+    return executor
+
+
+def retire_model(model_name: str):
+    print(f"Removing model: {model_name}")
+    model_dict.pop(model_name, None)
+    served_specs.pop(model_name, None)
+    tokenizer_dict.pop(model_name, None)
+    with model_status_lock:
+        model_status.pop(model_name, None)
+    _shutdown_runner(model_runners.pop(model_name, None))
+
+
+def reload_registry() -> dict:
+    """
+    Read the registry again: load the added and changed models in the background, retire the removed ones.
+    """
+    global model_specs, MODEL_NAMES
+    new_specs = load_registry()
+    with registry_lock:
+        added = [name for name in new_specs if name not in model_specs]
+        changed = [name for name in new_specs if name in model_specs and new_specs[name] != model_specs[name]]
+        removed = [name for name in model_specs if name not in new_specs]
+        # Unchanged models keep their spec object, which the loads in flight and served_specs refer to
+        new_specs = {
+            name: model_specs[name] if name in model_specs and name not in changed else spec
+            for name, spec in new_specs.items()
+        }
+        model_specs = new_specs
+        MODEL_NAMES = model_names_by_backend(new_specs)
+    for model_name in removed:
+        retire_model(model_name)
+    load_models_in_background(added + changed, warmup=True)
+
+    new_containers = [name for name in added + changed if new_specs[name].backend == "TEI"]
+    new_containers = [name for name in new_containers if not _tei_inprocess(new_specs[name])]
+    if new_containers:
+        print(f"*** WARNING: Run embed_start.sh to start the TEI containers of {new_containers}")
+    print(f"Model registry reloaded: added {added}, changed {changed}, removed {removed}")
+    return {"added": added, "changed": changed, "removed": removed}
+
+
+def _get_tokenizer(model_name: str, model_dict: dict):
+    """
+    Tokenizer of a model: the one of the loaded model, or, for TEI models served out of process,
+    the one stored next to the weights in the model zoo. None if not available.
+    """
+    tokenizer = getattr(model_dict.get(model_name), "tokenizer", None)
+    if tokenizer is not None:
+        return tokenizer
+    if model_name not in tokenizer_dict:
+        try:
+            from transformers import AutoTokenizer
+
+            tokenizer_dict[model_name] = AutoTokenizer.from_pretrained(_model_path(model_name))
+        except Exception as e:
+            print(f"*** WARNING: No tokenizer for {model_name}, falling back to character truncation: {e}")
+            tokenizer_dict[model_name] = None
+    return tokenizer_dict[model_name]
+
+
+def _update_truncation_stats(model_name: str, num_tokens: list[int], num_truncated: int):
+    with truncation_stats_lock:
+        stats = truncation_stats.setdefault(
+            model_name, {"inputs": 0, "truncated": 0, "tokens_total": 0, "tokens_max": 0}
+        )
+        stats["inputs"] += len(num_tokens)
+        stats["truncated"] += num_truncated
+        stats["tokens_total"] += sum(num_tokens)
+        stats["tokens_max"] = max(stats["tokens_max"], max(num_tokens, default=0))
+
+
+def truncate_sentences(
+    sentences: list[str], model_dict: dict, model_name: str, max_tokens: int | None = None
+) -> tuple[list[str], list[int]]:
+    """
+    Truncate sentences to their last `max_tokens` tokens (special tokens excluded), using the model tokenizer.
+    This bounds the sequence length, hence the forward pass time, whatever the language.
+    Falls back to the last MAX_LEN_CHARS characters for models without a fast tokenizer.
+    Return:
+        sentences: truncated sentences
+        num_tokens: number of tokens of each truncated sentence
+    """
+    max_tokens = max_tokens or get_max_tokens(model_name)
+    sentences = [s.replace("\n", " ").strip() for s in sentences]
+
+    tokenizer = _get_tokenizer(model_name, model_dict)
+    if tokenizer is None or not getattr(tokenizer, "is_fast", False):
+        # Truncate sentences that are too long, take the last MAX_LEN_CHARS characters
+        num_truncated = sum(len(s) > MAX_LEN_CHARS for s in sentences)
+        sentences = [s[-MAX_LEN_CHARS:] for s in sentences]
+        num_tokens = [len(s) for s in sentences]  # character count as a proxy
+        _update_truncation_stats(model_name, num_tokens, num_truncated)
+        return sentences, num_tokens
+
+    offset_mapping = tokenizer(
+        sentences,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        return_attention_mask=False,
+        return_token_type_ids=False,
+    )["offset_mapping"]
+    truncated_sentences, num_tokens = [], []
+    num_truncated = 0
+    for sentence, offsets in zip(sentences, offset_mapping):
+        if len(offsets) > max_tokens:
+            # Keep the end of the sentence: cut at the start of the first kept token
+            sentence = sentence[offsets[-max_tokens][0] :]
+            num_truncated += 1
+        truncated_sentences.append(sentence)
+        num_tokens.append(min(len(offsets), max_tokens))
+    _update_truncation_stats(model_name, num_tokens, num_truncated)
+    return truncated_sentences, num_tokens
 
 
 def _compute_embeddings_tei(
     sentences: list[str],
     model_name: str,
     batch_size: int,
-    max_len: int,
-) -> list:
+    num_tokens: list[int],
+) -> np.ndarray:
     if not sentences:
-        return []
+        return np.empty((0, 0), dtype=np.float32)
 
-    # Truncate sentences that are too long, take the last max_len characters
-    sentences = [s[-max_len:].replace("\n", " ").strip() for s in sentences]
-
-    # TEI service URL (port 8080, not 5000 like your Flask server)
-    url = f"http://127.0.0.1:8080/{model_name}"
+    url = f"{TEI_URL}/{model_name}"
     headers = {"Content-Type": "application/json"}
 
-    embeddings = [None] * len(sentences)
-    # Send batch of requests
+    embeddings = None
+    # Send batches of sentences of similar lengths, so that padding is minimal
+    order = sorted(range(len(sentences)), key=lambda i: num_tokens[i])
     for i in range(0, len(sentences), batch_size):
-        batch = sentences[i : i + batch_size]
-        data = json.dumps({"inputs": batch})
+        batch_idx = order[i : i + batch_size]
+        data = json.dumps({"inputs": [sentences[j] for j in batch_idx]})
 
         response = requests.post(url, headers=headers, data=data)
 
         # Parse the response
         if response.status_code == 200:
-            embeddings[i : i + batch_size] = response.json()
+            batch_embeddings = np.asarray(response.json(), dtype=np.float32)
+            if embeddings is None:
+                embeddings = np.empty((len(sentences), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[batch_idx] = batch_embeddings
         else:
             raise Exception(
                 f"TEI request failed to get prediction, with status {response.status_code}: {response.text}"
@@ -322,45 +715,113 @@ def _compute_embeddings_sentence_transformer(
     model_dict: dict,
     model_name: str,
     batch_size: int,
-    max_len: int,
-) -> list:
+    normalize_embeddings: bool = False,
+) -> np.ndarray:
     if not sentences:
-        return []
+        return np.empty((0, 0), dtype=np.float32)
 
-    # Truncate sentences that are too long, take the last max_len characters
-    sentences = [s[-max_len:].replace("\n", " ").strip() for s in sentences]
+    import torch
 
     model = model_dict[model_name]
-    
+    out = np.empty((len(sentences), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    # Encode batch by batch into the output array, instead of letting encode() stack all the batches.
+    # Batches of sentences of similar lengths, as encode() would do, so that padding is minimal
+    order = np.argsort([len(s) for s in sentences], kind="stable")
     with torch.inference_mode():
-        embeddings = model.encode(sentences, batch_size=batch_size)
-    
-    return embeddings.tolist()
+        for i in range(0, len(sentences), batch_size):
+            batch_idx = order[i : i + batch_size]
+            out[batch_idx] = model.encode(
+                [sentences[j] for j in batch_idx],
+                batch_size=batch_size,
+                normalize_embeddings=normalize_embeddings,
+                convert_to_numpy=True,
+            )
+    return out
+
+
+def _compute_embeddings_tei_inprocess(
+    sentences: list[str],
+    model_dict: dict,
+    model_name: str,
+    batch_size: int,
+) -> np.ndarray:
+    """
+    Embeddings of a TEI model served in process: TEI normalizes embeddings by default.
+    """
+    return _compute_embeddings_sentence_transformer(
+        sentences, model_dict, model_name, batch_size=batch_size, normalize_embeddings=True
+    )
+
 
 
+def _compute_embeddings_hfonnx(
+    sentences: list[str],
+    model_dict: dict,
+    model_name: str,
+    batch_size: int,
+) -> np.ndarray:
+    if not sentences:
+        return np.empty((0, 0), dtype=np.float32)
+
+    model = model_dict[model_name]
+    return model.encode(sentences, batch_size=batch_size)
+
+
+def _run_local_model(
+    compute, sentences: list[str], model_dict: dict, model_name: str, batch_size: int, inline: bool = False
+) -> np.ndarray:
+    """
+    Run `compute` on the model runner when the model has one (server), else (or if `inline`) in the calling thread.
+    """
+    runner = model_runners.get(model_name)
+    if runner is None or inline:
+        return compute(sentences, model_dict, model_name, batch_size=batch_size)
+    return runner.run(lambda replica: compute(sentences, {model_name: replica}, model_name, batch_size=batch_size))
+
 
 def compute_embeddings(
     sentences: list[str],
     model_dict: dict,
     model_name: str,
-    batch_size: int = BATCH_SIZE,
-    max_len: int = 200,
-) -> list:
+    batch_size: int | None = None,
+    max_tokens: int | None = None,
+    inline: bool = False,
+) -> np.ndarray:
     """
-    Compute embeddings for a list of sentences using the specified model.
+    Compute embeddings for a list of sentences using the specified model, as a float32 array (one row per sentence).
+    Repeated sentences are embedded once and their embedding is fanned back out.
+    Sentences are first truncated to their last `max_tokens` tokens (default: max_tokens of the model spec),
+    and embedded by batches of `batch_size` (default: batch_size of the model spec).
+    With `inline`, local models run in the calling thread instead of their runner (profiling).
     """
-    embeddings = [None] * len(sentences)
+    batch_size = batch_size or get_batch_size(model_name)
+    unique_idx = {}
+    inverse = [unique_idx.setdefault(s, len(unique_idx)) for s in sentences]
+    if len(unique_idx) < len(sentences):
+        unique_embeddings = compute_embeddings(
+            list(unique_idx), model_dict, model_name, batch_size=batch_size, max_tokens=max_tokens, inline=inline
+        )
+        return unique_embeddings[np.asarray(inverse)]
 
-    if model_type(model_name) == "TEI":
+    embeddings = np.empty((len(sentences), 0), dtype=np.float32)
+    sentences, num_tokens = truncate_sentences(sentences, model_dict, model_name, max_tokens)
+
+    if model_type(model_name) == "TEI" and model_dict.get(model_name) is not None:
+        embeddings = _run_local_model(
+            _compute_embeddings_tei_inprocess, sentences, model_dict, model_name, batch_size, inline
+        )
+    elif model_type(model_name) == "TEI":
         embeddings = _compute_embeddings_tei(
-            sentences, model_name, batch_size=batch_size, max_len=max_len
+            sentences, model_name, batch_size=batch_size, num_tokens=num_tokens
         )  
     elif model_type(model_name) == "sentence_transformer":
-        embeddings = _compute_embeddings_sentence_transformer(
-            sentences, model_dict, model_name, batch_size=batch_size, max_len=max_len
+        embeddings = _run_local_model(
+            _compute_embeddings_sentence_transformer, sentences, model_dict, model_name, batch_size, inline
         )  
     elif model_type(model_name) == "huggingface":
-        pass
+        embeddings = _run_local_model(
+            _compute_embeddings_hfonnx, sentences, model_dict, model_name, batch_size, inline
+        )
     elif model_type(model_name) == "pytorch":
         pass
     else:
@@ -369,15 +830,132 @@ def compute_embeddings(
     return embeddings
 
 
+def compute_embeddings_coalesced(
+    sentences: list[str],
+    model_dict: dict,
+    model_name: str,
+    max_tokens: int | None = None,
+) -> np.ndarray:
+    """
+    `compute_embeddings` shared across concurrent requests: a (model, max_tokens, sentence) already being
+    embedded by another request is not recomputed, its result is awaited instead.
+    Futures hold row views of the array of the request that computed them: rows are copied once, into the output.
+    """
+    unique_sentences = list(dict.fromkeys(sentences))
+    owned_futures = {}  # sentences this request computes
+    awaited_futures = {}  # sentences computed by other requests
+    with inflight_lock:
+        for sentence in unique_sentences:
+            key = (model_name, max_tokens, sentence)
+            future = inflight_embeddings.get(key)
+            if future is None:
+                future = inflight_embeddings[key] = concurrent.futures.Future()
+                owned_futures[sentence] = future
+            else:
+                awaited_futures[sentence] = future
+
+    error = None
+    try:
+        if owned_futures:
+            owned_sentences = list(owned_futures)
+            embeddings = compute_embeddings(
+                owned_sentences, model_dict, model_name, max_tokens=max_tokens
+            )
+            for sentence, embedding in zip(owned_sentences, embeddings):
+                owned_futures[sentence].set_result(embedding)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        # Never leave other requests waiting on a future that will not be resolved
+        for future in owned_futures.values():
+            if not future.done():
+                future.set_exception(error or RuntimeError("Embedding was not computed"))
+        with inflight_lock:
+            for sentence in owned_futures:
+                del inflight_embeddings[(model_name, max_tokens, sentence)]
+
+    futures = {**awaited_futures, **owned_futures}
+    out = None
+    for i, sentence in enumerate(sentences):
+        embedding = futures[sentence].result()
+        if out is None:
+            out = np.empty((len(sentences), len(embedding)), dtype=np.float32)
+        out[i] = embedding
+    return out if out is not None else np.empty((0, 0), dtype=np.float32)
+
+
+def serve_embeddings(model_name: str, sentences: list[str], max_tokens: int | None, deadline: float) -> np.ndarray:
+    """
+    Embeddings of a request, shared by the HTTP route and the Unix socket: the model must be loaded, and the
+    request goes through the queue of the model. Raises AdmissionError for a request that is not served.
+    """
+    if model_name not in model_dict:
+        if model_type(model_name) == "other":
+            raise AdmissionError(404, f"Unknown model: {model_name}")
+        if model_status.get(model_name) != "loading":
+            print(f"*** WARNING: Model {model_name} not already loaded. Loading it in the background...")
+            load_models_in_background([model_name], warmup=True)
+        raise AdmissionError(503, f"Model {model_name} is loading", LOADING_RETRY_AFTER)
+
+    with admission.queue(model_name).admit(deadline=deadline):
+        session = profiling_session
+        if session is not None and session.wants(model_name):
+            return session.profile_request(
+                model_dict,
+                lambda models: compute_embeddings(sentences, models, model_name, max_tokens=max_tokens, inline=True),
+            )
+        return compute_embeddings_coalesced(sentences, model_dict, model_name, max_tokens=max_tokens)
+
+
+def serve_embeddings_multi(
+    model_names: list[str], sentences: list[str], max_tokens: int | None, deadline: float
+) -> dict[str, np.ndarray]:
+    """
+    `serve_embeddings` for several models in parallel: TEI requests are sent concurrently and local models run on
+    their own runners, so the request takes about as long as its slowest model.
+    Sentences are deduplicated once for all the models. Fails if any model cannot serve the request.
+    """
+    unique_idx = {}
+    inverse = np.asarray([unique_idx.setdefault(s, len(unique_idx)) for s in sentences])
+    unique_sentences = list(unique_idx)
+    futures = {
+        model_name: fanout_executor.submit(serve_embeddings, model_name, unique_sentences, max_tokens, deadline)
+        for model_name in model_names
+    }
+    embeddings = {model_name: future.result() for model_name, future in futures.items()}
+    if len(unique_sentences) == len(sentences):
+        return embeddings
+    return {model_name: unique_embeddings[inverse] for model_name, unique_embeddings in embeddings.items()}
+
+
+def _serve_local_request(model_name: str, sentences: list[str], max_tokens: int | None) -> np.ndarray:
+    if not sentences:
+        raise AdmissionError(400, "No sentences provided")
+    return serve_embeddings(model_name, sentences, max_tokens, deadline=time.monotonic() + DEFAULT_TIMEOUT_MS / 1000)
+
+
 @app.route("/compute_embedding", methods=["POST"])
 def predict():
-    if not model_dict:
-        return jsonify({"error": "Model not loaded"}), 503
-
+    received_at = time.monotonic()
     data = request.get_json()
+    binary = data.get("format") == "binary" or request.headers.get("Accept") == "application/octet-stream"
+    result = _predict(data, binary, received_at)
+    if traffic_capture is not None:
+        latency = time.monotonic() - received_at
+        traffic_capture.record(data, binary, result[1], time.time() - latency, latency)
+    return result
+
+
+def _predict(data: dict, binary: bool, received_at: float):
     app.logger.info(f"Received data: {data}")
     sentences = data["sentences"]
     model_name = data["model_name"]
+    multi_model = isinstance(model_name, list)
+    if multi_model:
+        if not model_name or not all(isinstance(name, str) for name in model_name):
+            return jsonify({"error": "model_name must be a model name or a non-empty list of model names"}), 400
+        model_name = list(dict.fromkeys(model_name))
     if not sentences:
         app.logger.warning("Received no sentences.")
         return jsonify({"error": "No sentences provided"}), 400
@@ -386,33 +964,278 @@ def predict():
         f'Received request: model_name: {model_name}, {len(sentences)} sentence(s): "{sentences[0]}",...'
     )
 
-    if model_name not in model_dict:
-        print(f"*** WARNING: Model {model_name} not already loaded. Loading it now...")
-        model_dict[model_name] = load_model(model_name)
+    timeout_ms = data.get("timeout_ms", DEFAULT_TIMEOUT_MS)
+    if not isinstance(timeout_ms, (int, float)) or timeout_ms <= 0:
+        return jsonify({"error": "timeout_ms must be a positive number"}), 400
+
+    # Optional compact output: Matryoshka truncation and/or quantization (see compact.py)
+    dimension = data.get("dimension")
+    precision = data.get("precision")
+    if dimension is not None and (not isinstance(dimension, int) or dimension <= 0):
+        return jsonify({"error": "dimension must be a positive integer"}), 400
+    if precision is not None and precision not in PRECISIONS:
+        return jsonify({"error": f"precision must be one of {PRECISIONS}"}), 400
+
+    max_tokens = data.get("max_tokens")
+    if max_tokens is not None and (not isinstance(max_tokens, int) or max_tokens <= 0):
+        return jsonify({"error": "max_tokens must be a positive integer"}), 400
 
-    embeddings = compute_embeddings(sentences, model_dict, model_name)
+    if binary and precision not in (None, *BINARY_PRECISIONS):
+        return jsonify({"error": f"binary responses support the precisions {BINARY_PRECISIONS}"}), 400
+    if binary and multi_model:
+        return jsonify({"error": "binary responses support a single model_name"}), 400
+
+    try:
+        if TRACK_MEMORY:
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        deadline = received_at + timeout_ms / 1000
+        if multi_model:
+            embeddings = serve_embeddings_multi(model_name, sentences, max_tokens, deadline)
+        else:
+            embeddings = serve_embeddings(model_name, sentences, max_tokens, deadline)
+    except AdmissionError as e:
+        app.logger.warning(f"Request for {model_name} not served ({e.status_code}): {e}")
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after is not None else {}
+        return jsonify({"error": str(e)}), e.status_code, headers
+
+    try:
+        if binary:
+            response = _binary_response(embeddings, dimension, precision or "float32")
+        elif multi_model:
+            response = jsonify({name: _json_embeddings(e, dimension, precision) for name, e in embeddings.items()})
+        else:
+            response = jsonify(_json_embeddings(embeddings, dimension, precision))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if TRACK_MEMORY:
+        peak_mb = _record_peak_memory(",".join(model_name) if multi_model else model_name, memory_start)
+        response.headers["X-Peak-Memory-MB"] = f"{peak_mb:.3f}"
+    return response, 200
 
-    return jsonify(embeddings), 200
+
+def _json_embeddings(embeddings: np.ndarray, dimension: int | None, precision: str | None):
+    if dimension is None and precision is None:
+        return embeddings.tolist()
+    return encode_compact(embeddings, dimension, precision or "float32")
+
+
+def _binary_response(embeddings: np.ndarray, dimension: int | None, precision: str) -> Response:
+    """
+    Raw rows of the embedding matrix: no copy beyond the dtype conversion and the bytes handed to the server.
+    """
+    if dimension is not None:
+        embeddings = truncate_dimension(embeddings, dimension)
+    embeddings = np.ascontiguousarray(embeddings, dtype="<f4" if precision == "float32" else "<f2")
+    return Response(
+        embeddings.tobytes(),
+        mimetype="application/octet-stream",
+        headers={"X-Embedding-Shape": f"{embeddings.shape[0]},{embeddings.shape[1]}", "X-Embedding-Dtype": precision},
+    )
+
+
+def _record_peak_memory(model_name: str, memory_start: int) -> float:
+    peak_mb = max(0, tracemalloc.get_traced_memory()[1] - memory_start) / 2**20
+    with memory_stats_lock:
+        stats = memory_stats.setdefault(model_name, {"requests": 0, "peak_mb_total": 0.0, "peak_mb_max": 0.0})
+        stats["requests"] += 1
+        stats["peak_mb_total"] += peak_mb
+        stats["peak_mb_max"] = max(stats["peak_mb_max"], peak_mb)
+    return peak_mb
+
+
+@app.route("/memory_stats", methods=["GET"])
+def get_memory_stats():
+    """
+    Per model: number of requests, mean and max peak memory of a request in MB (EMBED_TRACK_MEMORY=1 only).
+    """
+    with memory_stats_lock:
+        return jsonify(
+            {
+                model_name: {
+                    "requests": stats["requests"],
+                    "peak_mb_mean": stats["peak_mb_total"] / stats["requests"],
+                    "peak_mb_max": stats["peak_mb_max"],
+                }
+                for model_name, stats in memory_stats.items()
+            }
+        ), 200
+
+
+@app.route("/truncation_stats", methods=["GET"])
+def get_truncation_stats():
+    """
+    Per model: number of inputs, how many were truncated, and mean/max number of tokens after truncation.
+    """
+    with truncation_stats_lock:
+        return jsonify(
+            {
+                model_name: {
+                    **stats,
+                    "truncated_ratio": stats["truncated"] / stats["inputs"] if stats["inputs"] else 0.0,
+                    "tokens_mean": stats["tokens_total"] / stats["inputs"] if stats["inputs"] else 0.0,
+                    "max_tokens": get_max_tokens(model_name),
+                }
+                for model_name, stats in truncation_stats.items()
+            }
+        ), 200
+
+
+@app.route("/live", methods=["GET"])
+def live():
+    """
+    200 as long as the process serves requests, whatever the state of the models.
+    """
+    return jsonify({"live": True}), 200
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """
+    200 once no model is loading anymore and at least one is served, 503 before.
+    The loading state ("ready", or "failed" for a model that could not be loaded) and queue of each model are
+    in the response.
+    """
+    statuses = list(model_status.values())
+    is_ready = "ready" in statuses and "loading" not in statuses
+    return (
+        jsonify({"ready": is_ready, "models": model_status, "queues": admission.stats()}),
+        200 if is_ready else 503,
+    )
+
+
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    """
+    Reload the model registry now, instead of waiting for the file watcher.
+    """
+    try:
+        return jsonify(reload_registry()), 200
+    except Exception as e:
+        return jsonify({"error": f"Invalid model registry: {e}"}), 400
+
+
+def _load_profiled_model(model_name: str, profile_prefix: str) -> HFONNXModel:
+    """
+    Copy of a "huggingface" model with ONNX Runtime profiling enabled, traces written to <profile_prefix>_*.json.
+    """
+    spec = get_model_spec(model_name)
+    session_options = ort_session_options(get_cpu_profile(model_name, spec))
+    session_options.enable_profiling = True
+    session_options.profile_file_prefix = profile_prefix
+    return _load_model_hfonnx(
+        model_name,
+        warmup=False,
+        onnx_filename=spec.onnx_file,
+        session_options=session_options,
+        model_path=_model_path(model_name, spec),
+        pooling=spec.pooling,
+    )
+
+
+def _clear_profiling_session(session: ProfilingSession):
+    # Called when a profile stops: requests stop checking it, and it stops holding its profiled model copy
+    global profiling_session
+    with profiling_lock:
+        if profiling_session is session:
+            profiling_session = None
+
+
+@app.route("/admin/profile", methods=["POST"])
+def admin_start_profile():
+    """
+    Start a profile: {"kind": "stack" | "torch" | "onnxruntime", "duration_s": 30,
+    "model_name": ... and "sample_rate": 0.1 for torch and onnxruntime, "interval_ms": 5 for stack}.
+    One profile at a time: 409 while one is running.
+    """
+    global profiling_session, last_profiling_session
+    data = request.get_json(silent=True) or {}
+    kind = data.get("kind", "stack")
+    model_name = data.get("model_name")
+    spec = get_model_spec(model_name) if model_name else None
+    if kind == "torch" and (spec is None or not (spec.backend == "sentence_transformer" or _tei_inprocess(spec))):
+        return jsonify({"error": "torch profiles need a sentence_transformer or in-process TEI model"}), 400
+    if kind == "onnxruntime" and (spec is None or spec.backend != "huggingface"):
+        return jsonify({"error": "onnxruntime profiles need a huggingface (ONNX) model"}), 400
+    with profiling_lock:
+        if profiling_session is not None:
+            return jsonify({"error": "A profile is already running", "profile": profiling_session.status()}), 409
+        try:
+            session = ProfilingSession(
+                kind,
+                model_name=model_name,
+                duration_s=float(data.get("duration_s", 30)),
+                sample_rate=float(data.get("sample_rate", 0.1)),
+                interval_ms=float(data.get("interval_ms", 5)),
+                load_profiled_model=_load_profiled_model,
+                on_stop=_clear_profiling_session,
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        if not session.stopped:  # a profile shorter than this request already cleared itself
+            profiling_session = session
+        last_profiling_session = session
+    app.logger.info(f"Started profile {session.id}")
+    return jsonify(session.status()), 200
+
+
+@app.route("/admin/profile", methods=["GET"])
+def admin_profile_status():
+    """
+    Status of the last profile, and the trace files of all the profiles on disk.
+    """
+    files = []
+    if os.path.isdir(PROFILES_DIR):
+        for root, _, names in os.walk(PROFILES_DIR):
+            files += [os.path.relpath(os.path.join(root, name), PROFILES_DIR) for name in names]
+    status = last_profiling_session.status() if last_profiling_session is not None else None
+    return jsonify({"profile": status, "files": sorted(files)}), 200
+
+
+@app.route("/admin/profile/stop", methods=["POST"])
+def admin_stop_profile():
+    session = last_profiling_session
+    if session is None:
+        return jsonify({"error": "No profile"}), 404
+    session.stop()
+    return jsonify(session.status()), 200
+
+
+@app.route("/admin/profile/<path:filename>", methods=["GET"])
+def admin_download_profile(filename):
+    return send_from_directory(os.path.abspath(PROFILES_DIR), filename, as_attachment=True)
 
 
 def run_app():
-    # Start the model update checker in a separate thread
-    # threading.Thread(target=check_for_model_update, daemon=True).start()
     print(f"OMP_NUM_THREADS: {os.environ.get('OMP_NUM_THREADS', None)}")
+    cpu_profiles.update(load_cpu_profiles())
+    if TRACK_MEMORY:
+        tracemalloc.start()
+    print(f"CPU profiles: { {name: profile.model_dump() for name, profile in cpu_profiles.items()} }")
+    # Before any model is loaded: the torch inter-op pool is process-wide and can only be sized once
+    torch_models = [
+        name for name, spec in model_specs.items() if spec.backend == "sentence_transformer" or _tei_inprocess(spec)
+    ]
+    configure_torch_interop_threads([get_cpu_profile(name, model_specs[name]) for name in torch_models])
 
     # Start the embedding network for TEI models in the background
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    embed_start_path = os.path.join(script_dir, "embed_start.sh")
-    subprocess.Popen(["bash", embed_start_path] + MODEL_NAMES["TEI"])
+    tei_container_models = [name for name in MODEL_NAMES["TEI"] if not _tei_inprocess(model_specs[name])]
+    if tei_container_models:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        embed_start_path = os.path.join(script_dir, "embed_start.sh")
+        subprocess.Popen(["bash", embed_start_path] + tei_container_models)
 
     model_names = (
         MODEL_NAMES["TEI"]
         + MODEL_NAMES["sentence_transformer"]
         + MODEL_NAMES["huggingface"]
     )
-    # Load all models to the global model_dict
-    for model_name in model_names:
-        model_dict[model_name] = load_model(model_name, warmup=False)
+    # Load all models to the global model_dict in the background, and serve them as they become ready
+    load_models_in_background(model_names, warmup=False)
+    # Reload the registry when it changes
+    start_registry_watcher(reload_registry, MODEL_REGISTRY_PATH, REGISTRY_CHECK_INTERVAL)
+    if UDS_PATH:
+        serve_unix_socket(UDS_PATH, _serve_local_request)
     app.run(host="0.0.0.0", port=5000)
 
 
@@ -0,0 +1,71 @@
+"""
+Sampled capture of the /compute_embedding traffic, to replay it later against a server (see replay_traffic.py).
+
+Enabled on the server with EMBED_CAPTURE_PATH=/path/to/capture.jsonl: a fraction EMBED_CAPTURE_RATE (default 0.01)
+of the requests is appended to the file, one JSON object per line:
+    {"ts": 1760000000.123, "model_name": "LaBSE", "num_sentences": 2, "text_lengths": [12, 7],
+     "max_tokens": null, "dimension": null, "precision": null, "format": "json", "timeout_ms": null,
+     "status": 200, "latency_ms": 18.2}
+The texts themselves ("sentences") are only captured with EMBED_CAPTURE_TEXTS=1: without them, the replay sends
+synthetic texts of the same lengths.
+"""
+
+import os
+import json
+import random
+import threading
+
+CAPTURE_PATH = os.environ.get("EMBED_CAPTURE_PATH")
+CAPTURE_RATE = float(os.environ.get("EMBED_CAPTURE_RATE", 0.01))
+CAPTURE_TEXTS = os.environ.get("EMBED_CAPTURE_TEXTS", "0") == "1"
+
+
+class TrafficCapture:
+    def __init__(self, path: str, sample_rate: float = CAPTURE_RATE, include_texts: bool = CAPTURE_TEXTS):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.include_texts = include_texts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, data: dict, binary: bool, status: int, received_at: float, latency: float):
+        """
+        Append a sampled request: `data` is its JSON body, `received_at` its wall-clock arrival time and
+        `latency` the time taken to serve it, in seconds.
+        """
+        if random.random() >= self.sample_rate:
+            return
+        sentences = data.get("sentences") or []
+        entry = {
+            "ts": round(received_at, 6),
+            "model_name": data.get("model_name"),
+            "num_sentences": len(sentences),
+            "text_lengths": [len(s) for s in sentences],
+            "max_tokens": data.get("max_tokens"),
+            "dimension": data.get("dimension"),
+            "precision": data.get("precision"),
+            "format": "binary" if binary else "json",
+            "timeout_ms": data.get("timeout_ms"),
+            "status": status,
+            "latency_ms": round(latency * 1000, 3),
+        }
+        if self.include_texts:
+            entry["sentences"] = sentences
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def load_capture(path: str) -> list[dict]:
+    """
+    Captured requests of a file, in arrival order.
+    """
+    with open(path, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return sorted(entries, key=lambda entry: entry["ts"])
@@ -0,0 +1,150 @@
+"""
+Auto-tune the CPU profiles of the local models (see cpu_profiles.py) on this host.
+
+For each model, every candidate profile on the given cores is benchmarked with concurrent clients sending small
+requests, as on the live path: one latency profile (one session using all the cores) and throughput profiles
+(2, 4, ... sessions sharing the cores). The best profile for the objective is saved to the profiles file.
+
+Run one model at a time on its own cores, on an otherwise idle host. Usage (from the repository root):
+    python src/embedding/tune_cpu_profiles.py --models LaBSE --cores 0-7
+    python src/embedding/tune_cpu_profiles.py --models sentence-camembert-large --cores 8-15 --objective latency
+"""
+
+import time
+import logging
+import argparse
+import threading
+
+import numpy as np
+
+import server_embedding
+from server_embedding import compute_embeddings, create_model_runner, load_model
+from cpu_profiles import (
+    CPU_PROFILES_PATH,
+    CPUProfile,
+    available_cores,
+    configure_torch_interop_threads,
+    load_cpu_profiles,
+    save_cpu_profiles,
+)
+
+DEFAULT_SENTENCES = [
+    "Hello, I would like to know the status of my order.",
+    "Yes, that's right.",
+    "No, I don't think so, can you call me back tomorrow morning?",
+    "I received a letter about an unpaid invoice but I already paid it last month by bank transfer.",
+    "What are your opening hours?",
+    "Can you repeat please?",
+    "I want to cancel my subscription because I am moving abroad next month and won't need it anymore.",
+    "Okay, thank you, goodbye.",
+]
+
+
+def parse_cores(cores: str) -> list[int]:
+    """
+    "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    """
+    result = []
+    for part in cores.split(","):
+        start, _, end = part.partition("-")
+        result += range(int(start), int(end or start) + 1)
+    return result
+
+
+def candidate_profiles(cores: list[int]) -> list[CPUProfile]:
+    profiles = [CPUProfile(mode="latency", intra_op_threads=len(cores), cores=cores)]
+    sessions = 2
+    while sessions <= len(cores):
+        profiles.append(
+            CPUProfile(mode="throughput", sessions=sessions, intra_op_threads=len(cores) // sessions, cores=cores)
+        )
+        sessions *= 2
+    return profiles
+
+
+def benchmark_profile(
+    model_name: str, profile: CPUProfile, sentences: list[str], batch_size: int, duration: float
+) -> dict:
+    """
+    Throughput and latency of `compute_embeddings` with 2 clients per session during `duration` seconds.
+    """
+    model = load_model(model_name, warmup=True, cpu_profile=profile)
+    runner = create_model_runner(model_name, model, profile)
+    model_dict = {model_name: model}
+    server_embedding.model_runners[model_name] = runner
+
+    latencies, lock = [], threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(seed: int):
+        rng = np.random.default_rng(seed)
+        while time.perf_counter() < stop_at:
+            # Unique sentences, so that nothing is deduplicated
+            batch = [
+                f"{sentences[i]} {seed}.{rng.integers(1 << 30)}"
+                for i in rng.integers(len(sentences), size=batch_size)
+            ]
+            start = time.perf_counter()
+            compute_embeddings(batch, model_dict, model_name)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(2 * profile.num_sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    del server_embedding.model_runners[model_name]
+    runner.shutdown()
+    return {
+        "throughput_texts_per_s": round(len(latencies) * batch_size / elapsed, 1),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)) * 1000, 2),
+    }
+
+
+def tune_model(
+    model_name: str, cores: list[int], objective: str, sentences: list[str], batch_size: int, duration: float
+) -> CPUProfile:
+    results = []
+    for profile in candidate_profiles(cores):
+        result = benchmark_profile(model_name, profile, sentences, batch_size, duration)
+        logging.info(f"{model_name} {profile.model_dump()}: {result}")
+        results.append((profile, result))
+    if objective == "throughput":
+        best_profile, best_result = max(results, key=lambda r: r[1]["throughput_texts_per_s"])
+    else:
+        best_profile, best_result = min(results, key=lambda r: r[1]["latency_ms_p95"])
+    logging.info(f"{model_name}: best {objective} profile {best_profile.model_dump()}: {best_result}")
+    return best_profile
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", required=True)
+    parser.add_argument("--cores", default=None, help='Cores of the models, e.g. "0-7" (default: all)')
+    parser.add_argument("--objective", choices=["throughput", "latency"], default="throughput")
+    parser.add_argument("--sentences", default=None, help="Text file with one benchmark sentence per line")
+    parser.add_argument("--batch-size", type=int, default=4, help="Sentences per request")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per candidate profile")
+    parser.add_argument("--output", default=CPU_PROFILES_PATH)
+    args = parser.parse_args()
+
+    cores = parse_cores(args.cores) if args.cores else available_cores()
+    sentences = DEFAULT_SENTENCES
+    if args.sentences:
+        with open(args.sentences, encoding="utf-8") as f:
+            sentences = [line.strip() for line in f if line.strip()]
+
+    # All the candidates have the default inter-op threads: benchmark torch models with the pool the server sets up
+    specs = [server_embedding.get_model_spec(model_name) for model_name in args.models]
+    if any(spec.backend == "sentence_transformer" or server_embedding._tei_inprocess(spec) for spec in specs):
+        configure_torch_interop_threads(candidate_profiles(cores))
+    profiles = load_cpu_profiles(args.output)
+    for model_name in args.models:
+        profiles[model_name] = tune_model(model_name, cores, args.objective, sentences, args.batch_size, args.duration)
+        save_cpu_profiles(profiles, args.output)
@@ -102,6 +102,49 @@ def cosine_distance(v1: list[float], v2: list[float]) -> float:
     return 1 - cos_sim
 
 
+def cosine_distance_float16(v1: np.ndarray, v2: np.ndarray) -> float:
+    """
+    Cosine distance between float16 embeddings, accumulated in float32.
+    """
+    return cosine_distance(np.asarray(v1, dtype=np.float32), np.asarray(v2, dtype=np.float32))
+
+
+def cosine_distance_int8(q1: np.ndarray, q2: np.ndarray) -> float:
+    """
+    Cosine distance between int8 quantized embeddings.
+    The per-vector scales cancel out in the cosine, so only the quantized values are needed.
+    """
+    q1 = np.asarray(q1, dtype=np.int32)
+    q2 = np.asarray(q2, dtype=np.int32)
+    cos_sim = np.dot(q1, q2) / (np.sqrt(np.dot(q1, q1)) * np.sqrt(np.dot(q2, q2)))
+    return 1 - float(cos_sim)
+
+
+def hamming_distance(b1: np.ndarray, b2: np.ndarray, dimension: int) -> float:
+    """
+    Normalized Hamming distance (in [0, 1]) between binary embeddings packed into bytes.
+    For sign-quantized embeddings, it approximates angle / pi, so it ranks candidates like the cosine distance.
+    """
+    differing_bits = np.unpackbits(np.bitwise_xor(np.asarray(b1, np.uint8), np.asarray(b2, np.uint8)))
+    return int(differing_bits[:dimension].sum()) / dimension
+
+
+def compact_cosine_distance(e1: np.ndarray, e2: np.ndarray, precision: str, dimension: int | None = None) -> float:
+    """
+    Distance between two embeddings in the same compact format (see compact.py).
+    Binary embeddings need their unpacked `dimension` and use the normalized Hamming distance.
+    """
+    if precision == "float32":
+        return cosine_distance(e1, e2)
+    if precision == "float16":
+        return cosine_distance_float16(e1, e2)
+    if precision == "int8":
+        return cosine_distance_int8(e1, e2)
+    if precision == "binary":
+        return hamming_distance(e1, e2, dimension)
+    raise ValueError(f"Unknown precision: {precision}")
+
+
 async def user_text_matching(
     user_text: str,
     possible_conv_paths: list[(str, str, str)],
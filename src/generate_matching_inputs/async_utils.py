@@ -0,0 +1,357 @@
+"""
+Asyncio DB layer for the user prompt matching extraction.
+
+Same extraction as `process_call_transcript`, but the independent lookups run concurrently over a pooled
+async connection instead of one after another:
+- the UP/AA/AQ text lookups of a source node,
+- the candidate and exact matching lookups of all matchings in a transcript,
+- the lookups of many transcripts at once.
+
+Tables are addressed with lightweight `sa.table` definitions (only the columns we read), so the layer
+can also run against a local SQLite stand-in of the datamodel tables, e.g. in tests.
+
+Usage:
+    asyncio.run(extract_ut_to_conv_path_async(ut_to_conv_path_dir, db_url=...))
+"""
+
+import os
+import json
+import asyncio
+import logging
+import time
+import sys
+from pathlib import Path
+from collections import defaultdict
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.utils import (
+    CALL_TRANSCRIPTS_DIR,
+    ConvPath,
+    UserPrompts,
+    AssistantAnswers,
+    AssistantQuestions,
+    ConversationalPaths,
+    MatchedMessage,
+    build_candidates,
+    get_transcript_store,
+    get_user_text,
+    normalize_text,
+    parse_messages,
+    save_ut_to_conv_path_matching,
+    write_text_file,
+)
+from src.generate_matching_inputs.dataset import default_candidate_sets_dir
+from src.generate_matching_inputs.run_metrics import metrics
+
+# Number of call transcripts processed concurrently, which is also the size of the connection pool
+CONCURRENCY = 32
+
+CONV_PATHS_TABLE = sa.table(
+    ConversationalPaths.__table__.name, *[sa.column(c) for c in ConvPath.model_fields.keys()]
+)
+USER_PROMPTS_TABLE = sa.table(
+    UserPrompts.__table__.name,
+    sa.column("id"),
+    sa.column("text"),
+    sa.column("primary_id"),
+    sa.column("attached_user_prompt_ids"),
+)
+ASSISTANT_ANSWERS_TABLE = sa.table(AssistantAnswers.__table__.name, sa.column("id"), sa.column("text"))
+ASSISTANT_QUESTIONS_TABLE = sa.table(
+    AssistantQuestions.__table__.name, sa.column("id"), sa.column("text")
+)
+
+
+def get_async_engine(db_url: str | None = None, pool_size: int = CONCURRENCY) -> AsyncEngine:
+    """
+    Create a pooled async engine. The URL defaults to the MATCHING_DB_URL environment variable.
+    Plain postgresql:// URLs are switched to the asyncpg driver.
+    """
+    db_url = db_url or os.environ["MATCHING_DB_URL"]
+    if db_url.startswith("postgresql://"):
+        db_url = db_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if db_url.startswith("sqlite"):
+        # SQLite does not use a sized connection pool
+        return create_async_engine(db_url)
+    return create_async_engine(db_url, pool_size=pool_size, max_overflow=0, pool_pre_ping=True)
+
+
+async def _fetch(engine: AsyncEngine, statement) -> list[dict]:
+    # Timed with the wait for a pooled connection: the latency seen by the transcript
+    with metrics.timer("db.async"):
+        async with engine.connect() as conn:
+            result = await conn.execute(statement)
+            return [dict(row) for row in result.mappings()]
+
+
+async def _fetch_texts(engine: AsyncEngine, table, ids: list[str]) -> dict[str, str]:
+    if not ids:
+        return {}
+    rows = await _fetch(engine, sa.select(table.c.id, table.c.text).where(table.c.id.in_(ids)))
+    return {row["id"]: row["text"] for row in rows}
+
+
+def _as_list(value) -> list:
+    # Array columns come back as lists from Postgres, but as JSON strings from a SQLite stand-in
+    if isinstance(value, str):
+        return json.loads(value)
+    return value or []
+
+
+async def async_get_depth2_conv_paths_by_ids_dict(
+    engine: AsyncEngine, matched_messages: list[MatchedMessage]
+) -> dict[str, ConvPath]:
+    """
+    Async version of `get_depth2_conv_paths_by_ids_dict`.
+    """
+    conv_path_ids = {message.conv_path_id for message in matched_messages}
+    if not conv_path_ids:
+        return {}
+    rows = await _fetch(
+        engine,
+        sa.select(CONV_PATHS_TABLE).where(
+            CONV_PATHS_TABLE.c.id.in_(conv_path_ids),
+            CONV_PATHS_TABLE.c.source_node_id.is_not(None),
+        ),
+    )
+    return {row["id"]: ConvPath(**row) for row in rows}
+
+
+async def async_get_conv_paths_from_source_nodes_dict(
+    engine: AsyncEngine, conv_paths: list[ConvPath]
+) -> dict[str, list[ConvPath]]:
+    """
+    Async version of `get_conv_paths_from_source_nodes_dict`.
+    """
+    source_node_ids = {cp.source_node_id for cp in conv_paths}
+    conv_paths_from_source_nodes_dict = defaultdict(list)
+    if not source_node_ids:
+        return conv_paths_from_source_nodes_dict
+    rows = await _fetch(
+        engine,
+        sa.select(CONV_PATHS_TABLE).where(CONV_PATHS_TABLE.c.source_node_id.in_(source_node_ids)),
+    )
+    for row in rows:
+        cp = ConvPath(**row)
+        conv_paths_from_source_nodes_dict[cp.source_node_id].append(cp)
+    return conv_paths_from_source_nodes_dict
+
+
+async def async_extract_matching_candidates_from_source_node(
+    engine: AsyncEngine, source_node_id: str, conv_paths_from_source_nodes_dict: dict
+) -> dict[str, list[str]] | None:
+    """
+    Async version of `extract_matching_candidates_from_source_node`: the UP, AA and AQ texts are fetched concurrently.
+    """
+    conv_paths_from_source_node = conv_paths_from_source_nodes_dict[source_node_id]
+    existing_ups_dict, existing_aas_dict, existing_aqs_dict = await asyncio.gather(
+        _fetch_texts(
+            engine, USER_PROMPTS_TABLE, [cp.user_prompt_id for cp in conv_paths_from_source_node]
+        ),
+        _fetch_texts(
+            engine, ASSISTANT_ANSWERS_TABLE, [cp.assistant_answer_id for cp in conv_paths_from_source_node]
+        ),
+        _fetch_texts(
+            engine,
+            ASSISTANT_QUESTIONS_TABLE,
+            [cp.target_node_id for cp in conv_paths_from_source_node if cp.target_node_id],
+        ),
+    )
+    return build_candidates(
+        conv_paths_from_source_node, existing_ups_dict, existing_aas_dict, existing_aqs_dict
+    )
+
+
+async def async_check_normalized_text_matching(
+    engine: AsyncEngine, ut_query: str, user_prompt_id: str
+) -> bool:
+    """
+    Async version of `check_normalized_text_matching`.
+    """
+    rows = await _fetch(
+        engine, sa.select(USER_PROMPTS_TABLE).where(USER_PROMPTS_TABLE.c.id == user_prompt_id)
+    )
+    if not rows:
+        logging.debug("Error retrieving user prompt: %s.", user_prompt_id)
+        return False
+    user_prompt = rows[0]
+
+    if user_prompt["primary_id"]:
+        # If the user prompt is secondary, compare its text
+        return normalize_text(ut_query) == normalize_text(user_prompt["text"])
+
+    # If the user prompt is primary, compare the texts of the attached (secondary) user prompts
+    attached_up_ids = _as_list(user_prompt["attached_user_prompt_ids"])
+    if not attached_up_ids:
+        return False
+    attached_ups = await _fetch(
+        engine,
+        sa.select(USER_PROMPTS_TABLE.c.text).where(USER_PROMPTS_TABLE.c.id.in_(attached_up_ids)),
+    )
+    for up in attached_ups:
+        if normalize_text(ut_query) == normalize_text(up["text"]):
+            logging.debug('Skipping exact match for user prompt: "%s".', ut_query)
+            return True
+    return False
+
+
+async def async_process_call_transcript(
+    engine: AsyncEngine,
+    call_transcripts_dir: str,
+    ut_to_conv_path_dir: Path,
+    language: str,
+    assistant_id: str,
+    call_id: str,
+    candidate_sets: bool = False,
+) -> int:
+    """
+    Async version of `process_call_transcript`.
+    The exact matching checks and candidate lookups of all matchings of the transcript run concurrently
+    (candidates once per source node), then matchings are saved in conversation order.
+    Return:
+        num_matchings: number of saved matchings
+    """
+    logging.debug("Start processing call transcript: %s / %s", assistant_id, call_id)
+
+    all_messages = get_transcript_store(str(call_transcripts_dir)).read(assistant_id, call_id)
+    conversation, matched_messages = parse_messages(all_messages)
+    depth2_conv_paths_by_ids_dict = await async_get_depth2_conv_paths_by_ids_dict(
+        engine, matched_messages
+    )
+    conv_paths_from_source_nodes_dict = await async_get_conv_paths_from_source_nodes_dict(
+        engine, list(depth2_conv_paths_by_ids_dict.values())
+    )
+
+    # Collect the depth 2 matchings in conversation order, with their user text
+    matchings = []  # (user_text, user_text_idx, message, conv_path)
+    for message in matched_messages:
+        conv_path = depth2_conv_paths_by_ids_dict.get(message.conv_path_id)
+        if conv_path is None:
+            continue
+        user_text = get_user_text(all_messages, message.user_text_idx)
+        matchings.append((user_text, message.user_text_idx, message, conv_path))
+
+    # Run all lookups concurrently: exact matching checks per (user_text, user_prompt), candidates per source node
+    exact_matching_tasks = {}
+    candidates_tasks = {}
+    for user_text, _, message, conv_path in matchings:
+        if message.distance == 0.0:
+            key = (user_text, conv_path.user_prompt_id)
+            if key not in exact_matching_tasks:
+                exact_matching_tasks[key] = async_check_normalized_text_matching(engine, *key)
+        if conv_path.source_node_id not in candidates_tasks:
+            candidates_tasks[conv_path.source_node_id] = (
+                async_extract_matching_candidates_from_source_node(
+                    engine, conv_path.source_node_id, conv_paths_from_source_nodes_dict
+                )
+            )
+    results = await asyncio.gather(*exact_matching_tasks.values(), *candidates_tasks.values())
+    exact_matchings = dict(zip(exact_matching_tasks.keys(), results[: len(exact_matching_tasks)]))
+    candidates_by_source_node = dict(
+        zip(candidates_tasks.keys(), results[len(exact_matching_tasks) :])
+    )
+
+    # Same selection as `process_call_transcript`
+    seen_conv_path_ids = set()
+    matching_id = 0
+    candidate_sets_dir = default_candidate_sets_dir(ut_to_conv_path_dir) if candidate_sets else None
+    for user_text, user_text_idx, message, conv_path in matchings:
+        if conv_path.id in seen_conv_path_ids:
+            continue
+        # Skip exact matching
+        if message.distance == 0.0 and exact_matchings[(user_text, conv_path.user_prompt_id)]:
+            metrics.count("matchings_skipped_exact")
+            continue
+        # Remove matchings with §NO_NEED§ in user prompt candidates
+        candidates = candidates_by_source_node[conv_path.source_node_id]
+        if not candidates:
+            metrics.count("matchings_skipped_no_need")
+            logging.debug(
+                "Remove matching with §NO_NEED§ user prompt candidate in %s / %s", assistant_id, call_id
+            )
+            continue
+
+        save_ut_to_conv_path_matching(
+            Path(f"{ut_to_conv_path_dir}/{language}/{assistant_id}/{call_id}"),
+            language,
+            assistant_id,
+            call_id,
+            matching_id,
+            user_text,
+            user_text_idx,
+            candidates,
+            source_node_id=conv_path.source_node_id,
+            candidate_sets_dir=candidate_sets_dir,
+        )
+        seen_conv_path_ids.add(conv_path.id)
+        matching_id += 1
+
+    # Save conversation only if there is at least one matching
+    if matching_id > 0:
+        write_text_file(
+            Path(f"{ut_to_conv_path_dir}/{language}/{assistant_id}/{call_id}/conversation.json"),
+            json.dumps(conversation),
+        )
+
+    metrics.count("transcripts_processed")
+    logging.debug("Processed call transcript: %s / %s with %d matchings.", assistant_id, call_id, matching_id)
+    return matching_id
+
+
+async def extract_ut_to_conv_path_async(
+    ut_to_conv_path_dir: str,
+    call_transcripts_dir: str = CALL_TRANSCRIPTS_DIR,
+    db_url: str | None = None,
+    concurrency: int = CONCURRENCY,
+    candidate_sets: bool = False,
+):
+    """
+    Async version of `extract_ut_to_conv_path`: up to `concurrency` call transcripts are processed at once
+    in a single process, sharing a connection pool of the same size.
+    """
+    # Imported here to avoid a circular import (extract_up_matchings imports the sync utils only)
+    from src.generate_matching_inputs.extract_up_matchings import iter_call_transcript_chunks
+
+    start = time.time()
+    engine = get_async_engine(db_url, pool_size=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+    num_processed = 0
+
+    async def run(args):
+        nonlocal num_processed
+        try:
+            await async_process_call_transcript(engine, *args)
+            num_processed += 1
+        except Exception as exc:
+            metrics.count("transcripts_failed")
+            logging.error(f"Error in async_process_call_transcript for {args[3]} / {args[4]}: {exc}")
+        finally:
+            semaphore.release()
+
+    try:
+        for chunk in iter_call_transcript_chunks(
+            ut_to_conv_path_dir, call_transcripts_dir, candidate_sets=candidate_sets
+        ):
+            for args in chunk:
+                await semaphore.acquire()  # bounds the number of transcripts in flight
+                task = asyncio.create_task(run(args))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    finally:
+        await engine.dispose()
+
+    logging.info(
+        f"Done extracting matchings from {num_processed} call transcripts. Took {time.time() - start:.2f} seconds."
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(
+        extract_ut_to_conv_path_async(ut_to_conv_path_dir="/www/files/up_matching_dataset/inputs/ut_to_conv_path")
+    )
@@ -0,0 +1,102 @@
+"""
+Benchmark the message parsing of `process_call_transcript` on large synthetic transcripts.
+
+Compares the former parsing (pydantic `Message` objects built twice per message, index lookups in a list,
+exceptions for non-matching messages) with the single-pass `parse_messages`.
+
+Usage:
+    python benchmark_parse_messages.py [num_messages] [num_repeats]
+"""
+
+import random
+import sys
+import timeit
+
+from pydantic import BaseModel
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.utils import parse_messages
+
+
+class Matching(BaseModel):
+    distance: float
+    conv_path_id: str
+    original: str | None = None
+
+
+class Message(BaseModel):
+    role: str
+    text: str
+    matching: Matching
+
+
+def legacy_parse_messages(message_list: list[dict]) -> tuple[list[dict], list[tuple[int, int, str]]]:
+    """
+    Parsing as previously done in `filter_messages_with_up_matching` + the main loop of `process_call_transcript`.
+    """
+    messages_with_up_matching = []
+    messages_with_up_matching_idx = []
+    for i, message in enumerate(message_list):
+        try:
+            messages_with_up_matching.append(Message(**message))
+            messages_with_up_matching_idx.append(i)
+        except Exception:
+            pass
+
+    conversation = []
+    matched = []
+    user_text_idx = -1
+    for idx, message in enumerate(message_list):
+        conversation.append({"role": message["role"], "text": message["text"]})
+        if message["role"] == "USER":
+            user_text_idx = idx
+        try:
+            message = Message(**message)
+            if idx not in messages_with_up_matching_idx:
+                continue
+        except Exception:
+            continue
+        matched.append((idx, user_text_idx, message.matching.conv_path_id))
+    return conversation, matched
+
+
+def make_transcript(num_messages: int, seed: int = 0) -> list[dict]:
+    """
+    Synthetic transcript alternating USER/ASSISTANT messages, with a matching on ~1/3 of the ASSISTANT messages.
+    """
+    rng = random.Random(seed)
+    messages = []
+    for i in range(num_messages):
+        if i % 2 == 0:
+            message = {"role": "USER", "text": "oui, c'est bien ça " * rng.randint(1, 5)}
+            if rng.random() < 0.3:
+                message["matching"] = {"distance": 0.1, "conv_path_id": "x", "original": message["text"]}
+        else:
+            message = {"role": "ASSISTANT", "text": "Très bien, je note. " * rng.randint(1, 5)}
+            if rng.random() < 0.33:
+                message["matching"] = {
+                    "distance": round(rng.random(), 3),
+                    "conv_path_id": f"src_{rng.randint(0, 50)}_aa_aq",
+                }
+        messages.append(message)
+    return messages
+
+
+def main(num_messages: int = 2000, num_repeats: int = 20):
+    messages = make_transcript(num_messages)
+
+    # Both parsers must agree on the matched messages
+    _, legacy_matched = legacy_parse_messages(messages)
+    _, matched = parse_messages(messages)
+    assert legacy_matched == [(m.idx, m.user_text_idx, m.conv_path_id) for m in matched]
+
+    for name, parse in [("legacy", legacy_parse_messages), ("single-pass", parse_messages)]:
+        elapsed = min(timeit.repeat(lambda: parse(messages), number=1, repeat=num_repeats))
+        print(
+            f"{name:>12}: {elapsed * 1000:8.2f} ms per transcript of {num_messages} messages "
+            f"({num_messages / elapsed:,.0f} messages/s)"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,96 @@
+"""
+Readers for the user prompt matching dataset (see README for the layout).
+
+No DB access here, so downstream stages (distance recomputation, model evaluation) can read the dataset
+without the datamodel dependencies.
+
+Normalized datasets store the candidates of a source node once, in candidate_sets/<source_node_id>.json next to
+ut_to_conv_path, and their matchings only reference it with a "source_node_id" field instead of "candidates".
+`read_matching` resolves the reference, so readers see the same matchings in both layouts.
+"""
+
+import os
+import json
+import functools
+from pathlib import Path
+
+from src.generate_matching_inputs.run_metrics import metrics
+
+# Number of candidate sets kept in memory by `load_candidate_set`
+CANDIDATE_SET_CACHE_SIZE = 4096
+
+
+def iter_matching_files(ut_to_conv_path_dir: str | Path):
+    """
+    Lazily yield the matching files of the `ut_to_conv_path` inputs, in a deterministic order.
+    """
+    for dir_path, dir_names, file_names in os.walk(ut_to_conv_path_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names, key=lambda name: (len(name), name)):  # 2.json before 10.json
+            if file_name.endswith(".json") and file_name != "conversation.json":
+                yield Path(dir_path) / file_name
+
+
+def default_candidate_sets_dir(ut_to_conv_path_dir: str | Path) -> Path:
+    """
+    Candidate sets of a ut_to_conv_path tree: next to it, so that they are not read as matchings.
+    """
+    return Path(ut_to_conv_path_dir).parent / "candidate_sets"
+
+
+_saved_candidate_sets = set()  # per process: candidate sets known to be on disk
+
+
+def save_candidate_set(candidate_sets_dir: str | Path, source_node_id: str, candidates: dict) -> bool:
+    """
+    Write the candidates of a source node, unless they are already on disk (first writer wins: rebuild a
+    dataset into a fresh directory). Safe across concurrent workers: files are written then renamed.
+    Return:
+        saved: whether this call wrote the file
+    """
+    path = Path(candidate_sets_dir) / f"{source_node_id}.json"
+    if path in _saved_candidate_sets:
+        return False
+    _saved_candidate_sets.add(path)
+    if path.exists():
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    data = json.dumps(candidates, ensure_ascii=False).encode("utf-8")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+    metrics.count("files_written")
+    metrics.count("bytes_written", len(data))
+    return True
+
+
+@functools.lru_cache(maxsize=CANDIDATE_SET_CACHE_SIZE)
+def _load_candidate_set(path: str) -> dict:
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def load_candidate_set(candidate_sets_dir: str | Path, source_node_id: str) -> dict:
+    """
+    Candidates of a source node, cached: the returned dictionary is shared, do not modify it.
+    """
+    return _load_candidate_set(str(Path(candidate_sets_dir) / f"{source_node_id}.json"))
+
+
+def read_matching(matching_path: Path, candidate_sets_dir: str | Path | None = None) -> dict:
+    """
+    Read a matching file, with its "candidates" resolved from its candidate set in normalized datasets
+    (default `candidate_sets_dir`: the one of the ut_to_conv_path tree of the file).
+    """
+    matching = json.loads(matching_path.read_text(encoding="utf-8"))
+    if "candidates" not in matching:
+        # <ut_to_conv_path_dir>/<language>/<assistant_id>/<call_id>/<matching_id>.json
+        candidate_sets_dir = candidate_sets_dir or default_candidate_sets_dir(matching_path.parents[3])
+        matching["candidates"] = load_candidate_set(candidate_sets_dir, matching["source_node_id"])
+    return matching
+
+
+def matching_key(matching: dict, matching_path: Path) -> str:
+    """
+    Identifier of a matching, shared by the inputs and outputs trees: <language>/<assistant_id>/<call_id>/<matching_id>.
+    """
+    return f"{matching['language']}/{matching['assistant_id']}/{matching['call_id']}/{matching_path.stem}"
@@ -8,43 +8,98 @@ Features:
 - Saves extracted matchings in a structured JSON format for downstream analysis and modeling.
 
 Usage:
-    Run this script to generate matching datasets from raw call transcripts.
+    Run this script to generate matching datasets from raw call transcripts:
+        python src/generate_matching_inputs/extract_up_matchings.py
+    or split the work across N hosts or containers (see sharding.py), then merge once they are all done:
+        python src/generate_matching_inputs/extract_up_matchings.py --shard 0/4  # ... up to --shard 3/4
+        python src/generate_matching_inputs/extract_up_matchings.py --merge 4
+
+Progress (throughput, ETA) is logged every PROGRESS_INTERVAL seconds, and the counters and timers of every stage
+(see run_metrics.py) are written to a JSON run report, by default in <ut_to_conv_path_dir>_reports/.
 """
 
+import os
 import json
+import shutil
+import argparse
 import logging
+import tempfile
 from pathlib import Path
 import concurrent.futures
+import queue
+import threading
 import time
 import sys
 
 sys.path.insert(0, "/www/Embedding")
 from src.generate_matching_inputs.utils import (
-    get_assistant_language,
+    attach_graph_snapshot,
+    available_cpu_count,
+    dump_graph_snapshot,
+    get_assistant_languages,
+    get_transcript_store,
     CALL_TRANSCRIPTS_DIR,
     process_call_transcript,
+    process_call_transcript_chunk,
     process_matching_json_file,
 )
+from src.generate_matching_inputs.dataset import default_candidate_sets_dir, load_candidate_set
+from src.generate_matching_inputs.run_metrics import ProgressReporter, metrics, run_with_metrics
+from src.generate_matching_inputs.sharding import (
+    in_shard,
+    merge_shards,
+    parse_shard,
+    shard_name,
+    shard_up_to_examples_dir,
+    update_shard_manifest,
+)
 
+UT_TO_CONV_PATH_DIR = "/www/files/up_matching_dataset/inputs/ut_to_conv_path"
+UP_TO_EXAMPLES_DIR = "/www/files/up_matching_dataset/inputs/up_to_examples"
 
-def extract_ut_to_conv_path(
-    ut_to_conv_path_dir: str, call_transcripts_dir: str = CALL_TRANSCRIPTS_DIR
-):
+# Number of call transcripts of the same assistant sent to a worker in one task
+CHUNK_SIZE = 32
+# Number of chunks buffered (and in flight) per worker
+QUEUE_DEPTH_PER_WORKER = 2
+
+
+def shard_assistant_ids(call_transcripts_dir: str, shard: tuple[int, int] | None = None) -> list[str]:
     """
-    Walk through all call transcripts and extract user prompt matchings using multiprocessing.
-    Saves the results into JSON files.
+    Assistants of the call transcript store processed by a shard (all of them without sharding).
     """
-    start = time.time()
-    arguments_list = []
+    store = get_transcript_store(str(call_transcripts_dir))
+    return [assistant_id for assistant_id in store.assistant_ids() if in_shard(assistant_id, shard)]
 
-    logging.info("Preparing arguments list for processing call transcripts...")
-    for assistant_dir in Path(call_transcripts_dir).iterdir():
-        assistant_id = assistant_dir.name
-        language = get_assistant_language(assistant_id)
 
-        for call_transcript_path in assistant_dir.iterdir():
-            call_id = Path(call_transcript_path.name).stem
+def iter_call_transcript_chunks(
+    ut_to_conv_path_dir: str,
+    call_transcripts_dir: str = CALL_TRANSCRIPTS_DIR,
+    chunk_size: int = CHUNK_SIZE,
+    shard: tuple[int, int] | None = None,
+    candidate_sets: bool = False,
+):
+    """
+    Lazily walk through the call transcript store and yield chunks of `process_call_transcript` arguments.
+    A chunk only contains call transcripts of a single assistant, so that a worker keeps hitting the same
+    conversational graph (DB pages, caches) and transcript archive while processing it.
+    The language of every assistant is resolved upfront with a single DB query.
+    With `shard` (i, N), only the assistants of shard i are walked through.
+    `candidate_sets` is passed to `process_call_transcript` (normalized dataset, see dataset.py).
+    """
+    store = get_transcript_store(str(call_transcripts_dir))
+    assistant_ids = shard_assistant_ids(call_transcripts_dir, shard)
+    assistant_languages = get_assistant_languages(assistant_ids)
+
+    for assistant_id in assistant_ids:
+        language = assistant_languages.get(assistant_id)
+        if language is None:
+            metrics.count("assistants_skipped")
+            logging.warning(f"Assistant {assistant_id} not found in DB, skipping its call transcripts...")
+            continue
 
+        chunk = []
+        for call_id in store.call_ids(assistant_id):
+            metrics.count("transcripts_scanned")
             # Since the conversation.json is only created after processing all matchings in call transcript,
             # we check if it exists to know whether the transcript has been completely processed.
             # Note that a call transcript without conversation.json can also mean that it has no matchings.
@@ -52,60 +107,275 @@ def extract_ut_to_conv_path(
             if Path(
                 f"{ut_to_conv_path_dir}/{language}/{assistant_id}/{call_id}/conversation.json"
             ).exists():
+                metrics.count("transcripts_skipped")
                 logging.debug(
-                    f"File {call_transcript_path} has already been processed, skipping..."
+                    "Call transcript %s / %s has already been processed, skipping...", assistant_id, call_id
                 )
                 continue
 
-            arguments_list.append(
-                (call_transcript_path, ut_to_conv_path_dir, language, assistant_id, call_id)
+            chunk.append(
+                (str(call_transcripts_dir), ut_to_conv_path_dir, language, assistant_id, call_id, candidate_sets)
             )
-    logging.info(
-        f"Total call transcripts to process: {len(arguments_list)}. Arguments list prepared in {time.time() - start:.2f} seconds."
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _produce_call_transcript_chunks(chunk_queue: queue.Queue, errors: list, *args):
+    """
+    Producer thread: enumerate the call transcripts directory into the bounded `chunk_queue`.
+    A None sentinel marks the end of the enumeration. An enumeration error is appended to `errors`,
+    to be re-raised by the consumer.
+    """
+    try:
+        for chunk in iter_call_transcript_chunks(*args):
+            chunk_queue.put(chunk)  # blocks while the queue is full
+    except Exception as exc:
+        logging.error(f"Error while enumerating call transcripts: {exc}")
+        errors.append(exc)
+    finally:
+        chunk_queue.put(None)
+
+
+def extract_ut_to_conv_path(
+    ut_to_conv_path_dir: str,
+    call_transcripts_dir: str = CALL_TRANSCRIPTS_DIR,
+    max_workers: int | None = None,
+    chunk_size: int = CHUNK_SIZE,
+    shard: tuple[int, int] | None = None,
+    candidate_sets: bool = False,
+    graph_snapshot_dir: str | None = None,
+) -> dict:
+    """
+    Walk through all call transcripts (or those of a shard) and extract user prompt matchings using
+    multiprocessing. Saves the results into JSON files, and the stats of a shard into its manifest.
+    With `graph_snapshot_dir`, the workers read the graph from that snapshot instead of the DB (see
+    graph_snapshot.py).
+
+    Directory enumeration runs in a producer thread and feeds a bounded queue of per-assistant chunks.
+    At most `QUEUE_DEPTH_PER_WORKER * max_workers` chunks are buffered or in flight at any time, and
+    idle workers pull the next chunk from the pool's shared call queue. Memory usage and time to the
+    first processed transcript therefore do not grow with the number of call transcripts.
+    Return:
+        report: counters and timers of the stage, merged from all workers (see run_metrics.py)
+    """
+    start = time.time()
+    metrics.drain()
+    max_workers = max_workers or available_cpu_count()
+    max_pending = QUEUE_DEPTH_PER_WORKER * max_workers
+
+    chunk_queue = queue.Queue(maxsize=max_pending)
+    producer_errors = []
+    producer = threading.Thread(
+        target=_produce_call_transcript_chunks,
+        args=(
+            chunk_queue, producer_errors, ut_to_conv_path_dir, call_transcripts_dir, chunk_size, shard, candidate_sets
+        ),
+        daemon=True,
     )
+    logging.info(f"Start processing call transcripts with {max_workers} workers...")
+    producer.start()
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
-        futures = [executor.submit(process_call_transcript, *args) for args in arguments_list]
-        for future in concurrent.futures.as_completed(futures):
+    num_processed = num_failed_chunks = 0
+    progress = ProgressReporter("Extracted", "transcripts")
+
+    def collect(done):
+        nonlocal num_processed, num_failed_chunks
+        for future in done:
             try:
-                future.result()
+                num_chunk_processed, task_metrics = future.result()
+                num_processed += num_chunk_processed
+                metrics.merge(task_metrics)
             except Exception as exc:
-                logging.error(f"Error in process_call_transcript: {exc}")
-    
+                num_failed_chunks += 1
+                logging.error(f"Error in process_call_transcript_chunk: {exc}")
+        counters = metrics.counters
+        progress.update(
+            counters["transcripts_processed"] + counters["transcripts_failed"],
+            counters["transcripts_scanned"] - counters["transcripts_skipped"],
+            total_known=not producer.is_alive(),
+        )
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers, initializer=attach_graph_snapshot, initargs=(graph_snapshot_dir,)
+    ) as executor:
+        pending = set()
+        while (chunk := chunk_queue.get()) is not None:
+            if len(pending) >= max_pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                collect(done)
+            pending.add(executor.submit(run_with_metrics, process_call_transcript_chunk, chunk))
+        for future in concurrent.futures.as_completed(pending):
+            collect([future])
+    producer.join()
+    if producer_errors:
+        # A partial enumeration (e.g. the DB query of the assistant languages failed) is not a successful run
+        raise producer_errors[0]
+
     logging.info(
-        f"Done extracting matchings from call transcripts. Took {time.time() - start:.2f} seconds."
+        f"Done extracting matchings from {num_processed} call transcripts. Took {time.time() - start:.2f} seconds."
     )
+    report = metrics.report(time.time() - start)
+    if shard is not None:
+        update_shard_manifest(
+            ut_to_conv_path_dir,
+            shard,
+            "extract",
+            assistant_ids=shard_assistant_ids(call_transcripts_dir, shard),
+            num_processed=num_processed,
+            num_failed_chunks=num_failed_chunks,
+            seconds=round(time.time() - start, 2),
+        )
+    return report
 
 
-def etract_up_to_examples(up_to_examples_dir: str, ut_to_conv_path_dir: str):
+def etract_up_to_examples(
+    up_to_examples_dir: str,
+    ut_to_conv_path_dir: str,
+    shard: tuple[int, int] | None = None,
+    graph_snapshot_dir: str | None = None,
+) -> dict:
+    """
+    Save the up_to_examples of the candidates of all matching files (or those of the assistants of a shard,
+    into the directory of the shard, see sharding.py).
+    In normalized datasets, every candidate set is processed once, however many matchings reference it.
+    With `graph_snapshot_dir`, the user prompts are read from that snapshot instead of the DB.
+    Return:
+        report: counters and timers of the stage, merged from all workers (see run_metrics.py)
+    """
     start = time.time()
+    metrics.drain()
     logging.info("Preparing arguments list for generating up_to_examples...")
     arguments_list = []
+    # <language>/<assistant_id>/<call_id>/<matching_id>.json
     matching_json_files = [
         file for file in Path(ut_to_conv_path_dir).rglob("*.json") 
         if file.name != "conversation.json"
+        and in_shard(file.relative_to(ut_to_conv_path_dir).parts[1], shard)
     ]
+    up_to_examples_dir = shard_up_to_examples_dir(up_to_examples_dir, shard)
+    candidate_sets_dir = default_candidate_sets_dir(ut_to_conv_path_dir)
+    source_node_ids = set()
     for file in matching_json_files:
-        candidates = json.loads(file.read_text(encoding="utf-8"))["candidates"]
-        arguments_list.append((up_to_examples_dir, candidates))
-    
-    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
-        futures = [executor.submit(process_matching_json_file, *args) for args in arguments_list]
-        for future in concurrent.futures.as_completed(futures):
+        matching = json.loads(file.read_text(encoding="utf-8"))
+        if "candidates" in matching:
+            arguments_list.append((up_to_examples_dir, matching["candidates"]))
+        elif matching["source_node_id"] not in source_node_ids:
+            source_node_ids.add(matching["source_node_id"])
+            candidates = load_candidate_set(candidate_sets_dir, matching["source_node_id"])
+            arguments_list.append((up_to_examples_dir, candidates))
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=4, initializer=attach_graph_snapshot, initargs=(graph_snapshot_dir,)
+    ) as executor:
+        futures = [executor.submit(run_with_metrics, process_matching_json_file, *args) for args in arguments_list]
+        progress = ProgressReporter("up_to_examples", "candidate sets")
+        for num_done, future in enumerate(concurrent.futures.as_completed(futures), 1):
             try:
-                future.result()
+                _, task_metrics = future.result()
+                metrics.merge(task_metrics)
+                metrics.count("candidate_sets_processed")
             except Exception as exc:
+                metrics.count("candidate_sets_failed")
                 logging.error(f"Error in process_matching_json_file: {exc}")
+            progress.update(num_done, len(futures))
     logging.info(f"Done processing {len(matching_json_files)} matching JSON files in {time.time() - start:.2f} seconds.")
+    metrics.count("matching_files_read", len(matching_json_files))
+    report = metrics.report(time.time() - start)
+    if shard is not None:
+        update_shard_manifest(
+            ut_to_conv_path_dir,
+            shard,
+            "up_to_examples",
+            up_to_examples_dir=str(up_to_examples_dir),
+            num_matching_files=len(matching_json_files),
+            seconds=round(time.time() - start, 2),
+        )
+    return report
 
 
+def default_report_path(ut_to_conv_path_dir: str | Path, shard: tuple[int, int] | None = None) -> Path:
+    # One report per run (and per shard), alongside the shard manifests
+    shard_suffix = f"_shard-{shard_name(shard)}" if shard is not None else ""
+    return Path(f"{ut_to_conv_path_dir}_reports") / f"{time.strftime('%Y%m%d-%H%M%S')}{shard_suffix}.json"
 
 
 if __name__ == "__main__":
-    extract_ut_to_conv_path(ut_to_conv_path_dir="/www/files/up_matching_dataset/inputs/ut_to_conv_path")
-
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ut-to-conv-path-dir", default=UT_TO_CONV_PATH_DIR)
+    parser.add_argument("--up-to-examples-dir", default=UP_TO_EXAMPLES_DIR)
+    parser.add_argument("--call-transcripts-dir", default=CALL_TRANSCRIPTS_DIR)
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--shard", type=parse_shard, default=None, help='Process only shard "i/N" (0 <= i < N)')
+    parser.add_argument("--merge", type=int, default=None, metavar="N", help="Merge the outputs of N shards")
+    parser.add_argument(
+        "--candidate-sets", action="store_true", help="Save the candidates once per source node (see dataset.py)"
+    )
+    parser.add_argument(
+        "--graph-snapshot",
+        action="store_true",
+        help="Read the graph once into a snapshot shared by the workers, instead of querying it in every worker",
+    )
+    parser.add_argument(
+        "--report", default=None, help="Path of the JSON run report (default: in <ut_to_conv_path_dir>_reports)"
+    )
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(levelname)s - %(message)s")
 
-    etract_up_to_examples(up_to_examples_dir="/www/files/up_matching_dataset/inputs/up_to_examples",
-                             ut_to_conv_path_dir="/www/files/up_matching_dataset/inputs/ut_to_conv_path")
+    if args.merge is not None:
+        manifest = merge_shards(args.ut_to_conv_path_dir, args.up_to_examples_dir, args.merge)
+        logging.info(
+            f"Merged {args.merge} shards: {manifest['num_up_to_examples_merged']} up_to_examples "
+            f"({manifest['num_up_to_examples_duplicates']} duplicates dropped)."
+        )
+    else:
+        run_start = time.time()
+        stages = {}
+        graph_snapshot_dir = None
+        if args.graph_snapshot:
+            # Shared memory when available, the snapshot is only needed during the run
+            graph_snapshot_dir = tempfile.mkdtemp(
+                prefix="graph_snapshot_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+            )
+            metrics.drain()
+            snapshot_start = time.time()
+            dump_graph_snapshot(graph_snapshot_dir)
+            stages["graph_snapshot"] = metrics.report(time.time() - snapshot_start)
+        try:
+            stages["extract"] = extract_ut_to_conv_path(
+                ut_to_conv_path_dir=args.ut_to_conv_path_dir,
+                call_transcripts_dir=args.call_transcripts_dir,
+                max_workers=args.max_workers,
+                shard=args.shard,
+                candidate_sets=args.candidate_sets,
+                graph_snapshot_dir=graph_snapshot_dir,
+            )
+            stages["up_to_examples"] = etract_up_to_examples(
+                up_to_examples_dir=args.up_to_examples_dir,
+                ut_to_conv_path_dir=args.ut_to_conv_path_dir,
+                shard=args.shard,
+                graph_snapshot_dir=graph_snapshot_dir,
+            )
+        finally:
+            if graph_snapshot_dir is not None:
+                shutil.rmtree(graph_snapshot_dir, ignore_errors=True)
+            report_path = Path(args.report or default_report_path(args.ut_to_conv_path_dir, args.shard))
+            report_path.parent.mkdir(parents=True, exist_ok=True)
+            report = {
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(run_start)),
+                "seconds": round(time.time() - run_start, 3),
+                "shard": shard_name(args.shard) if args.shard is not None else None,
+                "max_workers": args.max_workers or available_cpu_count(),
+                "candidate_sets": args.candidate_sets,
+                "graph_snapshot": args.graph_snapshot,
+                "stages": stages,
+            }
+            report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+            logging.info(f"Run report saved to {report_path}")
 
 
@@ -0,0 +1,213 @@
+"""
+Read-only snapshot of the conversational graph, shared by the worker processes of the extraction.
+
+The parent process dumps the tables read by the extraction once (see `utils.dump_graph_snapshot`) into a
+directory of .npy files, in /dev/shm when available. Every worker attaches it with `np.load(mmap_mode="r")`:
+the pages are shared by all the workers through the page cache instead of being copied, and the workers stop
+querying the DB for the graph. Lookups are binary searches on sorted 64-bit hashes of the IDs.
+
+Layout, strings being indices into one UTF-8 string table (-1 for None):
+    strings.npy, string_offsets.npy         all IDs and texts, deduplicated
+    conv_paths_*.npy                        id, source_node_id, user_prompt_id, assistant_answer_id, target_node_id
+    conv_paths_by_source_*.npy              conv path rows sorted by source node
+    user_prompts_*.npy                      id, text, primary_id, and attached_user_prompt_ids (CSR)
+    assistant_answers_*.npy, assistant_questions_*.npy     id, text
+No DB access here.
+"""
+
+import json
+import hashlib
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+CONV_PATH_FIELDS = ("id", "source_node_id", "user_prompt_id", "assistant_answer_id", "target_node_id")
+TEXT_TABLES = ("user_prompts", "assistant_answers", "assistant_questions")
+
+
+class UserPromptRecord(NamedTuple):
+    # Same attributes as the UserPrompts rows read by the extraction
+    id: str
+    text: str
+    primary_id: str | None
+    attached_user_prompt_ids: list[str]
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _hashes(keys) -> np.ndarray:
+    return np.fromiter((_hash(key) for key in keys), dtype=np.uint64)
+
+
+def _attached_ids(value) -> list[str]:
+    # JSON column: a list, or its serialized form
+    if isinstance(value, str):
+        value = json.loads(value)
+    return list(value or [])
+
+
+class _StringTable:
+    def __init__(self):
+        self.indices = {}
+        self.strings = []
+
+    def add(self, value: str | None) -> int:
+        if value is None:
+            return -1
+        index = self.indices.get(value)
+        if index is None:
+            index = self.indices[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def save(self, path: Path):
+        encoded = [s.encode("utf-8") for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        np.save(path / "strings.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        np.save(path / "string_offsets.npy", offsets)
+
+
+def _save_sorted(path: Path, name: str, keys: list[str], rows: np.ndarray) -> np.ndarray:
+    """
+    Save `rows` sorted by the hash of their key, and return the sort order.
+    """
+    hashes = _hashes(keys)
+    order = np.argsort(hashes, kind="stable")
+    np.save(path / f"{name}_hash.npy", hashes[order])
+    np.save(path / f"{name}_rows.npy", rows[order])
+    return order
+
+
+def build_graph_snapshot(
+    path: str | Path,
+    conv_paths: list[dict],
+    user_prompts: list[dict],
+    assistant_answers: list[dict],
+    assistant_questions: list[dict],
+) -> Path:
+    """
+    Write a snapshot from the rows of the tables: conv paths with the ConvPath fields, user prompts with
+    id, text, primary_id and attached_user_prompt_ids, assistant answers and questions with id and text.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    strings = _StringTable()
+
+    conv_path_rows = np.array(
+        [[strings.add(cp.get(field)) for field in CONV_PATH_FIELDS] for cp in conv_paths], dtype=np.int32
+    ).reshape(-1, len(CONV_PATH_FIELDS))
+    order = _save_sorted(path, "conv_paths", [cp["id"] for cp in conv_paths], conv_path_rows)
+    # Position of every conv path in the sorted rows, grouped by source node
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    source_hashes = _hashes(cp["source_node_id"] or "" for cp in conv_paths)
+    by_source = np.argsort(source_hashes, kind="stable")
+    np.save(path / "conv_paths_by_source_hash.npy", source_hashes[by_source])
+    np.save(path / "conv_paths_by_source_rows.npy", position[by_source].astype(np.int32))
+
+    user_prompt_rows = np.array(
+        [[strings.add(up["id"]), strings.add(up["text"]), strings.add(up.get("primary_id"))] for up in user_prompts],
+        dtype=np.int32,
+    ).reshape(-1, 3)
+    attached = [[strings.add(i) for i in _attached_ids(up.get("attached_user_prompt_ids"))] for up in user_prompts]
+    order = _save_sorted(path, "user_prompts", [up["id"] for up in user_prompts], user_prompt_rows)
+    attached = [attached[i] for i in order]
+    offsets = np.zeros(len(attached) + 1, dtype=np.int64)
+    np.cumsum([len(ids) for ids in attached], out=offsets[1:])
+    np.save(path / "user_prompts_attached_offsets.npy", offsets)
+    np.save(path / "user_prompts_attached.npy", np.fromiter((i for ids in attached for i in ids), dtype=np.int32))
+
+    for name, rows in (("assistant_answers", assistant_answers), ("assistant_questions", assistant_questions)):
+        text_rows = np.array([[strings.add(r["id"]), strings.add(r["text"])] for r in rows], dtype=np.int32)
+        _save_sorted(path, name, [r["id"] for r in rows], text_rows.reshape(-1, 2))
+
+    strings.save(path)
+    return path
+
+
+class GraphSnapshot:
+    """
+    Read-only view of a snapshot: memory-mapped, cheap to open in every worker.
+    """
+
+    def __init__(self, path: str | Path):
+        path = Path(path)
+        self.path = path
+        self._arrays = {file.stem: np.load(file, mmap_mode="r") for file in path.glob("*.npy")}
+        self._strings = self._arrays["strings"]
+        self._string_offsets = self._arrays["string_offsets"]
+
+    def _string(self, index: int) -> str | None:
+        if index < 0:
+            return None
+        start, end = self._string_offsets[index], self._string_offsets[index + 1]
+        return self._strings[start:end].tobytes().decode("utf-8")
+
+    def _row(self, table: str, key: str) -> int | None:
+        """
+        Row of a key in a table sorted by hash (collisions are resolved on the key itself).
+        """
+        hashes = self._arrays[f"{table}_hash"]
+        key_hash = np.uint64(_hash(key))
+        row = int(np.searchsorted(hashes, key_hash))
+        rows = self._arrays[f"{table}_rows"]
+        while row < len(hashes) and hashes[row] == key_hash:
+            if self._string(int(rows[row, 0])) == key:
+                return row
+            row += 1
+        return None
+
+    def _conv_path(self, row: int) -> dict:
+        return dict(zip(CONV_PATH_FIELDS, (self._string(int(i)) for i in self._arrays["conv_paths_rows"][row])))
+
+    def conv_paths(self, conv_path_ids) -> list[dict]:
+        """
+        Rows of the given conv paths (missing ones are skipped).
+        """
+        rows = (self._row("conv_paths", conv_path_id) for conv_path_id in conv_path_ids)
+        return [self._conv_path(row) for row in rows if row is not None]
+
+    def conv_paths_from_source_nodes(self, source_node_ids) -> list[dict]:
+        hashes = self._arrays["conv_paths_by_source_hash"]
+        rows = self._arrays["conv_paths_by_source_rows"]
+        conv_paths = []
+        for source_node_id in source_node_ids:
+            key_hash = np.uint64(_hash(source_node_id))
+            start, end = np.searchsorted(hashes, key_hash, "left"), np.searchsorted(hashes, key_hash, "right")
+            for row in rows[start:end]:
+                conv_path = self._conv_path(int(row))
+                if conv_path["source_node_id"] == source_node_id:
+                    conv_paths.append(conv_path)
+        return conv_paths
+
+    def texts(self, table: str, ids) -> dict[str, str]:
+        """
+        id -> text of the given rows of one of TEXT_TABLES (missing ones are skipped).
+        """
+        texts = {}
+        for key in ids:
+            row = self._row(table, key) if key is not None else None
+            if row is not None:
+                texts[key] = self._string(int(self._arrays[f"{table}_rows"][row, 1]))
+        return texts
+
+    def user_prompts(self, user_prompt_ids) -> dict[str, UserPromptRecord]:
+        records = {}
+        offsets = self._arrays["user_prompts_attached_offsets"]
+        attached = self._arrays["user_prompts_attached"]
+        for user_prompt_id in user_prompt_ids:
+            row = self._row("user_prompts", user_prompt_id)
+            if row is None:
+                continue
+            _, text, primary_id = self._arrays["user_prompts_rows"][row]
+            records[user_prompt_id] = UserPromptRecord(
+                user_prompt_id,
+                self._string(int(text)),
+                self._string(int(primary_id)),
+                [self._string(int(i)) for i in attached[offsets[row] : offsets[row + 1]]],
+            )
+        return records
@@ -0,0 +1,80 @@
+"""
+Migrate a call transcript store to another layout and/or compression, e.g. the legacy tree of indented JSON
+files to per-assistant packed zstd archives:
+
+    python migrate_transcripts.py /www/files/call_transcripts /www/files/call_transcripts_packed --layout packed --compression zstd
+
+Calls already present in the destination are skipped, so an interrupted migration can simply be restarted.
+The source store is left untouched; swap the directories once the migration is verified.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import time
+import sys
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.transcript_store import open_transcript_store
+
+
+def migrate_assistant(src_dir: str, dst_dir: str, assistant_id: str) -> int:
+    """
+    Copy the call transcripts of one assistant from the source store to the destination store.
+    Return:
+        num_migrated: number of call transcripts written to the destination
+    """
+    src_store = open_transcript_store(src_dir)
+    dst_store = open_transcript_store(dst_dir)
+    migrated_call_ids = dst_store.call_ids(assistant_id)
+    num_migrated = 0
+    for call_id in sorted(src_store.call_ids(assistant_id) - migrated_call_ids):
+        dst_store.write(assistant_id, call_id, src_store.read(assistant_id, call_id))
+        num_migrated += 1
+    return num_migrated
+
+
+def migrate_transcripts(
+    src_dir: str, dst_dir: str, layout: str = "packed", compression: str | None = "zstd", max_workers: int = 4
+) -> int:
+    """
+    Migrate all call transcripts from `src_dir` to a store at `dst_dir`, one assistant per task.
+    """
+    start = time.time()
+    src_store = open_transcript_store(src_dir)
+    open_transcript_store(dst_dir, layout, compression)  # create the destination store before workers use it
+
+    num_migrated = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(migrate_assistant, src_dir, dst_dir, assistant_id): assistant_id
+            for assistant_id in src_store.assistant_ids()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                num_migrated += future.result()
+            except Exception as exc:
+                logging.error(f"Error migrating call transcripts of assistant {futures[future]}: {exc}")
+    logging.info(
+        f"Migrated {num_migrated} call transcripts to {dst_dir}. Took {time.time() - start:.2f} seconds."
+    )
+    return num_migrated
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("src_dir")
+    parser.add_argument("dst_dir")
+    parser.add_argument("--layout", choices=["files", "packed"], default="packed")
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default="zstd")
+    parser.add_argument("--max-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    migrate_transcripts(
+        args.src_dir,
+        args.dst_dir,
+        args.layout,
+        None if args.compression == "none" else args.compression,
+        args.max_workers,
+    )
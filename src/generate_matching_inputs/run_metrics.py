@@ -0,0 +1,132 @@
+"""
+Counters and timers of the matching extraction, for progress logs and the JSON run report.
+
+Every process has its own `metrics`. Work sent to a worker process goes through `run_with_metrics`, which returns
+the metrics of that task with its result, so that the parent merges them into its own:
+    future = executor.submit(run_with_metrics, process_call_transcript_chunk, chunk)
+    num_processed, task_metrics = future.result()
+    metrics.merge(task_metrics)
+No DB access here.
+"""
+
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Seconds between two progress logs
+PROGRESS_INTERVAL = 30
+
+
+class RunMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()  # the parent counts from its producer thread too
+        self.counters = Counter()
+        self.timers = {}  # name -> [count, total seconds, max seconds]
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def drain(self) -> dict:
+        """
+        Metrics accumulated since the last drain, and reset them.
+        """
+        with self._lock:
+            drained = {"counters": dict(self.counters), "timers": self.timers}
+            self.counters = Counter()
+            self.timers = {}
+        return drained
+
+    def merge(self, other: dict):
+        with self._lock:
+            self.counters.update(other["counters"])
+            for name, (count, total, maximum) in other["timers"].items():
+                timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+                timer[0] += count
+                timer[1] += total
+                timer[2] = max(timer[2], maximum)
+
+    def report(self, seconds: float) -> dict:
+        """
+        JSON-serializable summary of a stage that took `seconds`.
+        """
+        with self._lock:
+            return {
+                "seconds": round(seconds, 3),
+                "counters": dict(sorted(self.counters.items())),
+                "timers": {
+                    name: {
+                        "count": count,
+                        "total_s": round(total, 3),
+                        "mean_ms": round(1000 * total / count, 3) if count else None,
+                        "max_ms": round(1000 * maximum, 3),
+                    }
+                    for name, (count, total, maximum) in sorted(self.timers.items())
+                },
+            }
+
+
+metrics = RunMetrics()
+
+
+def run_with_metrics(fn, *args):
+    """
+    Worker-side wrapper: `(fn(*args), metrics of this call)`.
+    """
+    metrics.drain()  # inherited from the parent at fork, or left by a failed task
+    return fn(*args), metrics.drain()
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class ProgressReporter:
+    """
+    Log the progress of a stage every `interval` seconds: done / total, throughput and ETA.
+    The total may only be known once the enumeration of the work is over (`total_known`).
+    """
+
+    def __init__(self, name: str, unit: str, interval: float = PROGRESS_INTERVAL):
+        self.name = name
+        self.unit = unit
+        self.interval = interval
+        self.start = self._last_log = time.monotonic()
+
+    def update(self, done: int, total: int, total_known: bool = True, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_log < self.interval:
+            return
+        self._last_log = now
+        elapsed = now - self.start
+        rate = done / elapsed if elapsed > 0 else 0.0
+        if not total_known:
+            eta = "enumerating"
+        elif rate > 0:
+            eta = _format_duration(max(total - done, 0) / rate)
+        else:
+            eta = "unknown"
+        percent = f" ({100 * done / total:.1f}%)" if total else ""
+        logging.info(
+            "%s: %d/%d %s%s, %.1f %s/s, elapsed %s, ETA %s",
+            self.name, done, total, self.unit, percent, rate, self.unit, _format_duration(elapsed), eta,
+        )
@@ -1,10 +1,20 @@
 """
 Save call transcripts for all assistants in production to JSON files.
+
+Two modes:
+- `save_call_transcripts_to_json`: save the last N completed calls of every assistant, one ORM query per assistant.
+- `export_call_transcripts` (bulk mode): stream the id and transcript columns of all completed calls with a
+  server-side cursor, skip already exported calls and write compact, optionally compressed, transcripts.
+  A `dt_started` watermark is kept per assistant so that later runs only export newer calls.
+Transcripts are written through the call transcript store (see transcript_store.py), either one file per call
+or one packed archive per assistant.
 """
 
-import json
+import sys
 import logging
 import time
+import argparse
+from datetime import datetime
 from pathlib import Path
 import concurrent.futures
 import sqlmodel as sm
@@ -14,7 +24,14 @@ import vocal.common.static  # noqa: E402,F401
 from getvocal.datamodel.sql.assistants import Assistants
 from getvocal.datamodel.sql.calls import Calls
 
-from utils import CALL_TRANSCRIPTS_DIR
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.utils import CALL_TRANSCRIPTS_DIR, get_engine
+from src.generate_matching_inputs.transcript_store import open_transcript_store
+
+# Number of rows fetched per round trip by the server-side cursor
+EXPORT_PAGE_SIZE = 500
+# Directory (in the store) holding one file per assistant with the `dt_started` of the most recent exported call
+WATERMARKS_DIR = ".watermarks"
 
 
 def process_call(
@@ -45,20 +62,18 @@ def process_call(
         logging.debug(f"Found no completed calls for assistant {assistant_id}.")
         return
 
-    output_dir = Path(f"{save_to_dir}/{assistant_id}")
+    store = open_transcript_store(save_to_dir)
 
     for call in calls:
-        file_path = Path(f"{output_dir}/{call.id}.json")
-        if file_path.exists():
+        if store.contains(assistant_id, call.id):
             logging.debug(f"Skipping call transcript {call.id}: already processed.")
             continue
         if not call.conversation_transcript:
             logging.debug(f"Found no transcript for call {call.id}.")
             continue
 
-        output_dir.mkdir(parents=True, exist_ok=True)
-        file_path.write_text(json.dumps(call.conversation_transcript, indent=2))
-        logging.info(f"Saved transcript to {file_path}")
+        store.write(assistant_id, call.id, call.conversation_transcript)
+        logging.info(f"Saved transcript of call {call.id} to {save_to_dir}")
 
 
 def save_call_transcripts_to_json(
@@ -85,8 +100,124 @@ def save_call_transcripts_to_json(
                 continue
 
 
+def read_watermark(save_to_dir: str, assistant_id: str) -> datetime | None:
+    watermark_path = Path(f"{save_to_dir}/{WATERMARKS_DIR}/{assistant_id}")
+    if not watermark_path.exists():
+        return None
+    return datetime.fromisoformat(watermark_path.read_text().strip())
+
+
+def write_watermark(save_to_dir: str, assistant_id: str, watermark: datetime):
+    watermarks_dir = Path(f"{save_to_dir}/{WATERMARKS_DIR}")
+    watermarks_dir.mkdir(parents=True, exist_ok=True)
+    # Write then rename, so that an interrupted export never leaves a truncated watermark
+    tmp_path = watermarks_dir / f"{assistant_id}.tmp"
+    tmp_path.write_text(watermark.isoformat())
+    tmp_path.replace(watermarks_dir / assistant_id)
+
+
+def export_calls(
+    assistant_id: str,
+    save_to_dir: str = CALL_TRANSCRIPTS_DIR,
+    layout: str | None = None,
+    compression: str | None = None,
+    since_last_export: bool = True,
+    page_size: int = EXPORT_PAGE_SIZE,
+) -> int:
+    """
+    Bulk export all completed call transcripts of an assistant.
+    Only the id, dt_started and transcript columns are selected, and rows are streamed in pages of `page_size`
+    through a server-side cursor, ordered by `dt_started`.
+    Args:
+        assistant_id: The assistant whose calls are exported.
+        save_to_dir: Directory of the call transcript store.
+        layout: Layout of a new store, "files" or "packed" (see `open_transcript_store`).
+        compression: Compression of new transcripts, None (plain JSON), "gzip" or "zstd".
+        since_last_export: Only export calls started at or after the watermark of the previous export.
+            Calls already exported are skipped in any case, so a full pass (False) only writes missing calls.
+        page_size: Number of rows fetched per round trip.
+    Return:
+        num_exported: number of call transcripts written
+    """
+    store = open_transcript_store(save_to_dir, layout, compression)
+    exported_call_ids = store.call_ids(assistant_id)  # single directory listing / index read
+    watermark = read_watermark(save_to_dir, assistant_id) if since_last_export else None
+
+    statement = select(Calls.id, Calls.dt_started, Calls.conversation_transcript).where(
+        (Calls.assistant_id == assistant_id) & (Calls.status == "completed")
+    )
+    if watermark is not None:
+        # >= since calls started at the same time as the watermark may not all have been exported yet
+        statement = statement.where(Calls.dt_started >= watermark)
+    statement = statement.order_by(Calls.dt_started)
+
+    num_exported = 0
+    latest_dt_started = watermark
+    with get_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=page_size).execute(statement)
+        for page in result.partitions():
+            for call_id, dt_started, transcript in page:
+                latest_dt_started = dt_started
+                if call_id in exported_call_ids or not transcript:
+                    continue
+                store.write(assistant_id, call_id, transcript)
+                exported_call_ids.add(call_id)
+                num_exported += 1
+            # The watermark only moves forward once a whole page is written, so an interrupted export resumes safely
+            if latest_dt_started is not None:
+                write_watermark(save_to_dir, assistant_id, latest_dt_started)
+
+    logging.info(f"Exported {num_exported} call transcripts for assistant {assistant_id}.")
+    return num_exported
+
+
+def export_call_transcripts(
+    save_to_dir: str = CALL_TRANSCRIPTS_DIR,
+    layout: str | None = None,
+    compression: str | None = None,
+    since_last_export: bool = True,
+    max_workers: int = 4,
+):
+    """
+    Bulk export the completed call transcripts of all assistants in production, one assistant per task.
+    """
+    logging.info("Fetching all assistants in production...")
+    all_assistants = Assistants.query(
+        sm.select(Assistants.id).where(Assistants.settings["version"] == "prod")
+    )
+    open_transcript_store(save_to_dir, layout, compression)  # create the store before workers use it
+
+    num_exported = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                export_calls, assistant["id"], save_to_dir, layout, compression, since_last_export
+            )
+            for assistant in all_assistants
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                num_exported += future.result()
+            except Exception as e:
+                logging.error(f"Error exporting calls: {e}")
+    logging.info(f"Exported {num_exported} call transcripts in total.")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bulk", action="store_true", help="Bulk export all completed calls")
+    parser.add_argument("--layout", choices=["files", "packed"], default=None, help="Layout of a new store")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default=None, help="Bulk export compression")
+    parser.add_argument("--full", action="store_true", help="Bulk export ignoring the since-last-export watermark")
+    parser.add_argument("--num-calls", type=int, default=2, help="Number of most recent calls per assistant")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
     start = time.time()
-    save_call_transcripts_to_json(2, CALL_TRANSCRIPTS_DIR)
+    if args.bulk:
+        export_call_transcripts(
+            CALL_TRANSCRIPTS_DIR, args.layout, args.compression, since_last_export=not args.full
+        )
+    else:
+        save_call_transcripts_to_json(args.num_calls, CALL_TRANSCRIPTS_DIR)
     logging.info(f"Done saving call transcripts to {CALL_TRANSCRIPTS_DIR}. Took {time.time() - start:.2f} seconds.")
-
@@ -0,0 +1,131 @@
+"""
+Deterministic sharding of the matching extraction across hosts or containers.
+
+Every assistant belongs to exactly one of N shards, from a stable hash of its ID (the same on every host and
+Python process, unlike `hash()`). Shard i/N (0 <= i < N) only processes the call transcripts of its assistants:
+    - ut_to_conv_path files are written under <language>/<assistant_id>/, so shards never write the same files
+    - up_to_examples files are keyed by conv_path_id, which several shards may produce: each shard writes them
+      to its own directory, <up_to_examples_dir>_shards/<i>-of-<N>/, deduplicated by `merge_shards`
+    - each shard records what it did in <ut_to_conv_path_dir>_manifests/shard-<i>-of-<N>.json
+
+Once all the shards are done, `merge_shards` checks that their manifests cover N disjoint slices, moves the
+up_to_examples of all the shards into <up_to_examples_dir> (first shard wins) and writes the combined manifest.
+No DB access here.
+"""
+
+import json
+import time
+import shutil
+import hashlib
+from pathlib import Path
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """
+    Parse "i/N" into (i, N), with 0 <= i < N.
+    """
+    try:
+        index, num_shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f'Invalid shard "{value}", expected "i/N"')
+    if not 0 <= index < num_shards:
+        raise ValueError(f'Invalid shard "{value}", expected 0 <= i < N')
+    return index, num_shards
+
+
+def shard_name(shard: tuple[int, int]) -> str:
+    return f"{shard[0]}-of-{shard[1]}"
+
+
+def shard_of(assistant_id: str, num_shards: int) -> int:
+    """
+    Shard of an assistant: stable across hosts and processes.
+    """
+    digest = hashlib.sha1(assistant_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def in_shard(assistant_id: str, shard: tuple[int, int] | None) -> bool:
+    return shard is None or shard_of(assistant_id, shard[1]) == shard[0]
+
+
+def shard_up_to_examples_dir(up_to_examples_dir: str | Path, shard: tuple[int, int] | None) -> Path:
+    """
+    Directory where a shard writes its up_to_examples files (the final directory without sharding).
+    """
+    if shard is None:
+        return Path(up_to_examples_dir)
+    return Path(f"{up_to_examples_dir}_shards") / shard_name(shard)
+
+
+def manifests_dir(ut_to_conv_path_dir: str | Path) -> Path:
+    # Next to ut_to_conv_path, not inside: every other .json file in there is read as a matching
+    return Path(f"{ut_to_conv_path_dir}_manifests")
+
+
+def update_shard_manifest(ut_to_conv_path_dir: str | Path, shard: tuple[int, int], stage: str, **stats):
+    """
+    Record the stats of a stage ("extract", "up_to_examples") in the manifest of a shard.
+    """
+    path = manifests_dir(ut_to_conv_path_dir) / f"shard-{shard_name(shard)}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    manifest = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+    manifest.update({"shard": shard[0], "num_shards": shard[1]})
+    manifest[stage] = {**stats, "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+
+def merge_shards(ut_to_conv_path_dir: str | Path, up_to_examples_dir: str | Path, num_shards: int) -> dict:
+    """
+    Merge the outputs of the N shards: check their manifests, move their up_to_examples files into
+    `up_to_examples_dir` (deduplicated by conv_path_id, existing files are kept) and write manifest.json.
+    Raises ValueError if a shard is missing, has failed chunks of call transcripts (to be rerun, see
+    extract_up_matchings.py) or two shards processed the same assistant.
+    Return:
+        manifest: combined manifest
+    """
+    shard_manifests = []
+    for index in range(num_shards):
+        path = manifests_dir(ut_to_conv_path_dir) / f"shard-{shard_name((index, num_shards))}.json"
+        if not path.exists():
+            raise ValueError(f"Missing manifest of shard {index}/{num_shards}: {path}")
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+        if manifest.get("extract", {}).get("num_failed_chunks"):
+            raise ValueError(
+                f"Shard {index}/{num_shards} failed on {manifest['extract']['num_failed_chunks']} chunks "
+                "of call transcripts, rerun it"
+            )
+        shard_manifests.append(manifest)
+
+    owners = {}
+    for index, manifest in enumerate(shard_manifests):
+        for assistant_id in manifest.get("extract", {}).get("assistant_ids", []):
+            if assistant_id in owners:
+                raise ValueError(f"Assistant {assistant_id} processed by shards {owners[assistant_id]} and {index}")
+            owners[assistant_id] = index
+
+    Path(up_to_examples_dir).mkdir(parents=True, exist_ok=True)
+    num_merged = num_duplicates = 0
+    for index in range(num_shards):
+        shard_dir = shard_up_to_examples_dir(up_to_examples_dir, (index, num_shards))
+        if not shard_dir.is_dir():
+            continue
+        for file in sorted(shard_dir.glob("*.json")):
+            destination = Path(up_to_examples_dir) / file.name
+            if destination.exists():
+                num_duplicates += 1
+                file.unlink()
+            else:
+                shutil.move(str(file), str(destination))
+                num_merged += 1
+
+    manifest = {
+        "num_shards": num_shards,
+        "num_assistants": len(owners),
+        "num_processed": sum(m.get("extract", {}).get("num_processed", 0) for m in shard_manifests),
+        "num_up_to_examples_merged": num_merged,
+        "num_up_to_examples_duplicates": num_duplicates,
+        "shards": shard_manifests,
+    }
+    (manifests_dir(ut_to_conv_path_dir) / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
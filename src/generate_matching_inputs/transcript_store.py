@@ -0,0 +1,264 @@
+"""
+Call transcript storage shared by `save_call_transcripts.py` (writer) and `extract_up_matchings.py` (reader).
+
+Two layouts under the call transcripts directory:
+- "files" (default, legacy): one file per call, `<assistant_id>/<call_id>.json[.gz|.zst]`.
+  Files of different compressions can coexist; the suffix tells how to decode each one.
+- "packed": one archive per assistant, `<assistant_id>.pack`, holding independently compressed transcripts
+  back to back, plus an append-only `<assistant_id>.idx` (one JSON line per call: call_id, offset, length).
+  Reading a call is one index lookup and one positioned read. The layout and compression are recorded
+  in `store.json` at the root of the store.
+
+Readers decompress on the fly, so the rest of the pipeline only sees lists of messages.
+"""
+
+import os
+import abc
+import gzip
+import json
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:  # declared in pyproject.toml; without it, only the zstd compression is unavailable
+    zstandard = None
+
+STORE_CONFIG_FILE = "store.json"
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+
+# Call transcript file suffix per compression ("files" layout)
+CALL_TRANSCRIPT_SUFFIXES = {
+    None: ".json",
+    "gzip": ".json.gz",
+    "zstd": ".json.zst",
+}
+
+
+def call_id_from_path(call_transcript_path: Path) -> str:
+    """
+    Call ID of a call transcript file, whatever its compression suffix.
+    """
+    name = call_transcript_path.name
+    for suffix in sorted(CALL_TRANSCRIPT_SUFFIXES.values(), key=len, reverse=True):
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return Path(name).stem
+
+
+def compress(data: bytes, compression: str | None) -> bytes:
+    if compression is None:
+        return data
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def decompress(data: bytes, compression: str | None) -> bytes:
+    if compression is None:
+        return data
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("Reading zstd compressed transcripts requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def encode_call_transcript(transcript: list[dict], compression: str | None = None) -> bytes:
+    """
+    Serialize a call transcript to compact JSON, optionally compressed with gzip or zstd.
+    """
+    data = json.dumps(transcript, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return compress(data, compression)
+
+
+def decode_call_transcript(data: bytes, compression: str | None = None) -> list[dict]:
+    return json.loads(decompress(data, compression))
+
+
+def read_call_transcript(call_transcript_path: Path) -> list[dict]:
+    """
+    Read a call transcript file, decompressing it according to its suffix.
+    """
+    name = call_transcript_path.name
+    compression = next(
+        (c for c, suffix in CALL_TRANSCRIPT_SUFFIXES.items() if c and name.endswith(suffix)), None
+    )
+    return decode_call_transcript(call_transcript_path.read_bytes(), compression)
+
+
+class TranscriptStore(abc.ABC):
+    """
+    Interface of a call transcript store. Use `open_transcript_store` to get one.
+    """
+
+    def __init__(self, root: str | Path, compression: str | None = None):
+        self.root = Path(root)
+        self.compression = compression
+
+    @abc.abstractmethod
+    def assistant_ids(self) -> list[str]: ...
+
+    @abc.abstractmethod
+    def call_ids(self, assistant_id: str) -> set[str]: ...
+
+    @abc.abstractmethod
+    def read(self, assistant_id: str, call_id: str) -> list[dict]: ...
+
+    @abc.abstractmethod
+    def write(self, assistant_id: str, call_id: str, transcript: list[dict]): ...
+
+    def contains(self, assistant_id: str, call_id: str) -> bool:
+        return call_id in self.call_ids(assistant_id)
+
+
+class FileTranscriptStore(TranscriptStore):
+    """
+    One (optionally compressed) JSON file per call: `<root>/<assistant_id>/<call_id>.json[.gz|.zst]`.
+    New transcripts are written with the store compression; existing files are read whatever their compression.
+    """
+
+    def assistant_ids(self) -> list[str]:
+        if not self.root.is_dir():
+            return []
+        return [
+            entry.name
+            for entry in os.scandir(self.root)
+            if entry.is_dir() and not entry.name.startswith(".")  # skip bookkeeping directories
+        ]
+
+    def _call_paths(self, assistant_id: str) -> dict[str, Path]:
+        assistant_dir = self.root / assistant_id
+        if not assistant_dir.is_dir():
+            return {}
+        return {
+            call_id_from_path(Path(entry.name)): Path(entry.path)
+            for entry in os.scandir(assistant_dir)
+            if entry.is_file() and not entry.name.startswith(".")
+        }
+
+    def call_ids(self, assistant_id: str) -> set[str]:
+        return set(self._call_paths(assistant_id))
+
+    def contains(self, assistant_id: str, call_id: str) -> bool:
+        return any(
+            (self.root / assistant_id / f"{call_id}{suffix}").exists()
+            for suffix in CALL_TRANSCRIPT_SUFFIXES.values()
+        )
+
+    def read(self, assistant_id: str, call_id: str) -> list[dict]:
+        # Try the store compression first, it is the most likely one
+        suffixes = [CALL_TRANSCRIPT_SUFFIXES[self.compression]] + list(CALL_TRANSCRIPT_SUFFIXES.values())
+        for suffix in suffixes:
+            path = self.root / assistant_id / f"{call_id}{suffix}"
+            if path.exists():
+                return read_call_transcript(path)
+        raise KeyError(f"Call transcript not found: {assistant_id} / {call_id}")
+
+    def write(self, assistant_id: str, call_id: str, transcript: list[dict]):
+        assistant_dir = self.root / assistant_id
+        assistant_dir.mkdir(parents=True, exist_ok=True)
+        suffix = CALL_TRANSCRIPT_SUFFIXES[self.compression]
+        (assistant_dir / f"{call_id}{suffix}").write_bytes(
+            encode_call_transcript(transcript, self.compression)
+        )
+
+
+class PackedTranscriptStore(TranscriptStore):
+    """
+    One archive per assistant: `<root>/<assistant_id>.pack` + `<root>/<assistant_id>.idx`.
+    The index is only appended to after the transcript bytes are written, so an interrupted write leaves
+    unreferenced bytes at the end of the pack at worst. Only one process may write an assistant at a time.
+    """
+
+    def __init__(self, root: str | Path, compression: str | None = None):
+        super().__init__(root, compression)
+        # Index of the last assistant read: workers process chunks of calls of a single assistant
+        self._index_assistant_id = None
+        self._index = {}
+
+    def assistant_ids(self) -> list[str]:
+        if not self.root.is_dir():
+            return []
+        return [
+            entry.name[: -len(INDEX_SUFFIX)]
+            for entry in os.scandir(self.root)
+            if entry.name.endswith(INDEX_SUFFIX)
+        ]
+
+    def _load_index(self, assistant_id: str) -> dict[str, tuple[int, int]]:
+        if assistant_id == self._index_assistant_id:
+            return self._index
+        index = {}
+        index_path = self.root / f"{assistant_id}{INDEX_SUFFIX}"
+        if index_path.exists():
+            with open(index_path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # partially written last line
+                    entry = json.loads(line)
+                    index[entry["call_id"]] = (entry["offset"], entry["length"])
+        self._index_assistant_id, self._index = assistant_id, index
+        return index
+
+    def call_ids(self, assistant_id: str) -> set[str]:
+        return set(self._load_index(assistant_id))
+
+    def contains(self, assistant_id: str, call_id: str) -> bool:
+        return call_id in self._load_index(assistant_id)
+
+    def read(self, assistant_id: str, call_id: str) -> list[dict]:
+        try:
+            offset, length = self._load_index(assistant_id)[call_id]
+        except KeyError:
+            raise KeyError(f"Call transcript not found: {assistant_id} / {call_id}")
+        fd = os.open(self.root / f"{assistant_id}{PACK_SUFFIX}", os.O_RDONLY)
+        try:
+            data = os.pread(fd, length, offset)
+        finally:
+            os.close(fd)
+        return decode_call_transcript(data, self.compression)
+
+    def write(self, assistant_id: str, call_id: str, transcript: list[dict]):
+        self.root.mkdir(parents=True, exist_ok=True)
+        data = encode_call_transcript(transcript, self.compression)
+        with open(self.root / f"{assistant_id}{PACK_SUFFIX}", "ab") as pack:
+            offset = pack.tell()
+            pack.write(data)
+        with open(self.root / f"{assistant_id}{INDEX_SUFFIX}", "a", encoding="utf-8") as index:
+            index.write(json.dumps({"call_id": call_id, "offset": offset, "length": len(data)}) + "\n")
+        if assistant_id == self._index_assistant_id:
+            self._index[call_id] = (offset, len(data))
+
+
+def open_transcript_store(
+    root: str | Path, layout: str | None = None, compression: str | None = None
+) -> TranscriptStore:
+    """
+    Open the call transcript store at `root`.
+    An existing packed store is opened with its recorded compression. Otherwise `layout` ("files" or "packed",
+    default "files") and `compression` (None, "gzip" or "zstd") apply to new transcripts; creating a packed
+    store records them in `store.json`.
+    """
+    root = Path(root)
+    config_path = root / STORE_CONFIG_FILE
+    if config_path.exists():
+        config = json.loads(config_path.read_text())
+        if layout not in (None, config["layout"]):
+            raise ValueError(f"Store {root} has layout {config['layout']}, not {layout}")
+        layout, compression = config["layout"], config["compression"]
+    elif layout == "packed":
+        root.mkdir(parents=True, exist_ok=True)
+        config_path.write_text(json.dumps({"layout": layout, "compression": compression}))
+
+    if layout == "packed":
+        return PackedTranscriptStore(root, compression)
+    if layout in (None, "files"):
+        return FileTranscriptStore(root, compression)
+    raise ValueError(f"Unknown transcript store layout: {layout}")
@@ -1,10 +1,15 @@
+import os
+import sys
 import json
 import logging
+import functools
 import sqlmodel as sm
 from pathlib import Path
 from collections import defaultdict
 from pydantic import BaseModel
+from sqlalchemy import Engine
 
+# Configures the datamodel DB connection used by `Model.query` (see "Database access" in README.md)
 import vocal.common.static  # noqa: F401
 from vocal.common.utils import normalize_text
 from getvocal.datamodel.sql import Assistants
@@ -13,6 +18,12 @@ from getvocal.datamodel.sql.assistant_questions import AssistantQuestions
 from getvocal.datamodel.sql.assistant_answers import AssistantAnswers
 from getvocal.datamodel.sql.conversational_paths import ConversationalPaths
 
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.transcript_store import TranscriptStore, open_transcript_store
+from src.generate_matching_inputs.dataset import default_candidate_sets_dir, save_candidate_set
+from src.generate_matching_inputs.graph_snapshot import GraphSnapshot, build_graph_snapshot
+from src.generate_matching_inputs.run_metrics import metrics
+
 CALL_TRANSCRIPTS_DIR = "/www/files/call_transcripts"
 
 LANGUAGES = {
@@ -22,13 +33,9 @@ LANGUAGES = {
 }
 
 
-# Configure logging to show DEBUG level messages
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    force=True,
-)
+
+# Graph snapshot attached by the worker processes (see graph_snapshot.py): lookups read it instead of the DB
+_graph_snapshot: GraphSnapshot | None = None
 
 
 class ConvPath(BaseModel):
@@ -43,16 +50,83 @@ class ConvPath(BaseModel):
         return [sm.column(c) for c in cls.model_fields.keys()]
 
 
-class Matching(BaseModel):
-    distance: float
-    conv_path_id: str
-    original: str | None = None
+class MatchedMessage:
+    """
+    Compact record of a message with a user prompt matching, as found by `parse_messages`.
+    """
+
+    __slots__ = ("idx", "user_text_idx", "conv_path_id", "distance")
+
+    def __init__(self, idx: int, user_text_idx: int, conv_path_id: str, distance: float):
+        self.idx = idx  # index of the message in the conversation
+        self.user_text_idx = user_text_idx  # index of the last USER message up to this message (-1 if none)
+        self.conv_path_id = conv_path_id
+        self.distance = distance
+
+
+def timed_query(model, statement) -> list:
+    """
+    `model.query(statement)`, timed per table in the run metrics.
+    """
+    with metrics.timer(f"db.{model.__table__.name}"):
+        return model.query(statement)
+
+
+def write_text_file(file_path: Path, text: str):
+    """
+    Write a UTF-8 file, counted in the run metrics.
+    """
+    data = text.encode("utf-8")
+    file_path.write_bytes(data)
+    metrics.count("files_written")
+    metrics.count("bytes_written", len(data))
+
+
+@functools.lru_cache(maxsize=None)
+def get_engine(db_url: str | None = None) -> Engine:
+    """
+    Engine for queries that need more than `Model.query`, e.g. server-side cursors.
+    The URL defaults to the MATCHING_DB_URL environment variable. Cached per process.
+    """
+    return sm.create_engine(db_url or os.environ["MATCHING_DB_URL"], pool_pre_ping=True)
+
+
+@functools.lru_cache(maxsize=None)
+def get_transcript_store(call_transcripts_dir: str = CALL_TRANSCRIPTS_DIR) -> TranscriptStore:
+    """
+    Call transcript store of a directory, opened once per process.
+    """
+    return open_transcript_store(call_transcripts_dir)
+
+
+def dump_graph_snapshot(path: str | Path) -> Path:
+    """
+    Dump the tables read by the extraction into a graph snapshot: the depth 2 conv paths (the ones with a
+    source node) and the texts of the user prompts, assistant answers and assistant questions.
+    """
+    conv_paths = timed_query(
+        ConversationalPaths,
+        sm.select(*ConvPath.columns()).where(ConversationalPaths.source_node_id.is_not(None))
+    )
+    user_prompts = timed_query(
+        UserPrompts,
+        sm.select(UserPrompts.id, UserPrompts.text, UserPrompts.primary_id, UserPrompts.attached_user_prompt_ids)
+    )
+    assistant_answers = timed_query(AssistantAnswers, sm.select(AssistantAnswers.id, AssistantAnswers.text))
+    assistant_questions = timed_query(AssistantQuestions, sm.select(AssistantQuestions.id, AssistantQuestions.text))
+    logging.info(
+        f"Graph snapshot: {len(conv_paths)} conv paths, {len(user_prompts)} user prompts, "
+        f"{len(assistant_answers)} assistant answers, {len(assistant_questions)} assistant questions"
+    )
+    return build_graph_snapshot(path, conv_paths, user_prompts, assistant_answers, assistant_questions)
 
 
-class Message(BaseModel):
-    role: str
-    text: str
-    matching: Matching
+def attach_graph_snapshot(path: str | None):
+    """
+    Worker initializer: serve the graph lookups of this process from the snapshot at `path` (None: from the DB).
+    """
+    global _graph_snapshot
+    _graph_snapshot = GraphSnapshot(path) if path is not None else None
 
 
 def get_assistant_language(assistant_id: str) -> str:
@@ -60,29 +134,84 @@ def get_assistant_language(assistant_id: str) -> str:
     return assistant[0].language
 
 
-def filter_messages_with_up_matching(message_list: list[dict]) -> tuple[list[Message], list[int]]:
+def get_assistant_languages(assistant_ids: list[str]) -> dict[str, str]:
     """
-    Filter messages from the message list that have a matching field containing both conv_path_id
-    and distance.
-    NB: Note that one conv_path_id can appear in multiple messages.
+    Resolve the language of many assistants with a single DB query.
     Return:
-        messages_with_up_matching: list of valid Message objects
-        message_idx: list of indices of valid Message objects in the original conversation before filtering
+        assistant_languages: assistant_id -> language dictionary (unknown assistants are missing)
     """
-    messages_with_up_matching = []
-    messages_with_up_matching_idx = []  # Stores the original indices of messages in the conversation before filtering
-    for i, message in enumerate(message_list):
+    if not assistant_ids:
+        return {}
+    assistants = timed_query(
+        Assistants,
+        sm.select(Assistants.id, Assistants.language).where(Assistants.id.in_(assistant_ids))
+    )
+    return {assistant["id"]: assistant["language"] for assistant in assistants}
+
+
+def available_cpu_count() -> int:
+    """
+    Number of cores this process is allowed to run on (respects container/taskset limits).
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _as_distance(value) -> float | None:
+    # Same coercion as a pydantic float field: numbers and numeric strings
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
         try:
-            messages_with_up_matching.append(Message(**message))
-            messages_with_up_matching_idx.append(i)
-        except Exception:
-            pass  # Ignore messages that cannot be parsed
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def parse_messages(message_list: list[dict]) -> tuple[list[dict], list[MatchedMessage]]:
+    """
+    Parse the message list of a call transcript in a single pass.
+    A message has a user prompt matching if it has string role and text, and a matching field containing
+    both a conv_path_id and a distance.
+    NB: Note that one conv_path_id can appear in multiple messages.
+    Return:
+        conversation: list of {"role", "text"} dictionaries, one per message
+        matched_messages: MatchedMessage records in conversation order
+    """
+    conversation = []
+    matched_messages = []
+    user_text_idx = -1
+    for idx, message in enumerate(message_list):
+        role = message["role"]
+        text = message["text"]
+        conversation.append({"role": role, "text": text})
+        if role == "USER":
+            user_text_idx = idx
+
+        matching = message.get("matching")
+        if not isinstance(matching, dict) or not isinstance(role, str) or not isinstance(text, str):
+            continue
+        conv_path_id = matching.get("conv_path_id")
+        distance = _as_distance(matching.get("distance"))
+        original = matching.get("original")
+        if (
+            not isinstance(conv_path_id, str)
+            or distance is None
+            or not (original is None or isinstance(original, str))
+        ):
+            continue
+        matched_messages.append(MatchedMessage(idx, user_text_idx, conv_path_id, distance))
 
-    return messages_with_up_matching, messages_with_up_matching_idx
+    return conversation, matched_messages
 
 
 def get_depth2_conv_paths_by_ids_dict(
-    messages_with_up_matching: list[Message],
+    matched_messages: list[MatchedMessage],
 ) -> dict[str, ConvPath]:
     """
     Filter messages from the message list that have depth 2 matching conv_path.
@@ -91,13 +220,17 @@ def get_depth2_conv_paths_by_ids_dict(
         depth2_conv_paths_by_ids_dict: conv_path_id -> conv_path dictionary
     """
     # Get all conv_path_ids in message list
-    conv_path_ids = set()  # Make sure that each conv_path_id is processed only once
-    for message in messages_with_up_matching:
-        conv_path_ids.add(message.matching.conv_path_id)
+    conv_path_ids = {
+        message.conv_path_id for message in matched_messages
+    }  # Make sure that each conv_path_id is processed only once
+    if _graph_snapshot is not None:
+        # The snapshot only holds depth 2 conv_paths
+        return {cp["id"]: ConvPath(**cp) for cp in _graph_snapshot.conv_paths(conv_path_ids)}
 
     # Query DB and select only depth 2 conv_paths, meaning those with source node.
     # Init conv_path and depth 1 conv_path are then excluded.
-    all_conv_paths = ConversationalPaths.query(
+    all_conv_paths = timed_query(
+        ConversationalPaths,
         sm.select(*ConvPath.columns()).where(
             ConversationalPaths.id.in_(conv_path_ids),
             ConversationalPaths.source_node_id.is_not(None),
@@ -121,11 +254,15 @@ def get_conv_paths_from_source_nodes_dict(
     source_node_ids = {
         cp.source_node_id for cp in conv_paths
     }  # Make sure that each source_node_id is processed only once
-    all_conv_paths_from_source_nodes = ConversationalPaths.query(
-        sm.select(*ConvPath.columns()).where(
-            ConversationalPaths.source_node_id.in_(source_node_ids)
+    if _graph_snapshot is not None:
+        all_conv_paths_from_source_nodes = _graph_snapshot.conv_paths_from_source_nodes(source_node_ids)
+    else:
+        all_conv_paths_from_source_nodes = timed_query(
+            ConversationalPaths,
+            sm.select(*ConvPath.columns()).where(
+                ConversationalPaths.source_node_id.in_(source_node_ids)
+            )
         )
-    )
     conv_paths_from_source_nodes_dict = defaultdict(list)
     for cp in all_conv_paths_from_source_nodes:
         cp = ConvPath(**cp)
@@ -144,9 +281,7 @@ def extract_matching_candidates_from_source_node(
         candidates: dictionary with keys "up", "aa", "aq", "conv_path_id" and values as lists of texts or IDs
     """
     conv_paths_from_source_node = conv_paths_from_source_nodes_dict[source_node_id]
-    num_conv_paths = len(conv_paths_from_source_node)
 
-    candidates = {"up": [], "aa": [], "aq": [], "conv_path_id": []}
     up_ids, aa_ids, aq_ids = [], [], []
 
     for conv_path in conv_paths_from_source_node:
@@ -154,14 +289,25 @@ def extract_matching_candidates_from_source_node(
         aa_ids.append(conv_path.assistant_answer_id)
         aq_ids.append(conv_path.target_node_id)
 
+    if _graph_snapshot is not None:
+        return build_candidates(
+            conv_paths_from_source_node,
+            _graph_snapshot.texts("user_prompts", up_ids),
+            _graph_snapshot.texts("assistant_answers", aa_ids),
+            _graph_snapshot.texts("assistant_questions", aq_ids),
+        )
+
     # Note that not all ids may be present in the DB, so the number of retrieved texts may be less than num_conv_paths
-    existing_ups = UserPrompts.query(
+    existing_ups = timed_query(
+        UserPrompts,
         sm.select(UserPrompts.id, UserPrompts.text).where(UserPrompts.id.in_(up_ids))
     )
-    existing_aas = AssistantAnswers.query(
+    existing_aas = timed_query(
+        AssistantAnswers,
         sm.select(AssistantAnswers.id, AssistantAnswers.text).where(AssistantAnswers.id.in_(aa_ids))
     )
-    existing_aqs = AssistantQuestions.query(
+    existing_aqs = timed_query(
+        AssistantQuestions,
         sm.select(AssistantQuestions.id, AssistantQuestions.text).where(
             AssistantQuestions.id.in_(aq_ids)
         )
@@ -171,26 +317,69 @@ def extract_matching_candidates_from_source_node(
     existing_aas_dict = {aa["id"]: aa["text"] for aa in existing_aas}
     existing_aqs_dict = {aq["id"]: aq["text"] for aq in existing_aqs}
 
+    return build_candidates(
+        conv_paths_from_source_node, existing_ups_dict, existing_aas_dict, existing_aqs_dict
+    )
+
+
+def build_candidates(
+    conv_paths_from_source_node: list[ConvPath],
+    existing_ups_dict: dict[str, str],
+    existing_aas_dict: dict[str, str],
+    existing_aqs_dict: dict[str, str],
+) -> dict[str, list[str]] | None:
+    """
+    Build the matching candidates of a source node from the texts retrieved from the DB.
+    Conv paths whose user prompt or assistant answer (or follow-up question, if any) is missing are dropped.
+    If any of the user prompts contains §NO_NEED*§, return None.
+    """
     # Remove all matchings with §NO_NEED*§ in up candidates
     if any("NO_NEED" in up for up in existing_ups_dict.values()):
         return None
 
-    for i in range(num_conv_paths):
+    candidates = {"up": [], "aa": [], "aq": [], "conv_path_id": []}
+    for conv_path in conv_paths_from_source_node:
+        up_id = conv_path.user_prompt_id
+        aa_id = conv_path.assistant_answer_id
+        aq_id = conv_path.target_node_id
         if (
-            up_ids[i] in existing_ups_dict.keys()
-            and aa_ids[i] in existing_aas_dict.keys()
-            and (
-                not aq_ids[i] or aq_ids[i] in existing_aqs_dict.keys()
-            )  # follow up question is optional
+            up_id in existing_ups_dict
+            and aa_id in existing_aas_dict
+            and (not aq_id or aq_id in existing_aqs_dict)  # follow up question is optional
         ):
-            candidates["up"].append(existing_ups_dict[up_ids[i]])
-            candidates["aa"].append(existing_aas_dict[aa_ids[i]])
-            candidates["aq"].append(existing_aqs_dict[aq_ids[i]] if aq_ids[i] else None)
-            candidates["conv_path_id"].append(conv_paths_from_source_node[i].id)
+            candidates["up"].append(existing_ups_dict[up_id])
+            candidates["aa"].append(existing_aas_dict[aa_id])
+            candidates["aq"].append(existing_aqs_dict[aq_id] if aq_id else None)
+            candidates["conv_path_id"].append(conv_path.id)
 
     return candidates
 
 
+def get_user_prompt(user_prompt_id: str):
+    """
+    User prompt row (from the graph snapshot if attached). Raises IndexError if it does not exist.
+    """
+    if _graph_snapshot is None:
+        with metrics.timer(f"db.{UserPrompts.__table__.name}"):
+            return UserPrompts.get(user_prompt_id)
+    user_prompts = _graph_snapshot.user_prompts([user_prompt_id])
+    if user_prompt_id not in user_prompts:
+        raise IndexError(user_prompt_id)
+    return user_prompts[user_prompt_id]
+
+
+def get_user_prompt_texts(user_prompt_ids: list[str]) -> list[str]:
+    """
+    Texts of the existing user prompts among `user_prompt_ids` (from the graph snapshot if attached).
+    """
+    if _graph_snapshot is not None:
+        return list(_graph_snapshot.texts("user_prompts", user_prompt_ids).values())
+    attached_ups = timed_query(
+        UserPrompts, sm.select(UserPrompts.text).where(UserPrompts.id.in_(user_prompt_ids))
+    )
+    return [up["text"] for up in attached_ups]
+
+
 def check_normalized_text_matching(ut_query: str, user_prompt_id: str) -> bool:
     """
     Check exact matching between user text and user prompt ID.
@@ -198,7 +387,7 @@ def check_normalized_text_matching(ut_query: str, user_prompt_id: str) -> bool:
         - if user prompt is primary, check attached (secondary) user prompts and compare their texts with user text
     """
     try:
-        user_prompt = UserPrompts.get(user_prompt_id)
+        user_prompt = get_user_prompt(user_prompt_id)
 
         if user_prompt.primary_id:
             # If the user prompt is secondary, get its text
@@ -209,19 +398,28 @@ def check_normalized_text_matching(ut_query: str, user_prompt_id: str) -> bool:
             attached_up_ids = user_prompt.attached_user_prompt_ids
             if attached_up_ids:
                 # primary user prompt is likely to have empty list of attached user prompts
-                attached_ups = UserPrompts.query(
-                    sm.select(UserPrompts.text).where(UserPrompts.id.in_(attached_up_ids))
-                )
-                for up in attached_ups:
-                    if normalize_text(ut_query) == normalize_text(up["text"]):
-                        logging.debug(f'Skipping exact match for user prompt: "{ut_query}".')
+                for attached_text in get_user_prompt_texts(attached_up_ids):
+                    if normalize_text(ut_query) == normalize_text(attached_text):
+                        logging.debug('Skipping exact match for user prompt: "%s".', ut_query)
                         return True
             return False
     except IndexError:
-        logging.debug(f"Error retrieving user prompt: {user_prompt_id}.")
+        logging.debug("Error retrieving user prompt: %s.", user_prompt_id)
         return False
 
 
+def get_user_text(all_messages: list[dict], user_text_idx: int) -> str:
+    """
+    Get the user text of a USER message: the offline transcription if available, else the live one.
+    """
+    user_text = all_messages[user_text_idx]["text"]  # live transcription
+    try:
+        user_text = all_messages[user_text_idx]["matching"]["original"]  # offline transcription
+    except KeyError:
+        pass
+    return user_text
+
+
 def save_ut_to_conv_path_matching(
     save_to_dir: Path,
     language: str,
@@ -231,79 +429,75 @@ def save_ut_to_conv_path_matching(
     user_text: str,
     user_text_idx: int,
     candidates: dict[str, list[str]],
+    source_node_id: str | None = None,
+    candidate_sets_dir: Path | None = None,
 ):
+    """
+    Save a matching with its candidates or, with `candidate_sets_dir` (normalized dataset, see dataset.py),
+    with a reference to the candidate set of its source node, written once.
+    """
     matching = {
         "assistant_id": assistant_id,
         "call_id": call_id,
         "language": language,
         "user_text": user_text,
         "user_text_idx": user_text_idx,
-        "candidates": candidates,
     }
+    if candidate_sets_dir is None:
+        matching["candidates"] = candidates
+    else:
+        save_candidate_set(candidate_sets_dir, source_node_id, candidates)
+        matching["source_node_id"] = source_node_id
     save_to_dir.mkdir(parents=True, exist_ok=True)
     file_path = Path(f"{save_to_dir}/{matching_id}.json")
-    file_path.write_text(json.dumps(matching, ensure_ascii=False), encoding="utf-8")
-    logging.debug(f"Saved matching to {file_path}")
+    write_text_file(file_path, json.dumps(matching, ensure_ascii=False))
+    metrics.count("matchings_emitted")
+    logging.debug("Saved matching to %s", file_path)
 
 
 def process_call_transcript(
-    call_transcript_path: Path,
+    call_transcripts_dir: str,
     ut_to_conv_path_dir: Path,
     language: str,
     assistant_id: str,
     call_id: str,
+    candidate_sets: bool = False,
 ) -> None:
     """
     Process a single call transcript to extract all user prompt matchings, then save them to JSON files.
+    With `candidate_sets`, the candidates are saved once per source node (normalized dataset, see dataset.py).
     """
-    logging.debug(f"Start processing call transcript: {assistant_id} / {call_id}")
+    logging.debug("Start processing call transcript: %s / %s", assistant_id, call_id)
 
-    all_messages = json.loads(call_transcript_path.read_text(encoding="utf-8"))
-    messages_with_up_matching, messages_with_up_matching_idx = filter_messages_with_up_matching(
-        all_messages
-    )
-    depth2_conv_paths_by_ids_dict = get_depth2_conv_paths_by_ids_dict(messages_with_up_matching)
-    depth2_conv_path_ids = depth2_conv_paths_by_ids_dict.keys()
+    with metrics.timer("stage.read_transcript"):
+        all_messages = get_transcript_store(str(call_transcripts_dir)).read(assistant_id, call_id)
+    with metrics.timer("stage.parse_messages"):
+        conversation, matched_messages = parse_messages(all_messages)
+    depth2_conv_paths_by_ids_dict = get_depth2_conv_paths_by_ids_dict(matched_messages)
     conv_paths_from_source_nodes_dict = get_conv_paths_from_source_nodes_dict(
         list(depth2_conv_paths_by_ids_dict.values())
     )
 
-    conversation = []
     seen_conv_path_ids = set()
-    user_text_idx = -1
-
     matching_id = 0
+    candidate_sets_dir = default_candidate_sets_dir(ut_to_conv_path_dir) if candidate_sets else None
 
-    for idx, message in enumerate(all_messages):
-        conversation.append({"role": message["role"], "text": message["text"]})
-        if message["role"] == "USER":
-            user_text_idx = idx
-
-        # Make sure that
-        try:
-            message = Message(**message)
-            conv_path_id = message.matching.conv_path_id
-            if (
-                idx not in messages_with_up_matching_idx  # the current message contains matching
-                or conv_path_id not in depth2_conv_path_ids  # matching is depth 2
-                or conv_path_id in seen_conv_path_ids  # and conv_path_id was not processed yet
-            ):
-                continue
-        except Exception:
+    for message in matched_messages:
+        conv_path_id = message.conv_path_id
+        # Make sure that the matching is depth 2 and conv_path_id was not processed yet
+        if conv_path_id not in depth2_conv_paths_by_ids_dict or conv_path_id in seen_conv_path_ids:
             continue
 
         # Get user_text from the last USER message before the current ASSISTANT message with matching
-        user_text = all_messages[user_text_idx]["text"]  # live transcription
-        try:
-            user_text = all_messages[user_text_idx]["matching"]["original"]  # offline transcription
-        except KeyError:
-            pass
+        user_text_idx = message.user_text_idx
+        user_text = get_user_text(all_messages, user_text_idx)
 
         # Skip exact matching
         conv_path = depth2_conv_paths_by_ids_dict.get(conv_path_id)
-        if message.matching.distance == 0.0 and check_normalized_text_matching(
+        if message.distance == 0.0 and check_normalized_text_matching(
             user_text, conv_path.user_prompt_id
         ):
+            metrics.count("matchings_skipped_exact")
             continue
 
         # Extract possible conv_paths from source_node as matching candidates
@@ -313,8 +507,9 @@ def process_call_transcript(
 
         # Remove matchings with §NO_NEED§ in user prompt candidates
         if not candidates:
+            metrics.count("matchings_skipped_no_need")
             logging.debug(
-                f"Remove matching with §NO_NEED§ user prompt candidate in {call_transcript_path}"
+                "Remove matching with §NO_NEED§ user prompt candidate in %s / %s", assistant_id, call_id
             )
             continue
 
@@ -327,6 +522,8 @@ def process_call_transcript(
             user_text,
             user_text_idx,
             candidates,
+            source_node_id=conv_path.source_node_id,
+            candidate_sets_dir=candidate_sets_dir,
         )
 
         seen_conv_path_ids.add(conv_path_id)
@@ -334,13 +531,32 @@ def process_call_transcript(
 
     # Save conversation only if there is at least one matching
     if matching_id > 0:
-        Path(
-            f"{ut_to_conv_path_dir}/{language}/{assistant_id}/{call_id}/conversation.json"
-        ).write_text(json.dumps(conversation), encoding="utf-8")
+        write_text_file(
+            Path(f"{ut_to_conv_path_dir}/{language}/{assistant_id}/{call_id}/conversation.json"),
+            json.dumps(conversation),
+        )
 
-    logging.info(
-        f"Processed call transcript: {assistant_id} / {call_id} with {matching_id} matchings."
-    )
+    metrics.count("transcripts_processed")
+    logging.debug("Processed call transcript: %s / %s with %d matchings.", assistant_id, call_id, matching_id)
+
+
+def process_call_transcript_chunk(chunk: list[tuple]) -> int:
+    """
+    Process a chunk of call transcripts (all from the same assistant) in a single worker task.
+    Each element of the chunk holds the arguments of `process_call_transcript`.
+    Errors are logged per transcript so that one bad transcript does not drop the whole chunk.
+    Return:
+        num_processed: number of transcripts processed without error
+    """
+    num_processed = 0
+    for args in chunk:
+        try:
+            process_call_transcript(*args)
+            num_processed += 1
+        except Exception as exc:
+            metrics.count("transcripts_failed")
+            logging.error(f"Error in process_call_transcript for {args[3]} / {args[4]}: {exc}")
+    return num_processed
 
 
 def process_matching_json_file(up_to_examples_dir: Path, candidates: dict[str, list[str]]):
@@ -352,13 +568,18 @@ def process_matching_json_file(up_to_examples_dir: Path, candidates: dict[str, l
     for conv_path_id in candidates["conv_path_id"]:
         # Check if a conv_path_id already exists, skip processing
         if Path(f"{up_to_examples_dir}/{conv_path_id}.json").exists():
-            logging.debug(f"File {up_to_examples_dir}/{conv_path_id}.json already exists, skipping...")
+            logging.debug("File %s/%s.json already exists, skipping...", up_to_examples_dir, conv_path_id)
             continue
         all_conv_path_ids.append(conv_path_id)
         all_user_prompt_ids.add(conv_path_id.split("_")[1])  # Assuming conv_path_id is depth 2 conv_path, whose format is source_up_aa_aq
-    user_prompts = UserPrompts.query(sm.select(UserPrompts).where(UserPrompts.id.in_(all_user_prompt_ids)))
-    # user_prompts = UserPrompts.get_by_ids(all_user_prompt_ids)
-    user_prompts_dict = {up.id: up for up in user_prompts}
+    if _graph_snapshot is not None:
+        user_prompts_dict = _graph_snapshot.user_prompts(all_user_prompt_ids)
+    else:
+        user_prompts = timed_query(
+            UserPrompts, sm.select(UserPrompts).where(UserPrompts.id.in_(all_user_prompt_ids))
+        )
+        # user_prompts = UserPrompts.get_by_ids(all_user_prompt_ids)
+        user_prompts_dict = {up.id: up for up in user_prompts}
 
     for conv_path_id in all_conv_path_ids:
         user_prompt_id = conv_path_id.split("_")[1]  
@@ -373,8 +594,7 @@ def process_matching_json_file(up_to_examples_dir: Path, candidates: dict[str, l
         else:
             # If the user prompt is primary, check for attached (secondary) user prompts and get their texts
             attached_up_ids = user_prompt.attached_user_prompt_ids
-            attached_ups = UserPrompts.query(sm.select(UserPrompts.text).where(UserPrompts.id.in_(attached_up_ids)))
-            attached_user_prompts = [up["text"] for up in attached_ups]
+            attached_user_prompts = get_user_prompt_texts(attached_up_ids)
             matching = {
                 "conv_path_id": conv_path_id,
                 "primary_user_prompt": user_prompt.text,
@@ -382,6 +602,8 @@ def process_matching_json_file(up_to_examples_dir: Path, candidates: dict[str, l
             }
         Path(up_to_examples_dir).mkdir(parents=True, exist_ok=True)
         file_path = Path(f"{up_to_examples_dir}/{conv_path_id}.json")
-        file_path.write_text(json.dumps(matching, indent=2, ensure_ascii=False), encoding="utf-8") # ensure_ascii=False to preserve § instead of converting it to \u00a7
-        logging.debug(f"Saved up_to_examples matching to {file_path}")
+        # ensure_ascii=False to preserve § instead of converting it to \u00a7
+        write_text_file(file_path, json.dumps(matching, indent=2, ensure_ascii=False))
+        metrics.count("up_to_examples_written")
+        logging.debug("Saved up_to_examples matching to %s", file_path)
 
@@ -0,0 +1,75 @@
+import sys
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, "/www/Embedding/src/embedding")
+from compact import encode_compact, truncate_dimension
+
+
+class FakeEmbeddingServer:
+    """
+    Stand-in for the /compute_embedding route of server_embedding.py on a local port. Records the request payloads,
+    answers 404 for the model "unknown", and binary rows when asked for them and `binary` is set. As on the real
+    server, "dimension" truncates the rows, and turns JSON responses into compact payloads.
+    """
+
+    def __init__(self, binary: bool = True):
+        self.payloads = []
+        self.binary = binary
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def fake_embedding(sentence: str) -> list[float]:
+        return [float(len(sentence)), float(sum(map(ord, sentence)) % 97), 1.0, 0.0]
+
+    @property
+    def requested_sentences(self) -> list[list[str]]:
+        return [payload["sentences"] for payload in self.payloads]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                fake.payloads.append(payload)
+                embeddings = np.asarray([fake.fake_embedding(s) for s in payload["sentences"]], dtype="<f4")
+                dimension = payload.get("dimension")
+                self.send_response(404 if payload["model_name"] == "unknown" else 200)
+                if fake.binary and self.headers.get("Accept") == "application/octet-stream":
+                    if dimension is not None:
+                        embeddings = np.ascontiguousarray(truncate_dimension(embeddings, dimension), dtype="<f4")
+                    body = embeddings.tobytes()
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("X-Embedding-Shape", f"{embeddings.shape[0]},{embeddings.shape[1]}")
+                    self.send_header("X-Embedding-Dtype", "float32")
+                else:
+                    body = json.dumps(
+                        embeddings.tolist() if dimension is None else encode_compact(embeddings, dimension)
+                    ).encode()
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def fake_server():
+    server = FakeEmbeddingServer()
+    yield server
+    server.shutdown()
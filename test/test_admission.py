@@ -0,0 +1,47 @@
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, "/www/Embedding/src/embedding")
+from admission import AdmissionError, ModelQueue
+
+
+def hold_slot(queue, started, release):
+    with queue.admit(deadline=time.monotonic() + 10):
+        started.set()
+        release.wait()
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    queue = ModelQueue(concurrency=1, depth=0)
+    started, release = threading.Event(), threading.Event()
+    thread = threading.Thread(target=hold_slot, args=(queue, started, release))
+    thread.start()
+    started.wait()
+    with pytest.raises(AdmissionError) as e:
+        with queue.admit(deadline=time.monotonic() + 10):
+            pass
+    assert e.value.status_code == 429 and e.value.retry_after >= 1
+    release.set()
+    thread.join()
+    assert queue.stats()["pending"] == 0 and queue.stats()["rejected"] == 1
+
+
+def test_request_is_dropped_at_its_deadline():
+    queue = ModelQueue(concurrency=1, depth=1)
+    started, release = threading.Event(), threading.Event()
+    thread = threading.Thread(target=hold_slot, args=(queue, started, release))
+    thread.start()
+    started.wait()
+    ran = False
+    with pytest.raises(AdmissionError) as e:
+        with queue.admit(deadline=time.monotonic() + 0.05):
+            ran = True
+    assert e.value.status_code == 504 and not ran
+    release.set()
+    thread.join()
+    with queue.admit(deadline=time.monotonic() + 1):
+        ran = True
+    assert ran and queue.stats()["expired"] == 1
@@ -0,0 +1,136 @@
+from pathlib import Path
+import asyncio
+import json
+import sys
+
+import sqlalchemy as sa
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.async_utils import (
+    CONV_PATHS_TABLE,
+    USER_PROMPTS_TABLE,
+    ASSISTANT_ANSWERS_TABLE,
+    ASSISTANT_QUESTIONS_TABLE,
+    get_async_engine,
+    async_get_conv_paths_from_source_nodes_dict,
+    async_extract_matching_candidates_from_source_node,
+    async_process_call_transcript,
+)
+from src.generate_matching_inputs.utils import ConvPath
+
+SOURCE_NODE_ID = "src"
+CONV_PATHS = [
+    # depth 2 conv paths from the same source node
+    {"id": "src_up1_aa1_aq1", "source_node_id": SOURCE_NODE_ID, "user_prompt_id": "up1", "assistant_answer_id": "aa1", "target_node_id": "aq1"},
+    {"id": "src_up2_aa2", "source_node_id": SOURCE_NODE_ID, "user_prompt_id": "up2", "assistant_answer_id": "aa2", "target_node_id": None},
+    # missing assistant answer: dropped from candidates
+    {"id": "src_up3_aa3", "source_node_id": SOURCE_NODE_ID, "user_prompt_id": "up3", "assistant_answer_id": "aa3", "target_node_id": None},
+    # depth 1 conv path: no source node
+    {"id": "init_up1_aa1", "source_node_id": None, "user_prompt_id": "up1", "assistant_answer_id": "aa1", "target_node_id": None},
+]
+USER_PROMPTS = [
+    {"id": "up1", "text": "I want to cancel", "primary_id": None, "attached_user_prompt_ids": json.dumps(["up1b"])},
+    {"id": "up1b", "text": "Cancel my order", "primary_id": "up1", "attached_user_prompt_ids": "[]"},
+    {"id": "up2", "text": "Where is my order", "primary_id": None, "attached_user_prompt_ids": "[]"},
+    {"id": "up3", "text": "Something else", "primary_id": None, "attached_user_prompt_ids": "[]"},
+]
+ASSISTANT_ANSWERS = [{"id": "aa1", "text": "Sure."}, {"id": "aa2", "text": "It is on its way."}]
+ASSISTANT_QUESTIONS = [{"id": "aq1", "text": "Anything else?"}]
+
+
+async def create_sqlite_stand_in(db_path: Path):
+    """
+    Create a SQLite stand-in of the datamodel tables, with only the columns read by the async layer.
+    """
+    engine = get_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    async with engine.begin() as conn:
+        for table, rows in [
+            (CONV_PATHS_TABLE, CONV_PATHS),
+            (USER_PROMPTS_TABLE, USER_PROMPTS),
+            (ASSISTANT_ANSWERS_TABLE, ASSISTANT_ANSWERS),
+            (ASSISTANT_QUESTIONS_TABLE, ASSISTANT_QUESTIONS),
+        ]:
+            columns = ", ".join(f"{c.name} TEXT" for c in table.c)
+            await conn.execute(sa.text(f"CREATE TABLE {table.name} ({columns})"))
+            await conn.execute(sa.insert(table), rows)
+    return engine
+
+
+def test_async_extract_matching_candidates_from_source_node(tmp_path):
+    async def run():
+        engine = await create_sqlite_stand_in(tmp_path / "db.sqlite")
+        conv_paths_dict = await async_get_conv_paths_from_source_nodes_dict(
+            engine, [ConvPath(**CONV_PATHS[0])]
+        )
+        candidates = await async_extract_matching_candidates_from_source_node(
+            engine, SOURCE_NODE_ID, conv_paths_dict
+        )
+        await engine.dispose()
+        return candidates
+
+    candidates = asyncio.run(run())
+    assert candidates == {
+        "up": ["I want to cancel", "Where is my order"],
+        "aa": ["Sure.", "It is on its way."],
+        "aq": ["Anything else?", None],
+        "conv_path_id": ["src_up1_aa1_aq1", "src_up2_aa2"],
+    }
+
+
+def test_async_process_call_transcript(tmp_path):
+    messages = [
+        {"role": "ASSISTANT", "text": "Hello"},
+        {"role": "USER", "text": "cancel my order"},
+        # exact matching on an attached user prompt: skipped
+        {"role": "ASSISTANT", "text": "Sure.", "matching": {"distance": 0.0, "conv_path_id": "src_up1_aa1_aq1"}},
+        {"role": "USER", "text": "where's my parcel", "matching": {"distance": 0.2, "conv_path_id": "x", "original": "where is my parcel"}},
+        {"role": "ASSISTANT", "text": "It is on its way.", "matching": {"distance": 0.2, "conv_path_id": "src_up2_aa2"}},
+        # depth 1 matching: ignored
+        {"role": "ASSISTANT", "text": "Sure.", "matching": {"distance": 0.1, "conv_path_id": "init_up1_aa1"}},
+    ]
+    call_transcript_path = tmp_path / "call.json"
+    call_transcript_path.write_text(json.dumps(messages), encoding="utf-8")
+    output_dir = tmp_path / "ut_to_conv_path"
+
+    async def run():
+        engine = await create_sqlite_stand_in(tmp_path / "db.sqlite")
+        num_matchings = await async_process_call_transcript(
+            engine, call_transcript_path, output_dir, "en", "assistant", "call"
+        )
+        await engine.dispose()
+        return num_matchings
+
+    assert asyncio.run(run()) == 1
+    matching = json.loads((output_dir / "en/assistant/call/0.json").read_text(encoding="utf-8"))
+    assert matching["user_text"] == "where is my parcel"
+    assert matching["user_text_idx"] == 3
+    assert matching["candidates"]["conv_path_id"] == ["src_up1_aa1_aq1", "src_up2_aa2"]
+    assert (output_dir / "en/assistant/call/conversation.json").exists()
+
+
+def test_async_process_call_transcript_with_candidate_sets(tmp_path):
+    messages = [
+        {"role": "USER", "text": "where is my parcel"},
+        {"role": "ASSISTANT", "text": "It is on its way.", "matching": {"distance": 0.2, "conv_path_id": "src_up2_aa2"}},
+        {"role": "USER", "text": "and my refund"},
+        {"role": "ASSISTANT", "text": "Sure.", "matching": {"distance": 0.3, "conv_path_id": "src_up1_aa1_aq1"}},
+    ]
+    call_transcript_path = tmp_path / "call.json"
+    call_transcript_path.write_text(json.dumps(messages), encoding="utf-8")
+    output_dir = tmp_path / "ut_to_conv_path"
+
+    async def run():
+        engine = await create_sqlite_stand_in(tmp_path / "db.sqlite")
+        num_matchings = await async_process_call_transcript(
+            engine, call_transcript_path, output_dir, "en", "assistant", "call", candidate_sets=True
+        )
+        await engine.dispose()
+        return num_matchings
+
+    assert asyncio.run(run()) == 2
+    matchings = [
+        json.loads((output_dir / f"en/assistant/call/{i}.json").read_text(encoding="utf-8")) for i in range(2)
+    ]
+    assert all("candidates" not in m and m["source_node_id"] == "src" for m in matchings)
+    candidate_set = json.loads((tmp_path / "candidate_sets/src.json").read_text(encoding="utf-8"))
+    assert candidate_set["conv_path_id"] == ["src_up1_aa1_aq1", "src_up2_aa2"]
@@ -0,0 +1,38 @@
+import sys
+import json
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.dataset import (
+    default_candidate_sets_dir,
+    iter_matching_files,
+    load_candidate_set,
+    read_matching,
+    save_candidate_set,
+)
+
+CANDIDATES = {"up": ["cancel", "track"], "aa": ["Sure.", "On its way."], "aq": [None, None], "conv_path_id": ["a", "b"]}
+
+
+def write_matching(ut_to_conv_path_dir, matching_id, matching):
+    path = ut_to_conv_path_dir / "en" / "assistant" / "call" / f"{matching_id}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(matching), encoding="utf-8")
+
+
+def test_normalized_matchings_resolve_their_candidate_set(tmp_path):
+    ut_to_conv_path_dir = tmp_path / "ut_to_conv_path"
+    candidate_sets_dir = default_candidate_sets_dir(ut_to_conv_path_dir)
+    assert save_candidate_set(candidate_sets_dir, "node1", CANDIDATES)
+    assert not save_candidate_set(candidate_sets_dir, "node1", {"up": []})  # written once
+    assert [p.name for p in candidate_sets_dir.iterdir()] == ["node1.json"]
+
+    base = {"language": "en", "assistant_id": "assistant", "call_id": "call", "user_text_idx": 1}
+    write_matching(ut_to_conv_path_dir, 0, {**base, "user_text": "stop it", "source_node_id": "node1"})
+    write_matching(ut_to_conv_path_dir, 1, {**base, "user_text": "where", "candidates": CANDIDATES})
+    write_matching(ut_to_conv_path_dir, 2, {**base, "user_text": "again", "source_node_id": "node1"})
+
+    matchings = [read_matching(path) for path in iter_matching_files(ut_to_conv_path_dir)]
+    assert [m["user_text"] for m in matchings] == ["stop it", "where", "again"]
+    assert all(m["candidates"] == CANDIDATES for m in matchings)
+    # Loaded once, shared by the matchings of the source node
+    assert matchings[0]["candidates"] is matchings[2]["candidates"] is load_candidate_set(candidate_sets_dir, "node1")
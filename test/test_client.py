@@ -0,0 +1,38 @@
+import sys
+import asyncio
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, "/www/Embedding/src/embedding")
+from client import EmbeddingCache, EmbeddingClient
+from compact import truncate_dimension
+
+DIMENSION = 4
+
+
+@pytest.mark.parametrize("binary, dimension", [(True, None), (False, None), (True, 2), (False, 2)])
+def test_embed_chunks_and_deduplicates(fake_server, binary, dimension):
+    fake_server.binary = binary
+    sentences = [f"sentence {i % 7}" for i in range(20)]
+    with EmbeddingClient(fake_server.url, model_name="LaBSE", chunk_size=3) as client:
+        embeddings = client.embed(sentences, dimension=dimension)
+    expected = np.asarray([fake_server.fake_embedding(s) for s in sentences], dtype=np.float32)
+    if dimension is not None:
+        expected = truncate_dimension(expected, dimension)
+    assert embeddings.shape == (20, dimension or DIMENSION)
+    np.testing.assert_allclose(embeddings, expected, rtol=1e-6)
+    assert sorted(len(chunk) for chunk in fake_server.requested_sentences) == [1, 3, 3]
+
+
+def test_cache_avoids_requests(fake_server, tmp_path):
+    with EmbeddingClient(fake_server.url, model_name="LaBSE", cache=EmbeddingCache(cache_dir=tmp_path)) as client:
+        client.embed(["a", "b"])
+        embeddings = asyncio.run(client.aembed(["b", "c"]))
+    assert fake_server.requested_sentences == [["a", "b"], ["c"]]
+    np.testing.assert_array_equal(embeddings, [fake_server.fake_embedding("b"), fake_server.fake_embedding("c")])
+
+    # The disk cache outlives the client
+    with EmbeddingClient(fake_server.url, model_name="LaBSE", cache=EmbeddingCache(cache_dir=tmp_path)) as client:
+        client.embed(["a", "c"])
+    assert len(fake_server.payloads) == 2
@@ -0,0 +1,34 @@
+import sys
+
+import numpy as np
+
+sys.path.insert(0, "/www/Embedding/src/embedding")
+from compact import decode_compact, encode_compact
+
+
+def random_embeddings(n=4, dimension=64, seed=0):
+    embeddings = np.random.default_rng(seed).standard_normal((n, dimension)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def test_truncation_is_renormalized():
+    embeddings = random_embeddings()
+    decoded = decode_compact(encode_compact(embeddings, dimension=16))
+    assert decoded.shape == (4, 16)
+    np.testing.assert_allclose(np.linalg.norm(decoded, axis=1), 1, rtol=1e-5)
+    np.testing.assert_allclose(decoded, embeddings[:, :16] / np.linalg.norm(embeddings[:, :16], axis=1, keepdims=True), rtol=1e-5)
+
+
+def test_quantized_round_trip():
+    embeddings = random_embeddings()
+    for precision, atol in [("float32", 0), ("float16", 1e-3), ("int8", 1e-2)]:
+        payload = encode_compact(embeddings, precision=precision)
+        np.testing.assert_allclose(decode_compact(payload, dequantize=True), embeddings, atol=atol)
+
+
+def test_binary_packing():
+    embeddings = random_embeddings(dimension=20)
+    payload = encode_compact(embeddings, precision="binary")
+    packed = decode_compact(payload)
+    assert packed.shape == (4, 3) and packed.dtype == np.uint8
+    np.testing.assert_array_equal(decode_compact(payload, dequantize=True), np.where(embeddings > 0, 1, -1))
@@ -0,0 +1,52 @@
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, "/www/Embedding/src/embedding")
+from cpu_profiles import CPUProfile, configure_torch_interop_threads
+
+
+@pytest.fixture
+def tune_cpu_profiles():
+    pytest.importorskip("flask")  # imports the server
+    import tune_cpu_profiles
+
+    return tune_cpu_profiles
+
+
+def test_parse_cores(tune_cpu_profiles):
+    assert tune_cpu_profiles.parse_cores("0-3,8,10-11") == [0, 1, 2, 3, 8, 10, 11]
+    assert tune_cpu_profiles.parse_cores("5") == [5]
+    with pytest.raises(ValueError):
+        tune_cpu_profiles.parse_cores("0-x")
+
+
+def test_candidate_profiles(tune_cpu_profiles):
+    cores = list(range(8))
+    profiles = tune_cpu_profiles.candidate_profiles(cores)
+    assert [(p.mode, p.num_sessions, p.intra_op_threads) for p in profiles] == [
+        ("latency", 1, 8),
+        ("throughput", 2, 4),
+        ("throughput", 4, 2),
+        ("throughput", 8, 1),
+    ]
+    assert all(p.cores == cores for p in profiles)
+    # Sessions never outnumber the cores
+    assert [p.num_sessions for p in tune_cpu_profiles.candidate_profiles([0, 1, 2])] == [1, 2]
+
+
+def test_torch_interop_threads_are_set_once_for_the_widest_profile(monkeypatch):
+    calls = []
+
+    def set_num_interop_threads(num_threads):
+        if calls:
+            raise RuntimeError("Error: cannot set number of interop threads after parallel work has started")
+        calls.append(num_threads)
+
+    monkeypatch.setitem(sys.modules, "torch", types.SimpleNamespace(set_num_interop_threads=set_num_interop_threads))
+    profiles = [CPUProfile(inter_op_threads=2), CPUProfile(mode="throughput", sessions=2, inter_op_threads=4)]
+    assert configure_torch_interop_threads(profiles) == 4
+    assert configure_torch_interop_threads(profiles) is None  # torch refuses to resize the pool
+    assert configure_torch_interop_threads([]) is None
+    assert calls == [4]
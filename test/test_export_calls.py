@@ -0,0 +1,94 @@
+from datetime import datetime
+import sys
+
+import pytest
+import sqlalchemy as sa
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs import save_call_transcripts
+from src.generate_matching_inputs.save_call_transcripts import export_calls, read_watermark
+from src.generate_matching_inputs.transcript_store import FileTranscriptStore, open_transcript_store
+
+ASSISTANT_ID = "assistant"
+# SQLite stand-in of the calls table, with only the columns read by export_calls
+CALLS_TABLE = sa.table(
+    "calls",
+    sa.column("id", sa.String),
+    sa.column("assistant_id", sa.String),
+    sa.column("status", sa.String),
+    sa.column("dt_started", sa.DateTime),
+    sa.column("conversation_transcript", sa.JSON),
+)
+
+
+def call(call_id: str, hour: int, status: str = "completed") -> dict:
+    return {
+        "id": call_id,
+        "assistant_id": ASSISTANT_ID,
+        "status": status,
+        "dt_started": datetime(2025, 1, 1, hour),
+        "conversation_transcript": [{"role": "USER", "text": f"hello from {call_id}"}],
+    }
+
+
+class InterruptedStore(FileTranscriptStore):
+    """
+    Store of which writes fail from a given call on, as when an export is killed.
+    """
+
+    interrupt_at = None
+
+    def write(self, assistant_id, call_id, transcript):
+        if call_id == self.interrupt_at:
+            raise KeyboardInterrupt
+        super().write(assistant_id, call_id, transcript)
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    with engine.begin() as conn:
+        conn.execute(
+            sa.text(
+                "CREATE TABLE calls (id TEXT, assistant_id TEXT, status TEXT, dt_started TIMESTAMP, "
+                "conversation_transcript JSON)"
+            )
+        )
+    monkeypatch.setattr(save_call_transcripts, "Calls", CALLS_TABLE.c)
+    monkeypatch.setattr(save_call_transcripts, "get_engine", lambda: engine)
+    yield engine
+    engine.dispose()
+
+
+def insert_calls(engine, calls: list[dict]):
+    with engine.begin() as conn:
+        conn.execute(sa.insert(CALLS_TABLE), calls)
+
+
+def test_export_resumes_from_the_watermark(tmp_path, engine, monkeypatch):
+    save_to_dir = str(tmp_path / "call_transcripts")
+    # call2 and call3 started at the same time, on both sides of a page boundary
+    insert_calls(
+        engine, [call("call1", 1), call("call2", 2), call("call3", 2), call("call4", 3), call("failed", 3, "failed")]
+    )
+
+    # Interrupted in the second page: the watermark is the last dt_started of the first page
+    monkeypatch.setattr(InterruptedStore, "interrupt_at", "call3")
+    monkeypatch.setattr(save_call_transcripts, "open_transcript_store", lambda *args: InterruptedStore(save_to_dir))
+    with pytest.raises(KeyboardInterrupt):
+        export_calls(ASSISTANT_ID, save_to_dir, page_size=2)
+    assert read_watermark(save_to_dir, ASSISTANT_ID) == datetime(2025, 1, 1, 2)
+    assert open_transcript_store(save_to_dir).call_ids(ASSISTANT_ID) == {"call1", "call2"}
+
+    # Resumed from the watermark, inclusive: call2 is skipped, call3 (same dt_started) is not lost
+    monkeypatch.setattr(InterruptedStore, "interrupt_at", None)
+    assert export_calls(ASSISTANT_ID, save_to_dir, page_size=2) == 2
+    assert read_watermark(save_to_dir, ASSISTANT_ID) == datetime(2025, 1, 1, 3)
+
+    # A later export only writes the new calls
+    insert_calls(engine, [call("call5", 4)])
+    assert export_calls(ASSISTANT_ID, save_to_dir, page_size=2) == 1
+    assert read_watermark(save_to_dir, ASSISTANT_ID) == datetime(2025, 1, 1, 4)
+    store = open_transcript_store(save_to_dir)
+    assert store.call_ids(ASSISTANT_ID) == {"call1", "call2", "call3", "call4", "call5"}
+    assert store.read(ASSISTANT_ID, "call5") == [{"role": "USER", "text": "hello from call5"}]
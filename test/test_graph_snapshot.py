@@ -0,0 +1,46 @@
+import sys
+import json
+import concurrent.futures
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.graph_snapshot import GraphSnapshot, UserPromptRecord, build_graph_snapshot
+
+CONV_PATHS = [
+    {"id": "src_up1_aa1_aq1", "source_node_id": "src", "user_prompt_id": "up1", "assistant_answer_id": "aa1", "target_node_id": "aq1"},
+    {"id": "src_up2_aa2", "source_node_id": "src", "user_prompt_id": "up2", "assistant_answer_id": "aa2", "target_node_id": None},
+    {"id": "other_up3_aa1", "source_node_id": "other", "user_prompt_id": "up3", "assistant_answer_id": "aa1", "target_node_id": None},
+]
+USER_PROMPTS = [
+    {"id": "up1", "text": "I want to cancel", "primary_id": None, "attached_user_prompt_ids": json.dumps(["up1b"])},
+    {"id": "up1b", "text": "Cancel my order", "primary_id": "up1", "attached_user_prompt_ids": []},
+    {"id": "up2", "text": "Où est ma commande ?", "primary_id": None, "attached_user_prompt_ids": None},
+]
+ASSISTANT_ANSWERS = [{"id": "aa1", "text": "Sure."}, {"id": "aa2", "text": "It is on its way."}]
+ASSISTANT_QUESTIONS = [{"id": "aq1", "text": "Anything else?"}]
+
+
+def lookup(path):
+    snapshot = GraphSnapshot(path)
+    return snapshot.conv_paths(["src_up2_aa2", "missing"]), snapshot.texts("user_prompts", ["up2"])
+
+
+def test_graph_snapshot_lookups(tmp_path):
+    path = build_graph_snapshot(tmp_path / "snapshot", CONV_PATHS, USER_PROMPTS, ASSISTANT_ANSWERS, ASSISTANT_QUESTIONS)
+    snapshot = GraphSnapshot(path)
+
+    assert snapshot.conv_paths(["src_up2_aa2", "missing"]) == [CONV_PATHS[1]]
+    assert snapshot.conv_paths_from_source_nodes(["src"]) == CONV_PATHS[:2]  # dump order within a source node
+    assert snapshot.conv_paths_from_source_nodes(["missing"]) == []
+    assert snapshot.texts("assistant_answers", ["aa1", "aa3"]) == {"aa1": "Sure."}
+    assert snapshot.texts("assistant_questions", ["aq1", None]) == {"aq1": "Anything else?"}
+    assert snapshot.user_prompts(["up1", "up1b", "up4"]) == {
+        "up1": UserPromptRecord("up1", "I want to cancel", None, ["up1b"]),
+        "up1b": UserPromptRecord("up1b", "Cancel my order", "up1", []),
+    }
+
+
+def test_graph_snapshot_is_attached_by_worker_processes(tmp_path):
+    path = build_graph_snapshot(tmp_path / "snapshot", CONV_PATHS, USER_PROMPTS, ASSISTANT_ANSWERS, ASSISTANT_QUESTIONS)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(lookup, [path] * 4))
+    assert all(result == ([CONV_PATHS[1]], {"up2": "Où est ma commande ?"}) for result in results)
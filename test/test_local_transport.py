@@ -0,0 +1,45 @@
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, "/www/Embedding/src/embedding")
+from local_transport import (
+    LocalTransportError,
+    UnixSocketTransport,
+    decode_request,
+    encode_request,
+    serve_unix_socket,
+)
+
+
+class NotServed(Exception):
+    status_code = 429
+    retry_after = 2
+
+
+def handle(model_name, sentences, max_tokens):
+    if model_name == "busy":
+        raise NotServed("Too many pending requests")
+    return np.asarray([[len(s), max_tokens or 0, len(model_name)] for s in sentences], dtype=np.float32)
+
+
+def test_request_roundtrip():
+    sentences = ["Hello", "", "Sí, ¿dígame?"]
+    assert decode_request(encode_request("LaBSE", sentences, 64)) == ("LaBSE", sentences, 64)
+    assert decode_request(encode_request("LaBSE", sentences)) == ("LaBSE", sentences, None)
+
+
+def test_unix_socket_server(tmp_path):
+    server = serve_unix_socket(str(tmp_path / "embedding.sock"), handle)
+    transport = UnixSocketTransport(str(tmp_path / "embedding.sock"))
+    try:
+        for _ in range(2):  # requests share the connection
+            embeddings = transport.embed(["ab", "abcd"], "LaBSE", max_tokens=8)
+            np.testing.assert_array_equal(embeddings, [[2, 8, 5], [4, 8, 5]])
+        with pytest.raises(LocalTransportError) as e:
+            transport.embed(["ab"], "busy")
+        assert e.value.status_code == 429 and e.value.retry_after == 2
+    finally:
+        transport.close()
+        server.shutdown()
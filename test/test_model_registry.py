@@ -0,0 +1,97 @@
+import sys
+import json
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, "/www/Embedding/src/embedding")
+from model_registry import MODEL_REGISTRY_PATH, ModelSpec, load_registry, model_names_by_backend
+
+
+def test_shipped_registry_is_valid():
+    specs = load_registry(MODEL_REGISTRY_PATH)
+    assert specs
+    assert sum(len(names) for names in model_names_by_backend(specs).values()) == len(specs)
+
+
+def test_registry_specs(tmp_path):
+    registry_path = tmp_path / "model_registry.json"
+    registry_path.write_text(
+        json.dumps(
+            {
+                "LaBSE": {"backend": "sentence_transformer"},
+                "gte": {
+                    "backend": "huggingface",
+                    "onnx_file": "model_quantized.onnx",
+                    "pooling": "cls",
+                    "cpu_profile": {"mode": "throughput", "sessions": 2, "intra_op_threads": 2},
+                },
+            }
+        )
+    )
+    specs = load_registry(str(registry_path))
+    assert specs["LaBSE"].max_tokens == 128 and specs["LaBSE"].cpu_profile is None
+    assert specs["gte"].cpu_profile.num_sessions == 2
+    assert model_names_by_backend(specs)["huggingface"] == ["gte"]
+
+
+def test_invalid_registry_is_rejected(tmp_path):
+    registry_path = tmp_path / "model_registry.json"
+    registry_path.write_text(json.dumps({"LaBSE": {"backend": "tensorflow"}}))
+    with pytest.raises(ValueError):
+        load_registry(str(registry_path))
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    pytest.importorskip("flask")
+    import server_embedding
+
+    for name in ("model_dict", "model_status", "served_specs", "model_runners"):
+        monkeypatch.setattr(server_embedding, name, {})
+    monkeypatch.setattr(server_embedding, "model_specs", {"LaBSE": ModelSpec(backend="sentence_transformer")})
+    monkeypatch.setattr(server_embedding, "get_cpu_profile", lambda model_name, spec: None)
+    monkeypatch.setattr(server_embedding, "create_model_runner", lambda *args: None)
+    return server_embedding
+
+
+@pytest.mark.parametrize(
+    "reloaded_max_tokens",
+    [
+        [128],  # unchanged: fresh spec objects of the same value
+        [256, 128],  # changed, then changed back
+        [256],  # changed: the first load is discarded, the new spec is loaded
+    ],
+)
+def test_reload_during_a_slow_load(server, monkeypatch, reloaded_max_tokens):
+    release = threading.Event()
+    loaded_specs = []
+
+    def slow_load_model(model_name, warmup, cpu_profile, spec):
+        if not loaded_specs:
+            release.wait()
+        loaded_specs.append(spec)
+        return f"{model_name} with max_tokens={spec.max_tokens}"
+
+    monkeypatch.setattr(server, "load_model", slow_load_model)
+    server.load_models_in_background(["LaBSE"])
+    assert server.model_status["LaBSE"] == "loading"
+    for max_tokens in reloaded_max_tokens:
+        monkeypatch.setattr(
+            server, "load_registry", lambda: {"LaBSE": ModelSpec(backend="sentence_transformer", max_tokens=max_tokens)}
+        )
+        server.reload_registry()
+    release.set()
+
+    expected = f"LaBSE with max_tokens={reloaded_max_tokens[-1]}"
+    wait_for(lambda: server.model_dict.get("LaBSE") == expected and server.model_status["LaBSE"] == "ready")
+    assert server.served_specs["LaBSE"] == server.model_specs["LaBSE"]
+    assert len(loaded_specs) == (2 if reloaded_max_tokens == [256] else 1)
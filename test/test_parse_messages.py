@@ -0,0 +1,27 @@
+import sys
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.utils import parse_messages
+
+
+def test_parse_messages():
+    messages = [
+        {"role": "ASSISTANT", "text": "Hello", "matching": {"distance": 0.0, "conv_path_id": "init"}},
+        {"role": "USER", "text": "hi"},
+        {"role": "ASSISTANT", "text": "How can I help?", "matching": {"distance": 0.3, "conv_path_id": "a"}},
+        # incomplete matchings are ignored
+        {"role": "ASSISTANT", "text": "Sure.", "matching": {"conv_path_id": "b"}},
+        {"role": "ASSISTANT", "text": "Sure.", "matching": {"distance": 0.1}},
+        {"role": "ASSISTANT", "text": "Sure.", "matching": None},
+        {"role": "USER", "text": "yes", "matching": {"distance": "0.5", "conv_path_id": "c", "original": "yes!"}},
+        {"role": "ASSISTANT", "text": "Done.", "matching": {"distance": 1, "conv_path_id": "a"}},
+    ]
+    conversation, matched_messages = parse_messages(messages)
+
+    assert conversation == [{"role": m["role"], "text": m["text"]} for m in messages]
+    assert [(m.idx, m.user_text_idx, m.conv_path_id, m.distance) for m in matched_messages] == [
+        (0, -1, "init", 0.0),
+        (2, 1, "a", 0.3),
+        (6, 6, "c", 0.5),
+        (7, 6, "a", 1.0),
+    ]
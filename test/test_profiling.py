@@ -0,0 +1,77 @@
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, "/www/Embedding/src/embedding")
+from profiling import ProfilingSession
+
+
+def test_stack_profile_writes_folded_stacks(tmp_path):
+    session = ProfilingSession("stack", duration_s=10, interval_ms=1, output_dir=str(tmp_path))
+    start = time.monotonic()
+    while time.monotonic() - start < 0.2:
+        sum(range(1000))
+    session.stop()
+    assert not session.wants("LaBSE")
+    lines = (session.dir / "stacks.folded").read_text().splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("test_stack_profile_writes_folded_stacks" in line for line in lines)
+    assert session.status()["files"] == [f"{session.id}/stacks.folded"]
+
+
+def test_invalid_profiles_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ProfilingSession("torch", output_dir=str(tmp_path))  # no model_name
+    with pytest.raises(ValueError):
+        ProfilingSession("stack", duration_s=3600, output_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        ProfilingSession("perf", output_dir=str(tmp_path))
+
+
+class FakeORTSession:
+    def __init__(self):
+        self.profiling_ended = False
+
+    def end_profiling(self):
+        self.profiling_ended = True
+
+
+class FakeHFONNXModel:
+    def __init__(self):
+        self.model = type("ORTModel", (), {"session": FakeORTSession()})()
+
+
+def test_stopped_profile_releases_its_model_and_stops_sampling(tmp_path):
+    profiled_model = FakeHFONNXModel()
+    stopped = []
+    session = ProfilingSession(
+        "onnxruntime",
+        model_name="gte",
+        sample_rate=1,
+        output_dir=str(tmp_path),
+        load_profiled_model=lambda model_name, prefix: profiled_model,
+        on_stop=stopped.append,
+    )
+    deadline = time.monotonic() + 5
+    while not session.wants("gte"):  # the profiled copy loads in the background
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert session.profile_request({"gte": "served"}, lambda models: models["gte"]) is profiled_model
+
+    session.stop()
+    assert stopped == [session]
+    assert profiled_model.model.session.profiling_ended
+    assert not session.wants("gte")
+    # A request sampled just before the stop is served by the served model
+    assert session.profile_request({"gte": "served"}, lambda models: models["gte"]) == "served"
+    assert session.status()["profiled_requests"] == 1
+
+
+def test_overlapping_torch_profiles_are_served_unprofiled(tmp_path):
+    session = ProfilingSession("torch", model_name="LaBSE", sample_rate=1, output_dir=str(tmp_path))
+    assert session.wants("LaBSE") and not session.wants("gte")
+    with session._torch_lock:  # another request is being profiled
+        assert session.profile_request({"LaBSE": "served"}, lambda models: models["LaBSE"]) == "served"
+    session.stop()
+    assert session.status()["profiled_requests"] == 0
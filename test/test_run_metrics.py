@@ -0,0 +1,44 @@
+import sys
+import json
+import concurrent.futures
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.run_metrics import ProgressReporter, RunMetrics, metrics, run_with_metrics
+
+
+def process(num_files):
+    with metrics.timer("db.user_prompts"):
+        metrics.count("files_written", num_files)
+    return num_files
+
+
+def test_worker_metrics_are_merged_into_the_report():
+    metrics.drain()
+    metrics.count("files_written", 100)  # left in the parent before the pool forks: not counted by the workers
+    parent = RunMetrics()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(run_with_metrics, process, n) for n in (1, 2, 3)]
+        for future in concurrent.futures.as_completed(futures):
+            result, task_metrics = future.result()
+            parent.merge(task_metrics)
+    metrics.drain()
+
+    report = parent.report(1.5)
+    json.dumps(report)
+    assert report["seconds"] == 1.5
+    assert report["counters"] == {"files_written": 6}
+    assert report["timers"]["db.user_prompts"]["count"] == 3
+    assert parent.drain()["counters"] == {"files_written": 6}
+    assert parent.report(0.0) == {"seconds": 0.0, "counters": {}, "timers": {}}
+
+
+def test_progress_reporter_logs_throughput_and_eta(caplog):
+    caplog.set_level("INFO")
+    progress = ProgressReporter("Extracted", "transcripts", interval=3600)
+    progress.update(10, 20)
+    assert not caplog.records  # within the interval
+    progress.update(10, 40, total_known=False, force=True)
+    progress.update(40, 40, force=True)
+    first, last = (record.getMessage() for record in caplog.records)
+    assert first.startswith("Extracted: 10/40 transcripts (25.0%)") and first.endswith("ETA enumerating")
+    assert last.startswith("Extracted: 40/40 transcripts (100.0%)") and last.endswith("ETA 0m00s")
@@ -0,0 +1,220 @@
+import sys
+import time
+import threading
+import concurrent.futures
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, "/www/Embedding/src/embedding")
+
+
+@pytest.fixture
+def server(monkeypatch):
+    pytest.importorskip("flask")
+    import server_embedding
+
+    monkeypatch.setattr(server_embedding, "inflight_embeddings", InflightEmbeddings())
+    return server_embedding
+
+
+class InflightEmbeddings(dict):
+    # Counts the lookups, to know when a request has registered its futures
+    lookups = 0
+
+    def get(self, key, default=None):
+        self.lookups += 1
+        return super().get(key, default)
+
+
+class BlockingComputation:
+    """
+    Stand-in for `compute_embeddings` that blocks until released, then embeds or fails.
+    """
+
+    def __init__(self, error: Exception | None = None):
+        self.error = error
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, sentences, model_dict, model_name, max_tokens=None):
+        self.calls.append(list(sentences))
+        self.started.set()
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return np.array([[len(sentence), 1.0] for sentence in sentences], dtype=np.float32)
+
+
+def coalesce_two_requests(server, computation):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(server.compute_embeddings_coalesced, ["a", "bb"], {}, "LaBSE")
+        assert computation.started.wait(5)
+        second = executor.submit(server.compute_embeddings_coalesced, ["bb", "a", "bb"], {}, "LaBSE")
+        # The second request (2 unique sentences) awaits the futures of the first one before they resolve
+        deadline = time.monotonic() + 5
+        while server.inflight_embeddings.lookups < 4:
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+        computation.release.set()
+        return first, second
+
+
+def test_concurrent_requests_share_one_computation(server, monkeypatch):
+    computation = BlockingComputation()
+    monkeypatch.setattr(server, "compute_embeddings", computation)
+    first, second = coalesce_two_requests(server, computation)
+
+    np.testing.assert_array_equal(first.result(), [[1, 1], [2, 1]])
+    np.testing.assert_array_equal(second.result(), [[2, 1], [1, 1], [2, 1]])
+    assert computation.calls == [["a", "bb"]]
+    assert server.inflight_embeddings == {}
+
+
+def test_a_failed_computation_fails_every_waiting_request(server, monkeypatch):
+    computation = BlockingComputation(error=RuntimeError("model crashed"))
+    monkeypatch.setattr(server, "compute_embeddings", computation)
+    first, second = coalesce_two_requests(server, computation)
+
+    for future in (first, second):
+        with pytest.raises(RuntimeError, match="model crashed"):
+            future.result()
+    assert computation.calls == [["a", "bb"]]
+    assert server.inflight_embeddings == {}
+
+
+def test_multi_model_requests_fan_out_in_parallel(server, monkeypatch):
+    model_dims = {"LaBSE": 2, "UAE-Large-V1": 3, "gte-large-en-v1.5": 4}
+    served = []
+
+    def serve_embeddings(model_name, sentences, max_tokens, deadline):
+        # Stand-in model: 0.3 s per request, rows tell the sentence and the model apart
+        served.append((model_name, list(sentences)))
+        time.sleep(0.3)
+        return np.array([[len(sentence)] * model_dims[model_name] for sentence in sentences], dtype=np.float32)
+
+    monkeypatch.setattr(server, "serve_embeddings", serve_embeddings)
+    start = time.perf_counter()
+    embeddings = server.serve_embeddings_multi(
+        list(model_dims), ["a", "bbb", "a", "cc", "bbb"], max_tokens=None, deadline=time.monotonic() + 5
+    )
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.6  # 3 models x 0.3 s, in parallel
+    assert list(embeddings) == list(model_dims)
+    # Each model embeds the unique sentences once, and the rows are fanned back to the request order
+    assert sorted(served) == sorted((model_name, ["a", "bbb", "cc"]) for model_name in model_dims)
+    for model_name, dim in model_dims.items():
+        np.testing.assert_array_equal(embeddings[model_name], [[n] * dim for n in (1, 3, 1, 2, 3)])
+
+
+@pytest.fixture
+def fast_tokenizer():
+    # Small fast tokenizer: one token per word or punctuation sign
+    tokenizers = pytest.importorskip("tokenizers")
+    transformers = pytest.importorskip("transformers")
+    words = "one two three four five six seven short sentence , !".split()
+    tokenizer = tokenizers.Tokenizer(
+        tokenizers.models.WordLevel({"[UNK]": 0, **{w: i + 1 for i, w in enumerate(words)}}, unk_token="[UNK]")
+    )
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]")
+
+
+def test_truncation_keeps_the_last_tokens(server, monkeypatch, fast_tokenizer):
+    monkeypatch.setattr(server, "truncation_stats", {})
+    model_dict = {"LaBSE": SimpleNamespace(tokenizer=fast_tokenizer)}
+    sentences, num_tokens = server.truncate_sentences(
+        ["one, two three\nfour five six seven!", "short sentence", "  one two three four  "],
+        model_dict,
+        "LaBSE",
+        max_tokens=4,
+    )
+
+    assert sentences == ["five six seven!", "short sentence", "one two three four"]
+    assert num_tokens == [4, 2, 4]
+    for sentence, n in zip(sentences, num_tokens):
+        assert len(fast_tokenizer(sentence, add_special_tokens=False)["input_ids"]) == n
+    assert server.truncation_stats == {"LaBSE": {"inputs": 3, "truncated": 1, "tokens_total": 10, "tokens_max": 4}}
+    stats = server.app.test_client().get("/truncation_stats").get_json()["LaBSE"]
+    assert stats["truncated_ratio"] == pytest.approx(1 / 3)
+    assert stats["tokens_mean"] == pytest.approx(10 / 3)
+
+
+def test_truncation_falls_back_to_characters_without_a_fast_tokenizer(server, monkeypatch):
+    monkeypatch.setattr(server, "truncation_stats", {})
+    model_dict = {"LaBSE": SimpleNamespace(tokenizer=SimpleNamespace(is_fast=False))}
+    long_sentence = "x" * (server.MAX_LEN_CHARS - 10) + "0123456789end"
+    sentences, num_tokens = server.truncate_sentences([long_sentence, "short"], model_dict, "LaBSE")
+
+    assert sentences == [long_sentence[-server.MAX_LEN_CHARS :], "short"]
+    assert sentences[0].endswith("0123456789end")
+    assert num_tokens == [server.MAX_LEN_CHARS, 5]
+    assert server.truncation_stats["LaBSE"]["truncated"] == 1
+
+
+class WordTokenizer:
+    """
+    Stand-in tokenizer: one token per word (its length), padded with 0 to the longest sentence of the batch.
+    """
+
+    def __call__(self, sentences, return_tensors="np", padding=True, truncation=True, max_length=512):
+        ids = [[len(word) for word in sentence.split()] for sentence in sentences]
+        length = max(map(len, ids))
+        return {
+            "input_ids": np.array([row + [0] * (length - len(row)) for row in ids]),
+            "attention_mask": np.array([[1] * len(row) + [0] * (length - len(row)) for row in ids]),
+        }
+
+
+# Hidden state of each token id; padding tokens get large values, so that a leak into the pooling shows
+TOKEN_STATES = np.vstack([np.full(3, 100.0), np.random.default_rng(0).normal(size=(9, 3))]).astype(np.float32)
+
+
+def onnx_model(input_ids, attention_mask):
+    return SimpleNamespace(last_hidden_state=TOKEN_STATES[input_ids] + attention_mask[..., None] * 0.5)
+
+
+def reference_embedding(sentence: str, pooling: str) -> np.ndarray:
+    # The torch path: masked mean over the tokens of the unpadded sentence (or its first token), L2 normalized
+    states = TOKEN_STATES[[len(word) for word in sentence.split()]] + 0.5
+    embedding = states[0] if pooling == "cls" else states.sum(axis=0) / len(states)
+    return embedding / np.linalg.norm(embedding)
+
+
+@pytest.mark.parametrize("pooling", ["mean", "cls"])
+@pytest.mark.parametrize("batch_size", [2, 3, 8])
+def test_onnx_pooling_matches_the_reference(server, pooling, batch_size):
+    sentences = ["a bb ccc", "dddd", "a a a a a a", "eeeee ffffff", "ggggggg h ii jjj kkkk"]
+    model = server.HFONNXModel(onnx_model, WordTokenizer(), pooling=pooling)
+    embeddings = model.encode(sentences, batch_size=batch_size)
+
+    assert embeddings.shape == (len(sentences), 3) and embeddings.dtype == np.float32
+    np.testing.assert_allclose(embeddings, [reference_embedding(s, pooling) for s in sentences], rtol=1e-5)
+    assert model.encode([]).shape == (0, 0)
+
+
+class SentenceTransformerStandIn:
+    # Rows tell the sentences apart; records the batches it encodes
+    def __init__(self):
+        self.batches = []
+
+    def get_sentence_embedding_dimension(self):
+        return 2
+
+    def encode(self, sentences, batch_size, normalize_embeddings, convert_to_numpy):
+        self.batches.append(list(sentences))
+        return np.array([[len(sentence), ord(sentence[0])] for sentence in sentences], dtype=np.float32)
+
+
+def test_sentence_transformer_batches_fill_the_output_in_request_order(server):
+    pytest.importorskip("torch")
+    model = SentenceTransformerStandIn()
+    sentences = ["ccc", "a", "eeeee", "bb", "dddd"]
+    embeddings = server._compute_embeddings_sentence_transformer(sentences, {"LaBSE": model}, "LaBSE", batch_size=2)
+
+    np.testing.assert_array_equal(embeddings, [[len(s), ord(s[0])] for s in sentences])
+    # Batches of sentences of similar lengths
+    assert model.batches == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
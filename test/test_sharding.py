@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.graph_snapshot import build_graph_snapshot
+from src.generate_matching_inputs.sharding import (
+    in_shard,
+    merge_shards,
+    parse_shard,
+    shard_of,
+    shard_up_to_examples_dir,
+    update_shard_manifest,
+)
+
+ASSISTANT_IDS = [f"assistant{i:04d}" for i in range(200)]
+
+# One shard, as run on its own host: its assistants, and up_to_examples shared by some assistants
+SHARD_SCRIPT = """
+import sys, json
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.sharding import in_shard, shard_up_to_examples_dir, update_shard_manifest
+shard = ({index}, {num_shards})
+assistant_ids = [a for a in {assistant_ids!r} if in_shard(a, shard)]
+out = shard_up_to_examples_dir({up_to_examples_dir!r}, shard)
+out.mkdir(parents=True, exist_ok=True)
+for assistant_id in assistant_ids:
+    conv_path_id = f"node_up{{int(assistant_id[-4:]) % 50}}_aa_aq"
+    (out / f"{{conv_path_id}}.json").write_text(json.dumps({{"conv_path_id": conv_path_id}}))
+update_shard_manifest(
+    {ut_to_conv_path_dir!r}, shard, "extract", assistant_ids=assistant_ids, num_processed=len(assistant_ids)
+)
+"""
+
+# One shard of the real stages, as run on its own host with --shard i/N. The graph is read from a snapshot and the
+# assistant languages are stubbed, so that no DB is needed
+STAGES_SCRIPT = """
+import sys
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs import extract_up_matchings
+extract_up_matchings.get_assistant_languages = lambda assistant_ids: {{a: "en" for a in assistant_ids}}
+shard = ({index}, {num_shards})
+extract_up_matchings.extract_ut_to_conv_path(
+    {ut_to_conv_path_dir!r}, {call_transcripts_dir!r}, max_workers=2, shard=shard, graph_snapshot_dir={snapshot!r}
+)
+extract_up_matchings.etract_up_to_examples(
+    {up_to_examples_dir!r}, {ut_to_conv_path_dir!r}, shard=shard, graph_snapshot_dir={snapshot!r}
+)
+"""
+NUM_SOURCE_NODES = 5
+
+
+def conv_path_id(assistant_id: str) -> str:
+    # Depth 2 conv path, source_up_aa_aq, matched in the calls of the assistant
+    k = int(assistant_id[-4:]) % NUM_SOURCE_NODES
+    return f"node{k}_up{k}_aa{k}_aq{k}"
+
+
+def test_shards_are_stable_and_disjoint():
+    assert parse_shard("2/4") == (2, 4)
+    for invalid in ("4/4", "1", "a/b", "-1/2"):
+        with pytest.raises(ValueError):
+            parse_shard(invalid)
+
+    shards = [[a for a in ASSISTANT_IDS if in_shard(a, (i, 4))] for i in range(4)]
+    assert sorted(sum(shards, [])) == ASSISTANT_IDS
+    assert all(len(shard) > 20 for shard in shards)
+
+    # Same assignment in another process, whatever its hash seed
+    code = "import sys; sys.path.insert(0, '/www/Embedding')\n"
+    code += "from src.generate_matching_inputs.sharding import shard_of\n"
+    code += f"print([shard_of(a, 4) for a in {ASSISTANT_IDS!r}])"
+    env = {**os.environ, "PYTHONHASHSEED": "123"}
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    assert json.loads(output.stdout) == [shard_of(a, 4) for a in ASSISTANT_IDS]
+
+
+def test_merge_shards_run_as_separate_processes(tmp_path):
+    ut_to_conv_path_dir = str(tmp_path / "ut_to_conv_path")
+    up_to_examples_dir = str(tmp_path / "up_to_examples")
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                SHARD_SCRIPT.format(
+                    index=index,
+                    num_shards=3,
+                    assistant_ids=ASSISTANT_IDS,
+                    up_to_examples_dir=up_to_examples_dir,
+                    ut_to_conv_path_dir=ut_to_conv_path_dir,
+                ),
+            ]
+        )
+        for index in range(3)
+    ]
+    assert all(process.wait() == 0 for process in processes)
+
+    manifest = merge_shards(ut_to_conv_path_dir, up_to_examples_dir, 3)
+    assert manifest["num_assistants"] == manifest["num_processed"] == len(ASSISTANT_IDS)
+    assert sorted(p.name for p in Path(up_to_examples_dir).iterdir()) == sorted(
+        {f"node_up{i}_aa_aq.json" for i in range(50)}
+    )
+    assert manifest["num_up_to_examples_merged"] == 50
+    assert manifest["num_up_to_examples_merged"] + manifest["num_up_to_examples_duplicates"] == sum(
+        len({int(a[-4:]) % 50 for a in ASSISTANT_IDS if in_shard(a, (i, 3))}) for i in range(3)
+    )
+    assert not any(list(shard_up_to_examples_dir(up_to_examples_dir, (i, 3)).glob("*.json")) for i in range(3))
+    assert (Path(f"{ut_to_conv_path_dir}_manifests") / "manifest.json").exists()
+
+
+def test_merge_rejects_missing_failed_or_overlapping_shards(tmp_path):
+    ut_to_conv_path_dir = tmp_path / "ut_to_conv_path"
+    update_shard_manifest(ut_to_conv_path_dir, (0, 2), "extract", assistant_ids=["a", "b"], num_processed=2)
+    with pytest.raises(ValueError, match="Missing manifest"):
+        merge_shards(ut_to_conv_path_dir, tmp_path / "up_to_examples", 2)
+    update_shard_manifest(
+        ut_to_conv_path_dir, (1, 2), "extract", assistant_ids=["c"], num_processed=0, num_failed_chunks=1
+    )
+    with pytest.raises(ValueError, match="Shard 1/2 failed on 1 chunks"):
+        merge_shards(ut_to_conv_path_dir, tmp_path / "up_to_examples", 2)
+    update_shard_manifest(ut_to_conv_path_dir, (1, 2), "extract", assistant_ids=["b"], num_processed=1)
+    with pytest.raises(ValueError, match="Assistant b"):
+        merge_shards(ut_to_conv_path_dir, tmp_path / "up_to_examples", 2)
+
+
+def test_extraction_stages_run_as_separate_shard_processes(tmp_path):
+    pytest.importorskip("src.generate_matching_inputs.extract_up_matchings")  # needs the datamodel packages
+    call_transcripts_dir = tmp_path / "call_transcripts"
+    ut_to_conv_path_dir = str(tmp_path / "ut_to_conv_path")
+    up_to_examples_dir = str(tmp_path / "up_to_examples")
+    assistant_ids = ASSISTANT_IDS[:12]
+    for assistant_id in assistant_ids:
+        for call_id in ("call1", "call2"):
+            matching = {"conv_path_id": conv_path_id(assistant_id), "distance": 0.4}  # not an exact matching
+            transcript = [
+                {"role": "USER", "text": f"question of {assistant_id} in {call_id}"},
+                {"role": "ASSISTANT", "text": "Sure.", "matching": matching},
+            ]
+            (call_transcripts_dir / assistant_id).mkdir(parents=True, exist_ok=True)
+            (call_transcripts_dir / assistant_id / f"{call_id}.json").write_text(json.dumps(transcript))
+    snapshot = build_graph_snapshot(
+        tmp_path / "snapshot",
+        [
+            {
+                "id": f"node{k}_up{k}_aa{k}_aq{k}",
+                "source_node_id": f"node{k}",
+                "user_prompt_id": f"up{k}",
+                "assistant_answer_id": f"aa{k}",
+                "target_node_id": f"aq{k}",
+            }
+            for k in range(NUM_SOURCE_NODES)
+        ],
+        [
+            {"id": f"up{k}", "text": f"prompt {k}", "primary_id": None, "attached_user_prompt_ids": []}
+            for k in range(NUM_SOURCE_NODES)
+        ],
+        [{"id": f"aa{k}", "text": f"answer {k}"} for k in range(NUM_SOURCE_NODES)],
+        [{"id": f"aq{k}", "text": f"question {k}"} for k in range(NUM_SOURCE_NODES)],
+    )
+
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                STAGES_SCRIPT.format(
+                    index=index,
+                    num_shards=3,
+                    call_transcripts_dir=str(call_transcripts_dir),
+                    ut_to_conv_path_dir=ut_to_conv_path_dir,
+                    up_to_examples_dir=up_to_examples_dir,
+                    snapshot=str(snapshot),
+                ),
+            ]
+        )
+        for index in range(3)
+    ]
+    assert all(process.wait() == 0 for process in processes)
+
+    # Every shard saw the matchings of its own assistants only, although they share ut_to_conv_path
+    shard_manifests = [
+        json.loads((Path(f"{ut_to_conv_path_dir}_manifests") / f"shard-{i}-of-3.json").read_text()) for i in range(3)
+    ]
+    num_matching_files = sum(manifest["up_to_examples"]["num_matching_files"] for manifest in shard_manifests)
+    assert num_matching_files == 2 * len(assistant_ids)
+    for i, manifest in enumerate(shard_manifests):
+        shard_assistant_ids = [a for a in assistant_ids if in_shard(a, (i, 3))]
+        assert sorted(manifest["extract"]["assistant_ids"]) == shard_assistant_ids
+        assert manifest["extract"]["num_processed"] == 2 * len(shard_assistant_ids)
+        assert manifest["extract"]["num_failed_chunks"] == 0
+
+    manifest = merge_shards(ut_to_conv_path_dir, up_to_examples_dir, 3)
+    assert manifest["num_processed"] == 2 * len(assistant_ids)
+    assert sorted(path.name for path in Path(up_to_examples_dir).iterdir()) == sorted(
+        {f"{conv_path_id(assistant_id)}.json" for assistant_id in assistant_ids}
+    )
+
+
+def test_enumeration_errors_fail_the_shard(tmp_path, monkeypatch):
+    extract_up_matchings = pytest.importorskip("src.generate_matching_inputs.extract_up_matchings")
+    (tmp_path / "call_transcripts" / "assistant").mkdir(parents=True)
+    (tmp_path / "call_transcripts" / "assistant" / "call.json").write_text("[]")
+
+    def get_assistant_languages(assistant_ids):
+        raise RuntimeError("DB unreachable")
+
+    monkeypatch.setattr(extract_up_matchings, "get_assistant_languages", get_assistant_languages)
+    with pytest.raises(RuntimeError, match="DB unreachable"):
+        extract_up_matchings.extract_ut_to_conv_path(
+            str(tmp_path / "ut_to_conv_path"), str(tmp_path / "call_transcripts"), max_workers=1, shard=(0, 1)
+        )
+    # Nor does the shard look complete to merge_shards
+    assert not (tmp_path / "ut_to_conv_path_manifests").exists()
@@ -0,0 +1,32 @@
+import sys
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, "/www/Embedding/src/embedding")
+
+TEI_RECORDINGS_DIR = Path("/www/files/test/tei_recordings")
+RECORDINGS = sorted(TEI_RECORDINGS_DIR.glob("*.json")) if TEI_RECORDINGS_DIR.is_dir() else []
+
+
+@pytest.mark.skipif(not RECORDINGS, reason="No TEI recordings, see record_tei_outputs.py")
+@pytest.mark.parametrize("recording_path", RECORDINGS, ids=lambda path: path.stem)
+def test_inprocess_backend_matches_tei(recording_path, monkeypatch):
+    pytest.importorskip("sentence_transformers")
+    monkeypatch.chdir("/www/Embedding")  # model_zoo/ is relative to the repository root
+    from server_embedding import _compute_embeddings_tei_inprocess, _load_model_sentence_transformer
+
+    recording = json.loads(recording_path.read_text(encoding="utf-8"))
+    model_name = recording["model_name"]
+    model_dict = {model_name: _load_model_sentence_transformer(model_name, warmup=False)}
+    embeddings = np.asarray(
+        _compute_embeddings_tei_inprocess(recording["sentences"], model_dict, model_name, batch_size=32)
+    )
+    expected = np.asarray(recording["embeddings"])
+
+    assert embeddings.shape == expected.shape
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1, rtol=1e-4)
+    # Same pooling and normalization: same vectors, up to float noise
+    np.testing.assert_array_less(1 - np.sum(embeddings * expected, axis=1), 1e-3)
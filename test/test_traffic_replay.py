@@ -0,0 +1,37 @@
+import sys
+
+import pytest
+
+sys.path.insert(0, "/www/Embedding/src/embedding")
+from traffic_capture import TrafficCapture, load_capture
+from replay_traffic import Replayer, replay_max_rate, replay_timed, report, synthetic_sentence
+
+
+@pytest.fixture
+def capture_path(tmp_path):
+    capture = TrafficCapture(str(tmp_path / "capture.jsonl"), sample_rate=1.0)
+    capture.record({"sentences": ["Hello", "world!"], "model_name": "LaBSE"}, False, 200, 100.0, 0.02)
+    capture.record({"sentences": ["Bonjour"], "model_name": "unknown"}, True, 404, 100.2, 0.001)
+    capture.record({"sentences": ["a b c"], "model_name": "LaBSE", "max_tokens": 8}, False, 200, 100.1, 0.01)
+    capture.close()
+    return str(tmp_path / "capture.jsonl")
+
+
+def test_capture_records_shapes_without_texts(capture_path):
+    entries = load_capture(capture_path)
+    assert [entry["ts"] for entry in entries] == [100.0, 100.1, 100.2]
+    assert entries[0]["text_lengths"] == [5, 6] and "sentences" not in entries[0]
+    assert entries[1]["max_tokens"] == 8 and entries[2]["format"] == "binary"
+    assert synthetic_sentence(40, 7) != synthetic_sentence(40, 8) and len(synthetic_sentence(40, 7)) == 40
+
+
+def test_replay_reports_latencies_and_errors(capture_path, fake_server):
+    entries = load_capture(capture_path)
+    timed_results = replay_timed(Replayer(fake_server.url), entries, speed=10.0, max_workers=4)
+    for results in (timed_results, replay_max_rate(Replayer(fake_server.url), entries, concurrency=2)):
+        result = report(results, 1.0)
+        assert result["overall"]["requests"] == 3 and result["overall"]["errors"] == {"404": 1}
+        assert result["models"]["LaBSE"]["p50_ms"] > 0 and result["models"]["LaBSE"]["captured_p50_ms"] == 15.0
+    replayed = [payload for payload in fake_server.payloads if payload["model_name"] == "LaBSE"]
+    assert sorted(len(s) for payload in replayed for s in payload["sentences"]) == [5, 5, 5, 5, 6, 6]
+    assert any(payload.get("max_tokens") == 8 for payload in replayed)
@@ -0,0 +1,82 @@
+import json
+import sys
+
+import pytest
+
+sys.path.insert(0, "/www/Embedding")
+from src.generate_matching_inputs.transcript_store import (
+    FileTranscriptStore,
+    PackedTranscriptStore,
+    TranscriptStore,
+    open_transcript_store,
+)
+from src.generate_matching_inputs.migrate_transcripts import migrate_transcripts
+
+TRANSCRIPTS = {
+    "assistant_a": {
+        "call_1": [{"role": "USER", "text": "¿Hola?"}, {"role": "ASSISTANT", "text": "Bonjour §"}],
+        "call_2": [{"role": "USER", "text": "yes"}],
+    },
+    "assistant_b": {"call_3": [{"role": "ASSISTANT", "text": "Hello", "matching": {"distance": 0.1, "conv_path_id": "x"}}]},
+}
+
+
+def write_all(store):
+    for assistant_id, calls in TRANSCRIPTS.items():
+        for call_id, transcript in calls.items():
+            store.write(assistant_id, call_id, transcript)
+
+
+def check_all(store):
+    assert sorted(store.assistant_ids()) == sorted(TRANSCRIPTS)
+    for assistant_id, calls in TRANSCRIPTS.items():
+        assert store.call_ids(assistant_id) == set(calls)
+        for call_id, transcript in calls.items():
+            assert store.contains(assistant_id, call_id)
+            assert store.read(assistant_id, call_id) == transcript
+    assert not store.contains("assistant_a", "call_3")
+
+
+@pytest.mark.parametrize("layout", ["files", "packed"])
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_transcript_store_round_trip(tmp_path, layout, compression):
+    write_all(open_transcript_store(tmp_path, layout, compression))
+    # Reopening a packed store picks up its recorded compression
+    store = open_transcript_store(tmp_path)
+    assert isinstance(store, PackedTranscriptStore if layout == "packed" else FileTranscriptStore)
+    check_all(store)
+
+
+def test_legacy_tree_is_readable(tmp_path):
+    # Legacy layout: indented JSON, one file per call, mixed with newly compressed files
+    (tmp_path / "assistant_a").mkdir()
+    (tmp_path / "assistant_a/call_1.json").write_text(json.dumps(TRANSCRIPTS["assistant_a"]["call_1"], indent=2))
+    store = open_transcript_store(tmp_path, compression="gzip")
+    store.write("assistant_a", "call_2", TRANSCRIPTS["assistant_a"]["call_2"])
+    store.write("assistant_b", "call_3", TRANSCRIPTS["assistant_b"]["call_3"])
+    assert (tmp_path / "assistant_a/call_2.json.gz").exists()
+    check_all(store)
+
+
+def test_migrate_transcripts(tmp_path):
+    src_dir, dst_dir = tmp_path / "src", tmp_path / "dst"
+    write_all(open_transcript_store(src_dir))
+    assert migrate_transcripts(str(src_dir), str(dst_dir), "packed", "gzip", max_workers=2) == 3
+    check_all(open_transcript_store(dst_dir))
+    # Already migrated calls are skipped
+    assert migrate_transcripts(str(src_dir), str(dst_dir), "packed", "gzip", max_workers=2) == 0
+
+
+def test_incomplete_store_fails_when_created(tmp_path):
+    class ReadOnlyStore(TranscriptStore):
+        def assistant_ids(self):
+            return []
+
+        def call_ids(self, assistant_id):
+            return set()
+
+        def read(self, assistant_id, call_id):
+            return []
+
+    with pytest.raises(TypeError, match="write"):
+        ReadOnlyStore(tmp_path)